@@ -1,20 +1,33 @@
+import array
+import bisect
 import json
+import mmap
+import struct
+import sys
+from collections.abc import Mapping as MappingABC
 from typing import *
 
 
 class MeasuringResults:
     def __init__(self, build_times: Mapping[str, int], immediate_deps: Mapping[str, Set[str]],
-                 object_files: Mapping[str, str]):
+                 object_files: Mapping[str, str], peak_memory: Optional[Mapping[str, int]] = None):
         self.build_times = build_times
         self.immediate_deps = immediate_deps
         self.object_files = object_files
+        self.peak_memory = peak_memory  # measured peak RSS of TU compilations in bytes, if recorded
 
     def to_json(self) -> str:
-        return json.dumps({
+        data = {
             'build_times': {p: d for p, d in self.build_times.items()},
             'immediate_deps': {p: sorted(list(d)) for p, d in self.immediate_deps.items()},
             'object_files': self.object_files
-        }, indent=2)
+        }
+        if self.peak_memory is not None:
+            data['peak_memory'] = {p: m for p, m in self.peak_memory.items()}
+        return json.dumps(data, indent=2)
+
+    def to_binary(self) -> bytes:
+        return encode_binary(self)
 
 
 def from_json(json_text: str) -> MeasuringResults:
@@ -22,4 +35,185 @@ def from_json(json_text: str) -> MeasuringResults:
     build_times = {cpp: t for cpp, t in data['build_times'].items()}
     immediate_deps = {path: deps for path, deps in data['immediate_deps'].items()}
     object_files = {cpp: obj for cpp, obj in data['object_files'].items()}
-    return MeasuringResults(build_times, immediate_deps, object_files)
+    peak_memory = data.get('peak_memory')
+    return MeasuringResults(build_times, immediate_deps, object_files, peak_memory)
+
+
+# Binary format: a sorted table of all paths (nodes and object files) followed by fixed-width per-path arrays and
+# CSR adjacency lists referencing paths by index. Every section is 8-byte aligned, so the file is usable straight
+# from mmap without parsing, and paths are looked up by binary search.
+#
+#   header | string offsets u64[n+1] | flags u8[n] | build times i64[n] | object file index i64[n] |
+#   deps offsets u64[n+1] | deps u32[edges] | utf-8 string blob | peak memory i64[n] (if any node has HAS_MEMORY)
+#
+# Version 1 files are the same without the peak memory section.
+BINARY_MAGIC = b'MRES'
+BINARY_VERSION = 2
+BINARY_HEADER = struct.Struct('<4sIQQQ')  # magic, version, path count, edge count, blob size
+
+HAS_TIME = 1
+HAS_DEPS = 2
+HAS_OBJECT = 4
+HAS_MEMORY = 8
+
+
+def _aligned(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def _pack(typecode: str, values: Iterable[int]) -> bytes:
+    a = array.array(typecode, values)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    data = a.tobytes()
+    return data + b'\0' * (_aligned(len(data)) - len(data))
+
+
+def encode_binary(m: MeasuringResults) -> bytes:
+    paths = set(m.build_times) | set(m.immediate_deps) | set(m.object_files) | set(m.object_files.values())
+    for deps in m.immediate_deps.values():
+        paths.update(deps)
+    peak_memory = m.peak_memory or {}
+    paths.update(peak_memory)
+    encoded = sorted(p.encode() for p in paths)
+    paths = [p.decode() for p in encoded]
+    index = {p: i for i, p in enumerate(paths)}
+
+    string_offsets = [0]
+    for p in encoded:
+        string_offsets.append(string_offsets[-1] + len(p))
+
+    flags = bytearray(len(paths))
+    build_times = [0] * len(paths)
+    object_index = [-1] * len(paths)
+    memory = [0] * len(paths)
+    deps_offsets = [0]
+    deps = []
+    for i, p in enumerate(paths):
+        if p in m.build_times:
+            flags[i] |= HAS_TIME
+            build_times[i] = m.build_times[p]
+        if p in m.object_files:
+            flags[i] |= HAS_OBJECT
+            object_index[i] = index[m.object_files[p]]
+        if p in peak_memory:
+            flags[i] |= HAS_MEMORY
+            memory[i] = peak_memory[p]
+        node_deps = m.immediate_deps.get(p)
+        if node_deps is not None:
+            flags[i] |= HAS_DEPS
+            deps.extend(sorted(index[d] for d in node_deps))
+        deps_offsets.append(len(deps))
+
+    blob = b''.join(encoded)
+    return b''.join([
+        BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(paths), len(deps), len(blob)),
+        _pack('Q', string_offsets),
+        bytes(flags) + b'\0' * (_aligned(len(flags)) - len(flags)),
+        _pack('q', build_times),
+        _pack('q', object_index),
+        _pack('Q', deps_offsets),
+        _pack('I', deps),
+        blob + b'\0' * (_aligned(len(blob)) - len(blob)) if peak_memory else blob,
+        _pack('q', memory) if peak_memory else b''])
+
+
+class _PathsView(MappingABC):
+    # lazy read-only mapping over the paths having a given flag
+    def __init__(self, results: 'BinaryMeasuringResults', flag: int, value: Callable[[int], Any]):
+        self.results = results
+        self.flag = flag
+        self.value = value
+        self.count = None
+
+    def __getitem__(self, path: str):
+        i = self.results.find(path)
+        if i is None or not self.results.flags[i] & self.flag:
+            raise KeyError(path)
+        return self.value(i)
+
+    def __iter__(self):
+        flags = self.results.flags
+        return (self.results.path(i) for i in range(len(flags)) if flags[i] & self.flag)
+
+    def __len__(self):
+        if self.count is None:
+            self.count = sum(1 for f in self.results.flags if f & self.flag)
+        return self.count
+
+
+class BinaryMeasuringResults(MeasuringResults):
+    # MeasuringResults backed by a (possibly memory-mapped) binary buffer, nothing is decoded until accessed
+    def __init__(self, buffer):
+        magic, version, n, edges, blob_size = BINARY_HEADER.unpack_from(buffer, 0)
+        if magic != BINARY_MAGIC or version not in (1, BINARY_VERSION):
+            raise RuntimeError('Unsupported measuring results format: {!r} v{}'.format(magic, version))
+        if sys.byteorder != 'little':
+            raise RuntimeError('Binary measuring results are only supported on little-endian machines')
+        self.buffer = buffer
+        view = memoryview(buffer)
+        offset = BINARY_HEADER.size
+
+        def section(typecode: str, count: int):
+            nonlocal offset
+            size = count * struct.calcsize(typecode)
+            result = view[offset:offset + size].cast(typecode)
+            offset += _aligned(size)
+            return result
+
+        self.string_offsets = section('Q', n + 1)
+        self.flags = section('B', n)
+        self.times = section('q', n)
+        self.object_index = section('q', n)
+        self.deps_offsets = section('Q', n + 1)
+        self.deps = section('I', edges)
+        self.blob = view[offset:offset + blob_size]
+        offset += _aligned(blob_size)
+        self.memory = section('q', n) if offset < len(view) else None
+        self.decoded: Dict[int, str] = {}
+
+        super().__init__(_PathsView(self, HAS_TIME, lambda i: self.times[i]),
+                         _PathsView(self, HAS_DEPS, self.dependencies),
+                         _PathsView(self, HAS_OBJECT, lambda i: self.path(self.object_index[i])),
+                         _PathsView(self, HAS_MEMORY, lambda i: self.memory[i]) if self.memory is not None else None)
+
+    def _raw(self, i: int):
+        return self.blob[self.string_offsets[i]:self.string_offsets[i + 1]]
+
+    def path(self, i: int) -> str:
+        p = self.decoded.get(i)
+        if p is None:
+            p = self.decoded[i] = bytes(self._raw(i)).decode()
+        return p
+
+    def find(self, path: str) -> Optional[int]:
+        key = path.encode()
+        n = len(self.flags)
+        # binary search over the sorted string table, comparing raw bytes
+        i = bisect.bisect_left(range(n), key, key=lambda j: bytes(self._raw(j)))
+        return i if i < n and self._raw(i) == key else None
+
+    def dependencies(self, i: int) -> List[str]:
+        return [self.path(d) for d in self.deps[self.deps_offsets[i]:self.deps_offsets[i + 1]]]
+
+
+def from_binary(data: bytes) -> MeasuringResults:
+    return BinaryMeasuringResults(data)
+
+
+def load(path: str) -> MeasuringResults:
+    # format is detected from the file contents, binary files are memory-mapped
+    with open(path, 'rb') as f:
+        if f.read(len(BINARY_MAGIC)) == BINARY_MAGIC:
+            return BinaryMeasuringResults(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        f.seek(0)
+        return from_json(f.read().decode())
+
+
+def save(m: MeasuringResults, path: str, binary: bool = False):
+    if binary:
+        with open(path, 'wb') as f:
+            f.write(m.to_binary())
+    else:
+        with open(path, 'w') as f:
+            f.write(m.to_json())
@@ -0,0 +1,224 @@
+import argparse
+import contextlib
+import gc
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import *
+
+import MeasuringResults
+import dependenciesForest
+from cdbToNinja import cdb_to_ninja
+from createFakeBuild import measurements_to_ninja
+from dependenciesForest import collect_results
+from graphReduction import reduce_measurements
+from jsonStream import iter_json_array
+from pathInterner import PathInterner
+from predictModularBuild import predict
+from syntheticCorpus import CorpusParams, generate_corpus, trace_paths
+
+SCALES = {
+    'small': CorpusParams(tus=200, headers=500),
+    'medium': CorpusParams(tus=2000, headers=3000),
+    'large': CorpusParams(tus=10000, headers=10000, directories=40),
+}
+DEFAULT_SCALES = ['small', 'medium']
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarkBaseline.json')
+DEFAULT_TIME_THRESHOLD = 1.5  # allowed slowdown, times are noisy
+DEFAULT_MEMORY_THRESHOLD = 1.2  # allowed growth of peak traced memory, which is almost deterministic
+DEFAULT_REPEATS = 5
+# s, stages shorter than this are allowed to slow down as much as a stage of this length, their ratios are mostly
+# scheduler and timer noise
+MIN_STAGE_TIME = 0.1
+
+
+class Corpus:
+    # generated once per scale and reused, stages get the outputs of previous stages precomputed
+    def __init__(self, root: str, params: CorpusParams):
+        self.root = root
+        self.cdb_path = os.path.join(root, 'compile_commands.json')
+        params_path = os.path.join(root, 'corpus.json')
+        expected = json.loads(json.dumps(params._asdict()))  # as it would read back from JSON
+        if not os.path.isfile(params_path) or json.load(open(params_path)) != expected:
+            print('Generating corpus in', root)
+            generate_corpus(params, root)
+        self.traces = trace_paths(root)
+        self.results: Optional[MeasuringResults.MeasuringResults] = None
+        self.reduced: Optional[MeasuringResults.MeasuringResults] = None
+
+
+def stage_cdb_to_ninja(corpus: Corpus):
+    with open(os.path.join(corpus.root, 'build.ninja'), 'w') as f:
+        cdb_to_ninja(iter_json_array(corpus.cdb_path), os.path.join(corpus.root, 'measuring'), f)
+
+
+def stage_collect_results(corpus: Corpus):
+    dependenciesForest.PATHS = PathInterner()  # every run starts cold, like a fresh process
+    corpus.results = collect_results(corpus.traces, corpus.root)
+
+
+def stage_reduce_measurements(corpus: Corpus):
+    corpus.reduced = reduce_measurements(corpus.results)
+
+
+def stage_measurements_to_ninja(corpus: Corpus):
+    measurements_to_ninja(corpus.reduced, os.path.join(corpus.root, 'fake'))
+
+
+def stage_predict(corpus: Corpus):
+    predict(corpus.reduced, 16)
+
+
+# in pipeline order, every stage may use what the previous ones left in the corpus
+STAGES = [
+    ('cdb_to_ninja', stage_cdb_to_ninja),
+    ('collect_results', stage_collect_results),
+    ('reduce_measurements', stage_reduce_measurements),
+    ('measurements_to_ninja', stage_measurements_to_ninja),
+    ('predict', stage_predict),
+]
+
+
+def calibrate_machine(repeats: int = DEFAULT_REPEATS) -> float:
+    # time of a fixed pure python workload, stage times are compared relative to it, so that a baseline
+    # recorded on one machine stays usable on another. Median like the stages, so that both see the same load.
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        d = {}
+        for i in range(200000):
+            d[str(i)] = [i] * 3
+        sorted(d.items(), key=lambda x: x[1][0] % 1000)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def run_stage(stage: Callable[[Corpus], None], corpus: Corpus, repeats: int) -> Tuple[float, int]:
+    # median of repeats for time, a single lucky or unlucky run doesn't move it, peak memory is traced in a
+    # separate run, tracing slows everything down
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        times = []
+        for _ in range(repeats):
+            gc.collect()
+            start = time.perf_counter()
+            stage(corpus)
+            times.append(time.perf_counter() - start)
+        gc.collect()
+        tracemalloc.start()
+        stage(corpus)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return statistics.median(times), peak
+
+
+def is_slower(measured: float, expected: float, threshold: float) -> bool:
+    # the allowed slowdown is relative to the stage's time, but at least as large as for a MIN_STAGE_TIME stage
+    return measured - expected > (threshold - 1.) * max(expected, MIN_STAGE_TIME)
+
+
+def run_benchmarks(scales: List[str], work_dir: str, repeats: int) -> Dict[str, Any]:
+    results = {'calibration': calibrate_machine(), 'scales': {}}
+    for scale in scales:
+        corpus = Corpus(os.path.join(work_dir, scale), SCALES[scale])
+        stages = {}
+        for name, stage in STAGES:
+            t, peak = run_stage(stage, corpus, repeats)
+            print('{:>8} {:<24} {:>8.3f}s {:>8.1f}MB'.format(scale, name, t, peak / 1e6))
+            stages[name] = {'time': t, 'peak_memory': peak}
+        # traces hold absolute paths, so memory and times of stages processing them grow with the corpus root
+        results['scales'][scale] = {'params': SCALES[scale]._asdict(), 'root_length': len(corpus.root),
+                                    'stages': stages}
+    return results
+
+
+def compare(results: Mapping[str, Any], baseline: Mapping[str, Any], time_threshold: float,
+            memory_threshold: float) -> Tuple[List[str], List[str]]:
+    # returns report lines and regressions, stages or scales missing from the baseline are reported but pass
+    speed = results['calibration'] / baseline['calibration']
+    lines = ['calibration workload took {:.2f}x of baseline, baseline times are scaled by it'.format(speed),
+             '{:>8} {:<24} {:>9} {:>9} {:>7} {:>9} {:>9} {:>7}'.format(
+                 'scale', 'stage', 'time', 'baseline', 'ratio', 'memory', 'baseline', 'ratio')]
+    regressions = []
+    for scale, r in results['scales'].items():
+        base_scale = baseline['scales'].get(scale)
+        if base_scale is None or base_scale['params'] != r['params']:
+            lines.append('{:>8} no baseline for these parameters'.format(scale))
+            continue
+        if base_scale.get('root_length') != r['root_length']:
+            lines.append('{:>8} baseline corpus root was {} characters long, not {}, pass a work directory of the '
+                         'same length'.format(scale, base_scale.get('root_length', 'of unknown length'),
+                                              r['root_length']))
+            continue
+        for name, s in r['stages'].items():
+            b = base_scale['stages'].get(name)
+            if b is None:
+                lines.append('{:>8} {:<24} no baseline'.format(scale, name))
+                continue
+            time_ratio = s['time'] / (b['time'] * speed) if b['time'] else 1.
+            memory_ratio = s['peak_memory'] / b['peak_memory'] if b['peak_memory'] else 1.
+            status = []
+            if is_slower(s['time'], b['time'] * speed, time_threshold):
+                status.append('SLOWER')
+            if memory_ratio > memory_threshold:
+                status.append('MORE MEMORY')
+            if status:
+                regressions.append('{} {}: {}'.format(scale, name, ', '.join(status)))
+            lines.append('{:>8} {:<24} {:>8.3f}s {:>8.3f}s {:>6.2f}x {:>7.1f}MB {:>7.1f}MB {:>6.2f}x {}'.format(
+                scale, name, s['time'], b['time'] * speed, time_ratio, s['peak_memory'] / 1e6,
+                b['peak_memory'] / 1e6, memory_ratio, ' '.join(status)).rstrip())
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pipeline stages on synthetic corpora against a baseline')
+
+    parser.add_argument('--scales', help='comma-separated list of scales out of {}'.format(', '.join(SCALES)),
+                        type=lambda s: s.split(','), default=DEFAULT_SCALES)
+    parser.add_argument('--work-dir', help='directory to keep generated corpora in',
+                        default=os.path.join(tempfile.gettempdir(), 'module-experiments-benchmark'))
+    parser.add_argument('--repeats', help='number of timed runs of every stage, the median is compared', type=int,
+                        default=DEFAULT_REPEATS)
+    parser.add_argument('--baseline', help='path to the stored baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--update-baseline', help='store the results as the new baseline', default=False,
+                        action='store_true')
+    parser.add_argument('--time-threshold', help='max allowed ratio to baseline time, stages shorter than {}s may '
+                                                 'slow down as much as one that long'.format(MIN_STAGE_TIME),
+                        type=float,
+                        default=DEFAULT_TIME_THRESHOLD)
+    parser.add_argument('--memory-threshold', help='max allowed ratio to baseline peak memory', type=float,
+                        default=DEFAULT_MEMORY_THRESHOLD)
+    parser.add_argument('--output-path', help='path to dump the results as JSON')
+    args = parser.parse_args()
+
+    unknown = [s for s in args.scales if s not in SCALES]
+    if unknown:
+        parser.error('unknown scales: {}'.format(', '.join(unknown)))
+
+    results = run_benchmarks(args.scales, args.work_dir, args.repeats)
+    if args.output_path:
+        with open(args.output_path, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('baseline stored in', args.baseline)
+        return 0
+    if not os.path.isfile(args.baseline):
+        print('no baseline in {}, run with --update-baseline first'.format(args.baseline), file=sys.stderr)
+        return 1
+
+    with open(args.baseline) as f:
+        lines, regressions = compare(results, json.load(f), args.time_threshold, args.memory_threshold)
+    print('\n'.join(lines))
+    if regressions:
+        print('regressions:\n    ' + '\n    '.join(regressions), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import os
+import sys
+from typing import *
+
+import MeasuringResults
+
+
+class BmiSizeModel(NamedTuple):
+    # size = fixed + own_factor * header size + transitive_factor * total size of headers it transitively includes
+    fixed: float = 0.
+    own_factor: float = 5.  # what the fake build always did: BMI is five copies of the header
+    transitive_factor: float = 0.
+
+    def size(self, own_size: int, transitive_size: int) -> int:
+        return max(0, int(self.fixed + self.own_factor * own_size + self.transitive_factor * transitive_size))
+
+    def __str__(self):
+        return '{:.0f} + {:.3f} * own + {:.3f} * transitive bytes'.format(self.fixed, self.own_factor,
+                                                                          self.transitive_factor)
+
+
+def module_names(m: MeasuringResults.MeasuringResults) -> List[str]:
+    return [name for name in m.build_times.keys() if not m.object_files.get(name)]
+
+
+def file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def source_sizes(m: MeasuringResults.MeasuringResults, with_sources: bool = False) \
+        -> Tuple[Dict[str, int], Dict[str, int]]:
+    # own and transitive source sizes of every module (and TU with with_sources), transitive ones exclude the
+    # node itself
+    own = {name: file_size(name) for name in (m.build_times.keys() if with_sources else module_names(m))}
+    closures: Dict[str, FrozenSet[str]] = {}
+
+    def closure(root: str) -> FrozenSet[str]:
+        # iterative post-order, include chains can be deeper than the recursion limit
+        stack = [(root, False)]
+        visiting = set()
+        while stack:
+            name, expanded = stack.pop()
+            if name in closures or not expanded and name in visiting:
+                continue  # done already, or an include cycle merged from different TUs
+            deps = [d for d in m.immediate_deps.get(name, ()) if d in own]
+            if not expanded:
+                visiting.add(name)
+                stack.append((name, True))
+                stack.extend((d, False) for d in deps if d not in closures)
+                continue
+            result = set(deps)
+            for d in deps:
+                result.update(closures.get(d, ()))
+            closures[name] = frozenset(result)
+        return closures[root]
+
+    transitive = {name: sum(own[d] for d in closure(name)) for name in own}
+    return own, transitive
+
+
+def bmi_sizes(m: MeasuringResults.MeasuringResults, model: BmiSizeModel) -> Dict[str, int]:
+    own, transitive = source_sizes(m)
+    return {name: model.size(own[name], transitive[name]) for name in own}
+
+
+def _solve(a: List[List[float]], b: List[float]) -> Optional[List[float]]:
+    # gaussian elimination with partial pivoting, for the tiny normal equations below
+    n = len(b)
+    a = [row[:] + [b[i]] for i, row in enumerate(a)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(a[r][col]))
+        if abs(a[pivot][col]) < 1e-12:
+            return None
+        a[col], a[pivot] = a[pivot], a[col]
+        for r in range(n):
+            if r != col:
+                k = a[r][col] / a[col][col]
+                a[r] = [x - k * y for x, y in zip(a[r], a[col])]
+    return [a[i][n] / a[i][i] for i in range(n)]
+
+
+def fit(samples: Sequence[Tuple[int, int, int]]) -> BmiSizeModel:
+    # least squares fit of (own size, transitive size, BMI size) samples
+    rows = [(1., float(own), float(trans)) for own, trans, _ in samples]
+    ata = [[sum(r[i] * r[j] for r in rows) for j in range(3)] for i in range(3)]
+    atb = [sum(r[i] * s[2] for r, s in zip(rows, samples)) for i in range(3)]
+    solution = _solve(ata, atb)
+    if solution is None:
+        # degenerate samples (e.g. no transitive includes at all), fit BMI size to own size only
+        own_total = sum(own for own, _, _ in samples)
+        return BmiSizeModel(0., sum(size for _, _, size in samples) / own_total if own_total else 0., 0.)
+    return BmiSizeModel(*(max(0., x) for x in solution))
+
+
+def calibrate(m: MeasuringResults.MeasuringResults, pcm_dir: str) -> Tuple[BmiSizeModel, int]:
+    # real BMIs are matched to headers by name: foo/bar.h <-> pcm_dir/bar.pcm
+    own, transitive = source_sizes(m)
+    samples = []
+    for name in own:
+        pcm = os.path.join(pcm_dir, os.path.splitext(os.path.basename(name))[0] + '.pcm')
+        if os.path.isfile(pcm):
+            samples.append((own[name], transitive[name], os.path.getsize(pcm)))
+    if not samples:
+        raise RuntimeError('No .pcm files in {} match measured headers'.format(pcm_dir))
+    return fit(samples), len(samples)
+
+
+if __name__ == '__main__':
+    measuring_results = MeasuringResults.load(sys.argv[1])
+    model, matched = calibrate(measuring_results, sys.argv[2])
+    print('calibrated on {} BMIs: {}'.format(matched, model))
@@ -1,77 +1,86 @@
 #!/usr/bin/env python3
 import argparse
-import json
-import shlex
 import os
+import shlex
+import sys
+import time
 from typing import *
 
+from commandNormalizer import CommandNormalizer
+from jsonStream import iter_json_array
 from util import make_absolute
 
+PEAK_RSS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'peakRss.py')
+PEAK_RSS_SUFFIX = '.rss'
 
-def find_output(args: List[str]) -> str:
-    if args:
-        for a1, a2 in zip(args[:-1], args[1:]):
-            if a1 == '-o':
-                return a2
-    raise RuntimeError("Can\'t find output in {0}".format(str(args)))
 
-
-def remove_input_and_output(args: List[str], input_file: str, wd: str) -> str:
-    skip_next = False
-    result = []
-    for arg in args:
-        if arg == '-o':
-            skip_next = True
-            continue
-        if skip_next:
-            skip_next = False
-            continue
-        if make_absolute(arg, wd) == input_file:
-            continue
-        result.append(arg)
-    return ' '.join(result)
+def peak_rss_command() -> str:
+    # -S skips site initialization, which is most of interpreter startup time
+    return '{} -S {}'.format(shlex.quote(sys.executable), shlex.quote(PEAK_RSS))
 
 
 class CDBToNinjaBuilder:
-    def __init__(self, measuring_compilers_path: Optional[str]):
+    def __init__(self, measuring_compilers_path: Optional[str], out: Optional[TextIO] = None,
+                 peak_rss_wrapper: Optional[str] = None):
         self.compilers: Dict[str, str] = {}  # dict of (exec name: var name)
-        self.rules: Dict[str, Tuple[str, str]] = {}  # dict of (common_args: (rule_name, rule_text))
+        self.rules: Dict[Hashable, Tuple[str, str]] = {}  # dict of (canonical flag set: (rule_name, rule_text))
+        # rules we'd get without flag set interning, only for stats
+        self.raw_rule_keys: Set[Tuple[str, Tuple[str, ...], str]] = set()
+        self.normalizer = CommandNormalizer()
         self.edges: List[str] = []
         self.measuring_compilers_path = measuring_compilers_path
         self.input_to_output: Dict[str, str] = {}
+        # if set, rules and edges are written out as soon as they are created instead of being kept in memory
+        self.out = out
+        # if set, every compiler command is run through it to record its peak RSS next to the object file
+        self.peak_rss_wrapper = peak_rss_wrapper
 
-    def add_cdb_command(self, command: str, input_file: str, wd: str):
+    def add_cdb_command(self, command: Union[str, Sequence[str]], input_file: str, wd: str):
+        # command is either CDB "command" string or CDB "arguments" list
         assert os.path.isabs(wd), 'Only absolute working dirs are supported!'
-        args = [shlex.quote(s) for s in shlex.split(command)]
-        compiler_var_name = self.add_or_create_compiler(args[0])
-        args[0] = '${}'.format(compiler_var_name)
-        rel_output = find_output(args)
-        output_file = make_absolute(rel_output, wd)
+        normalized = self.normalizer.normalize(command, input_file, wd)
+        compiler_var_name = self.add_or_create_compiler(normalized.compiler)
+        output_file = make_absolute(normalized.output, wd)
         self.input_to_output[input_file] = output_file
-        time_file = rel_output + '.time.json' if self.measuring_compilers_path is not None else None
-        input_file = make_absolute(input_file, wd)
-        common_args = remove_input_and_output(args, input_file, wd)
-        self.add_build_edge(common_args, input_file, output_file, time_file, wd)
-
-    def add_build_edge(self, common_args: str, input_file: str, output_file: str, time_file: Optional[str],
-                       working_dir: str):
-        rule_name = self.find_or_add_rule(common_args, working_dir)
-        self.edges.append(f"build {output_file}{time_file}: {rule_name} {input_file}\n" +
-                          f"   obj_file={output_file}\n" +
-                          f"   time_trace_file={time_file}\n")
-
-    def find_or_add_rule(self, common_args: str, working_dir: str) -> str:
-        key = common_args + working_dir
+        time_file = normalized.output + '.time.json' if self.measuring_compilers_path is not None else None
+        self.add_build_edge(compiler_var_name, normalized.common_args, normalized.input_file, output_file, time_file,
+                            wd)
+
+    def add_build_edge(self, compiler_var_name: str, common_args: Tuple[str, ...], input_file: str, output_file: str,
+                       time_file: Optional[str], working_dir: str):
+        rule_name = self.find_or_add_rule(compiler_var_name, common_args, working_dir)
+        # the trace is an output too, so that ninja rebuilds TUs whose trace is missing, ninja runs elsewhere
+        outputs = output_file if time_file is None else f"{output_file} {make_absolute(time_file, working_dir)}"
+        edge = f"build {outputs}: {rule_name} {input_file}\n" + \
+               f"   obj_file={output_file}\n" + \
+               f"   time_trace_file={time_file}\n"
+        if self.peak_rss_wrapper is not None:
+            edge += f"   peak_rss_file={output_file}{PEAK_RSS_SUFFIX}\n"
+        if self.out is not None:
+            self.out.write(edge + "\n")
+        else:
+            self.edges.append(edge)
+
+    def find_or_add_rule(self, compiler_var_name: str, common_args: Tuple[str, ...], working_dir: str) -> str:
+        # commands which differ only in order of independent flags share the rule of the first of them
+        self.raw_rule_keys.add((compiler_var_name, common_args, working_dir))
+        key = (compiler_var_name, self.normalizer.flag_set(common_args), working_dir)
 
         existing_rule = self.rules.get(key)
         if existing_rule is not None:
             return existing_rule[0]
 
         rule_name = 'cc{}'.format(len(self.rules))
+        command = ' '.join(('$' + compiler_var_name,) + common_args)
+        if self.peak_rss_wrapper is not None:
+            command = '{} $peak_rss_file {}'.format(self.peak_rss_wrapper, command)
         rule_text = f"rule {rule_name}\n" + \
-                    f"   command = cd {working_dir} && {common_args} --time-trace $time_trace_file -o $obj_file $in"
+                    f"   command = cd {working_dir} && {command} --time-trace $time_trace_file -o $obj_file $in"
 
         self.rules[key] = (rule_name, rule_text)
+        if self.out is not None:
+            # rules have to be defined before the first edge using them
+            self.out.write(rule_text + "\n\n")
         return rule_name
 
     def get_text(self):
@@ -84,6 +93,16 @@ class CDBToNinjaBuilder:
             "\n".join(self.edges) + \
             "\n"
 
+    def finish(self):
+        # compiler variables are only known after all commands are seen, ninja expands rule commands
+        # lazily, so it's fine to define them after the rules
+        compilers = self.get_target_compilers()
+        self.out.write("\n".join(["{} = {}".format(name, exe) for exe, name in compilers.items()]) + "\n")
+
+    def report(self) -> str:
+        return '{} rules ({} without flag set interning), {}'.format(len(self.rules), len(self.raw_rule_keys),
+                                                                    self.normalizer.report())
+
     def add_or_create_compiler(self, compiler):
         if compiler in self.compilers:
             return self.compilers[compiler]
@@ -109,11 +128,18 @@ class CDBToNinjaBuilder:
         return [(input_path, output_path) for input_path, output_path in self.input_to_output.items()]
 
 
-def cdb_to_ninja(cdb: Iterable[Mapping[str, str]], measuring_compiler_path: str) -> Tuple[str, List[Tuple[str, str]]]:
-    builder = CDBToNinjaBuilder(measuring_compiler_path)
+def cdb_to_ninja(cdb: Iterable[Mapping[str, Any]], measuring_compiler_path: str, out: Optional[TextIO] = None,
+                 peak_rss_wrapper: Optional[str] = None) -> Tuple[Optional[str], List[Tuple[str, str]]]:
+    # if out is given, the script is streamed into it and no text is returned
+    builder = CDBToNinjaBuilder(measuring_compiler_path, out, peak_rss_wrapper)
     for entry in cdb:
-        builder.add_cdb_command(entry['command'], entry['file'], entry['directory'])
+        command = entry['arguments'] if 'arguments' in entry else entry['command']
+        builder.add_cdb_command(command, entry['file'], entry['directory'])
+    print(builder.report())
 
+    if out is not None:
+        builder.finish()
+        return None, builder.get_metadata()
     return builder.get_text(), builder.get_metadata()
 
 
@@ -125,11 +151,15 @@ def main():
     parser.add_argument('--metadata-path', help='path to store metadata (i.e. .cpp/.o mappings)')
     parser.add_argument('--measuring-compiler-path',
                         help='path to measuring compilers (clang/clang++), omit to use original compiler')
+    parser.add_argument('--record-peak-rss', help='record peak RSS of every compiler command in <object file>{}'.format(
+        PEAK_RSS_SUFFIX), default=False, action='store_true')
     args = parser.parse_args()
 
-    cdb = json.load(open(args.cdb_path))
-    ninja, metadata = cdb_to_ninja(cdb, args.measuring_compiler_path)
-    open(args.output_path, 'w').write(ninja)
+    start_time = time.time()
+    with open(args.output_path, 'w') as out:
+        _, metadata = cdb_to_ninja(iter_json_array(args.cdb_path), args.measuring_compiler_path, out,
+                                   peak_rss_command() if args.record_peak_rss else None)
+    print('Converted in {:.2f}s'.format(time.time() - start_time))
     if args.metadata_path:
         open(args.metadata_path, 'w').write('\n'.join('"{}" "{}"'.format(ip, op) for ip, op in metadata))
 
@@ -0,0 +1,135 @@
+import os
+import shlex
+from typing import *
+
+from util import make_absolute
+
+# options whose value is passed as the next argument
+TAKES_ARG = {'-o', '-I', '-D', '-U', '-include', '-imacros', '-isystem', '-iquote', '-idirafter', '-iprefix',
+             '-isysroot', '-F', '-Xclang', '-Xlinker', '-Xpreprocessor', '-Xassembler', '-mllvm', '-MF', '-MT', '-MQ',
+             '-x', '-arch', '-target', '--sysroot'}
+
+INCLUDE_PATH_OPTIONS = ('-I', '-isystem', '-iquote', '-idirafter', '-iprefix', '-F')
+MACRO_OPTIONS = ('-D', '-U')
+ORDERED_OPTIONS = ('-include', '-imacros', '-Xclang', '-Xlinker', '-Xpreprocessor', '-Xassembler', '-mllvm', '-Wl,',
+                   '-Wp,', '-Wa,')
+
+
+def needs_shell_parsing(command: str) -> bool:
+    # without quotes and escapes shlex.split is the same as a plain whitespace split, but much slower
+    return '"' in command or "'" in command or '\\' in command
+
+
+def tokenize(command: str) -> List[str]:
+    return shlex.split(command) if needs_shell_parsing(command) else command.split()
+
+
+def option_family(option: Tuple[str, ...]) -> str:
+    # Options in the same family may override or depend on each other, so their relative order matters,
+    # while options from different families can be freely reordered.
+    flag = option[0]
+    if flag.startswith(INCLUDE_PATH_OPTIONS):
+        return 'include-paths'
+    if flag.startswith(ORDERED_OPTIONS):
+        return 'ordered'
+    if flag.startswith(MACRO_OPTIONS):
+        definition = option[1] if len(option) > 1 else flag[2:]
+        return 'macro:' + definition.split('=', 1)[0]
+    if flag.startswith(('-f', '-W', '-m')):
+        # one family for all of them, as flags with different names still override each other, e.g. -Wall and
+        # -Wno-unused-variable, -Werror and -Wno-error=..., -ffast-math and -fno-finite-math-only
+        return 'machine-and-warnings'
+    if flag.startswith('-O'):
+        return 'optimization'
+    if flag.startswith(('-std', '--std')):
+        return 'std'
+    if flag.startswith('-g'):
+        return 'debug'
+    return flag
+
+
+def group_options(args: Iterable[str]) -> List[Tuple[str, ...]]:
+    options = []
+    pending = None
+    for arg in args:
+        if pending is not None:
+            options.append((pending, arg))
+            pending = None
+        elif arg in TAKES_ARG:
+            pending = arg
+        else:
+            options.append((arg,))
+    if pending is not None:
+        options.append((pending,))
+    return options
+
+
+def canonical_flag_set(args: Sequence[str]) -> Tuple[Tuple[str, ...], ...]:
+    options = group_options(args)
+    families = {}
+    for option in options:
+        families.setdefault(option_family(option), []).append(option)
+    return tuple(option for family in sorted(families) for option in families[family])
+
+
+class NormalizedCommand(NamedTuple):
+    compiler: str
+    common_args: Tuple[str, ...]  # shell-quoted, without compiler, input and output
+    output: str  # as written in the command, relative to the working dir
+    input_file: str  # absolute
+
+
+class CommandNormalizer:
+    def __init__(self):
+        self.quoted: Dict[str, str] = {}
+        self.flag_sets: Dict[Tuple[str, ...], Tuple[Tuple[str, ...], ...]] = {}  # common args: canonical flag set
+        self.commands = 0
+        self.shlex_commands = 0
+
+    def quote(self, arg: str) -> str:
+        q = self.quoted.get(arg)
+        if q is None:
+            q = self.quoted[arg] = shlex.quote(arg)
+        return q
+
+    def normalize(self, command: Union[str, Sequence[str]], input_file: str, wd: str) -> NormalizedCommand:
+        # command is either CDB "command" string or already split CDB "arguments"
+        self.commands += 1
+        if isinstance(command, str):
+            if needs_shell_parsing(command):
+                self.shlex_commands += 1
+            args = tokenize(command)
+        else:
+            args = command
+
+        abs_input = make_absolute(input_file, wd)
+        input_name = os.path.basename(input_file)
+        output = None
+        common_args = []
+        skip_next = False
+        for arg in args[1:]:
+            if skip_next:
+                skip_next = False
+                output = arg
+                continue
+            if arg == '-o':
+                skip_next = True
+                continue
+            # only args looking like the input file need the (slow) normalization
+            if arg == input_file or arg.endswith(input_name) and make_absolute(arg, wd) == abs_input:
+                continue
+            common_args.append(self.quote(arg))
+        if output is None:
+            raise RuntimeError("Can\'t find output in {0}".format(str(args)))
+        return NormalizedCommand(args[0], tuple(common_args), output, abs_input)
+
+    def flag_set(self, common_args: Tuple[str, ...]) -> Tuple[Tuple[str, ...], ...]:
+        # commands from the same target mostly share flags, so this is computed once per distinct flag list
+        flags = self.flag_sets.get(common_args)
+        if flags is None:
+            flags = self.flag_sets[common_args] = canonical_flag_set(common_args)
+        return flags
+
+    def report(self) -> str:
+        return '{} commands ({} needed full shell parsing), {} distinct flag lists, {} distinct flag sets'.format(
+            self.commands, self.shlex_commands, len(self.flag_sets), len(set(self.flag_sets.values())))
@@ -1,71 +1,259 @@
+import argparse
+import json
 import os
+import shlex
+import subprocess
 import sys
+import tempfile
+import time
 
 import MeasuringResults
+from bmiModel import BmiSizeModel, bmi_sizes, calibrate
+from graphReduction import edge_count, reduce_measurements, transitive_deps
 
 from typing import *
 
 MODULE_RULE = 'fake_module'
 OBJFILE_RULE = 'fake_objfile'
 MIN_TIME_TO_SPAWN_COMPILER = 0.015
+FAKE_COMPILER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fakeCompiler.py')
+SHELL_MODE = 'shell'
+FAKE_COMPILER_MODE = 'fake-compiler'
+MODE_VARIABLE = 'fake_build_mode'  # top-level variable of the script telling which rules its edges run
 
+# BMIs are passed explicitly as well, so that consumers can read them like a real compiler would
 BUILD_EDGE_TEMPLATE = """
 build {output}: {rule_name} {input} {dependencies}
     wait_time = {wait_time:.6f}
-    cat_times = {cat_times}
+    bmi_size = {bmi_size}
+    bmis = {bmis}
 """.strip()
 
+# /dev/null keeps cat from reading stdin when there are no BMIs
 RULES = """
 rule {module_rule}
-    command = sleep $wait_time && truncate -s 0 $out && seq 1 $cat_times | xargs -I@@@ cat $in >> $out
+    command = cat /dev/null $bmis > /dev/null && sleep $wait_time && head -c $bmi_size /dev/zero > $out
 
 rule {objfile_rule}
-    command = sleep $wait_time && touch $out
+    command = cat /dev/null $bmis > /dev/null && sleep $wait_time && touch $out
 """.format(module_rule=MODULE_RULE, objfile_rule=OBJFILE_RULE).strip()
 
+FAKE_COMPILER_RULES = """
+rule {module_rule}
+    command = {compiler} $wait_time $bmi_size $out $in $bmis
+
+rule {objfile_rule}
+    command = {compiler} $wait_time 0 $out $in $bmis
+"""
+
+
+class OverheadModel(NamedTuple):
+    # observed edge duration = fixed + scale * requested wait time, fitted on .ninja_log of a previous fake build.
+    # Shell rules and the fake compiler have different overheads, so a model only applies to the mode it was
+    # fitted in, None for models stored before the mode was recorded.
+    fixed: float = 0.
+    scale: float = 1.
+    mode: Optional[str] = None
+
+    def wait_time(self, duration: float) -> float:
+        # wait time to request for an edge to take the given duration
+        return max(0., (duration - self.fixed) / self.scale) if self.scale > 0 else 0.
+
+    def __str__(self):
+        return '{:.2f}ms + {:.3f} * wait time ({} mode)'.format(self.fixed * 1000., self.scale,
+                                                                 self.mode or 'unknown')
+
+
+def load_overhead_model(path: str) -> OverheadModel:
+    with open(path) as f:
+        return OverheadModel(**json.load(f))
+
+
+def build_mode(fake_compiler: Optional[str]) -> str:
+    return SHELL_MODE if fake_compiler is None else FAKE_COMPILER_MODE
+
+
+def check_overhead_model(model: OverheadModel, mode: str) -> bool:
+    # raises if the model was fitted in another mode, returns False if it's not known which one it was fitted in
+    if model.mode is None:
+        return False
+    if model.mode != mode:
+        raise RuntimeError('Edge overhead model was fitted on a {} fake build, it doesn\'t apply to a {} one'.format(
+            model.mode, mode))
+    return True
+
+
+def fake_compiler_command() -> str:
+    # -S skips site initialization, which is most of interpreter startup time
+    return '{} -S {}'.format(shlex.quote(sys.executable), shlex.quote(FAKE_COMPILER))
+
+
+def measure_spawn_overhead(compiler: str, samples: int = 20) -> float:
+    # wall time of a no-op fake compiler edge spawned through the shell the same way ninja does it
+    with tempfile.TemporaryDirectory() as d:
+        source = os.path.join(d, 'source')
+        open(source, 'w').close()
+        command = '{} 0 0 {} {}'.format(compiler, shlex.quote(os.path.join(d, 'out')), shlex.quote(source))
+        subprocess.check_call(command, shell=True)  # warm up caches
+        start_time = time.perf_counter()
+        for _ in range(samples):
+            subprocess.check_call(command, shell=True)
+        return (time.perf_counter() - start_time) / samples
+
 
 class NinjaBuilder:
-    def __init__(self):
+    def __init__(self, fake_compiler: Optional[str] = None, spawn_overhead: float = 0.,
+                 overhead_model: Optional[OverheadModel] = None, pool_depths: Optional[Mapping[str, int]] = None):
+        # with fake_compiler, edges hold for exactly the measured time, spawn overhead is subtracted from it,
+        # otherwise the shell rules are used and MIN_TIME_TO_SPAWN_COMPILER is added to every edge. In both modes
+        # reading BMIs and writing the output come on top of the wait time.
+        # A fitted overhead model replaces all of that: edges are aimed at exactly the measured time, which is what
+        # ninjaLog reports the error against.
         self.edges: List[str] = []
+        self.fake_compiler = fake_compiler
+        self.spawn_overhead = spawn_overhead
+        self.overhead_model = overhead_model
+        self.pool_depths = pool_depths or {}
 
     def add_fake_command(self, rule_name: str, wait_time_us: int, source_input: str, module_inputs: List[str],
-                         output: str):
+                         output: str, bmi_size: int = 0, pool: Optional[str] = None,
+                         bmis: Optional[List[str]] = None):
+        # module_inputs are what the edge waits for, bmis what it reads, module_inputs by default
         if module_inputs:
             implicit_deps_part = ' | ' + ' '.join(module_inputs)
         else:
             implicit_deps_part = ''
-        self.edges.append(BUILD_EDGE_TEMPLATE.format(
+        duration = wait_time_us / 1000000.
+        if self.overhead_model is not None:
+            wait_time = self.overhead_model.wait_time(duration)
+        elif self.fake_compiler is None:
+            wait_time = duration + MIN_TIME_TO_SPAWN_COMPILER
+        else:
+            wait_time = max(0., duration - self.spawn_overhead)
+        edge = BUILD_EDGE_TEMPLATE.format(
             rule_name=rule_name,
             output=output,
             input=source_input, dependencies=implicit_deps_part,
-            wait_time=(wait_time_us / 1000000.) + MIN_TIME_TO_SPAWN_COMPILER,
-            cat_times=5))
+            wait_time=wait_time,
+            bmi_size=bmi_size,
+            bmis=' '.join(module_inputs if bmis is None else bmis))
+        if pool is not None:
+            edge += '\n    pool = {}'.format(pool)
+        self.edges.append(edge)
 
     def build(self):
-        return RULES + '\n\n' + '\n\n'.join(self.edges) + '\n'
+        if self.fake_compiler is None:
+            rules = RULES
+        else:
+            rules = FAKE_COMPILER_RULES.format(module_rule=MODULE_RULE, objfile_rule=OBJFILE_RULE,
+                                               compiler=self.fake_compiler).strip()
+        pools = ''.join('pool {}\n    depth = {}\n\n'.format(name, depth)
+                        for name, depth in sorted(self.pool_depths.items()))
+        mode = '{} = {}\n\n'.format(MODE_VARIABLE, build_mode(self.fake_compiler))
+        # joined at once, scripts of large builds are big enough for every intermediate copy to count
+        pieces = [mode, rules, '\n\n', pools]
+        for i, edge in enumerate(self.edges):
+            if i:
+                pieces.append('\n\n')
+            pieces.append(edge)
+        pieces.append('\n')
+        return ''.join(pieces)
 
 
 def get_bmi_path(input_name: str, path: str) -> str:
     return os.path.join(path, 'BMI', input_name.replace('/', '_') + '.bmi')
 
 
-def measurements_to_ninja(m: MeasuringResults.MeasuringResults, result_path: str) -> str:
-    builder = NinjaBuilder()
+def measurements_to_ninja(m: MeasuringResults.MeasuringResults, result_path: str, fake_compiler: Optional[str] = None,
+                          spawn_overhead: float = 0., bmi_model: BmiSizeModel = BmiSizeModel(),
+                          overhead_model: Optional[OverheadModel] = None,
+                          pools: Optional[Tuple[Mapping[str, int], Mapping[str, str]]] = None) -> str:
+    # pools are (depths by pool name, pools by edge name) of edges to run in a ninja pool, see memory_pools
+    # Edges wait for their immediate deps, which may be transitively reduced, but read the BMIs of all modules they
+    # transitively import, like a compiler loading a module loads everything it imports.
+    pool_depths, edge_pools = pools or ({}, {})
+    builder = NinjaBuilder(fake_compiler, spawn_overhead, overhead_model, pool_depths)
+    sizes = bmi_sizes(m, bmi_model)
+    imported = transitive_deps(m.immediate_deps)
+    bmi_paths: Dict[str, str] = {}
+
+    def bmi_path(name: str) -> str:
+        path = bmi_paths.get(name)
+        if path is None:
+            path = bmi_paths[name] = get_bmi_path(name, result_path)
+        return path
 
     for input_name, self_time in m.build_times.items():
         object_file = m.object_files.get(input_name)
-        deps = [get_bmi_path(dep, result_path) for dep in m.immediate_deps[input_name]]
+        deps = [bmi_path(dep) for dep in m.immediate_deps[input_name]]
+        bmis = [bmi_path(dep) for dep in sorted(imported[input_name])]
         if object_file:  # source
-            builder.add_fake_command(OBJFILE_RULE, self_time, input_name, deps, object_file)
+            builder.add_fake_command(OBJFILE_RULE, self_time, input_name, deps, object_file,
+                                     pool=edge_pools.get(input_name), bmis=bmis)
         else:  # module
-            builder.add_fake_command(MODULE_RULE, self_time, input_name, deps, get_bmi_path(input_name, result_path))
+            builder.add_fake_command(MODULE_RULE, self_time, input_name, deps, get_bmi_path(input_name, result_path),
+                                     sizes[input_name], edge_pools.get(input_name), bmis)
 
     return builder.build()
 
 
 if __name__ == '__main__':
-    measuring_results = MeasuringResults.from_json(open(sys.argv[1]).read())
-    results_path = sys.argv[2]
-    ninja_script = measurements_to_ninja(measuring_results, results_path)
+    parser = argparse.ArgumentParser(description='Create fake modular build script out of measuring results')
+
+    parser.add_argument('results', help='path to measuring results (JSON or binary)')
+    parser.add_argument('output', help='path to fake build directory')
+    parser.add_argument('--fake-compiler', help='use fake compiler process instead of shell commands',
+                        default=False, action='store_true')
+    parser.add_argument('--calibrate-bmi', help='directory with real .pcm files to fit the BMI size model to')
+    parser.add_argument('--keep-redundant-deps', help='don\'t remove transitively redundant dependencies',
+                        default=False, action='store_true')
+    parser.add_argument('--overhead-model', help='per-edge overhead model fitted by ninjaLog.py on a previous build')
+    parser.add_argument('--memory-budget', help='memory budget in GB to put heavy edges into ninja pools for, needs '
+                                                'peak RSS in the results', type=float)
+    parser.add_argument('-j', help='parallelism the fake build will run with, to size memory pools for (default: '
+                                   'same as ninja)', type=int, dest='parallelism')
+    args = parser.parse_args()
+    if args.parallelism is not None and args.parallelism <= 0:
+        parser.error('parallelism must be positive, got {}'.format(args.parallelism))
+
+    measuring_results = MeasuringResults.load(args.results)
+    if not args.keep_redundant_deps:
+        reduced_results = reduce_measurements(measuring_results)
+        print('dependencies: {} before, {} after reduction'.format(edge_count(measuring_results.immediate_deps),
+                                                                    edge_count(reduced_results.immediate_deps)))
+        measuring_results = reduced_results
+    bmi_model = BmiSizeModel()
+    if args.calibrate_bmi:
+        bmi_model, matched = calibrate(measuring_results, args.calibrate_bmi)
+        print('BMI size model calibrated on {} BMIs: {}'.format(matched, bmi_model))
+    results_path = args.output
+    fake_compiler = fake_compiler_command() if args.fake_compiler else None
+    spawn_overhead = 0.
+    overhead_model = None
+    if args.overhead_model:
+        overhead_model = load_overhead_model(args.overhead_model)
+        print('edge overhead model: {}'.format(overhead_model))
+        try:
+            if not check_overhead_model(overhead_model, build_mode(fake_compiler)):
+                print('warning: edge overhead model doesn\'t record the mode it was fitted in, make sure it was '
+                      'fitted {} --fake-compiler'.format('with' if fake_compiler else 'without'), file=sys.stderr)
+        except RuntimeError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+    elif fake_compiler:
+        spawn_overhead = measure_spawn_overhead(fake_compiler)
+        print('fake compiler overhead: {:.2f}ms per edge'.format(spawn_overhead * 1000.))
+    pools = None
+    if args.memory_budget:
+        # imported here, both import this module
+        from memoryModel import edge_memory, fit_memory_model, memory_pools
+        from predictModularBuild import default_parallelism
+        memory_model, measured = fit_memory_model(measuring_results)
+        print('memory model fitted on {} TUs: {}'.format(measured, memory_model))
+        pools = memory_pools(edge_memory(measuring_results, memory_model), int(args.memory_budget * 1e9),
+                             args.parallelism or default_parallelism())
+        print('{} edges in {} memory pools'.format(len(pools[1]), len(pools[0])))
+    ninja_script = measurements_to_ninja(measuring_results, results_path, fake_compiler, spawn_overhead, bmi_model,
+                                         overhead_model, pools)
     ninja_build_path = os.path.join(results_path, 'build.ninja')
     open(ninja_build_path, 'w').write(ninja_script)
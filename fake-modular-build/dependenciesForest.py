@@ -1,78 +1,136 @@
+import array
 import glob
-import json
+import itertools
+import multiprocessing
 import os
 import statistics
 import sys
+from jsonStream import JsonStreamReader
 from MeasuringResults import MeasuringResults
+from pathInterner import PathInterner
+from resultsCache import ResultsCache
 from typing import *
 
+# all path canonicalization goes through this per-process cache, so each unique path is resolved once per run
+PATHS = PathInterner()
 
-class Node:
-    def __init__(self, name: str, children, self_time, total_time):
-        self.parent = None
-        self.name = name
+
+class Forest:
+    # Include forest of one TU in parallel arrays: nodes are integer ids in the order of first inclusion (0 is the
+    # TU itself), children of node i are children[child_offsets[i]:child_offsets[i + 1]]
+    __slots__ = ('names', 'self_times', 'total_times', 'child_offsets', 'children', 'ids')
+
+    def __init__(self, names: List[str], self_times: array.array, total_times: array.array,
+                 child_offsets: array.array, children: array.array):
+        self.names = names
+        self.self_times = self_times
+        self.total_times = total_times
+        self.child_offsets = child_offsets
         self.children = children
-        self.self_time = self_time
-        self.total_time = total_time
+        self.ids = {name: i for i, name in enumerate(names)}
 
-    def __repr__(self):
-        return '{}, self-time: {}, total-time: {}, children count: {}'.format(self.name, self.self_time,
-                                                                              self.total_time, len(self.children))
+    def __len__(self):
+        return len(self.names)
+
+    def child_ids(self, node_id: int) -> array.array:
+        return self.children[self.child_offsets[node_id]:self.child_offsets[node_id + 1]]
+
+    def node(self, node_id: int) -> 'Node':
+        return Node(self, node_id)
+
+    @property
+    def root(self) -> 'Node':
+        return Node(self, 0)
+
+    def nodes(self) -> Iterator['Node']:
+        return (Node(self, i) for i in range(len(self)))
+
+    def find(self, name: str) -> Optional['Node']:
+        node_id = self.ids.get(name)
+        return Node(self, node_id) if node_id is not None else None
 
-    def dump_tree(self, indent=0):
-        return '\n'.join([' ' * indent + str(self)] + [child.dump_tree(indent + 1) for child in self.children])
 
+class Node:
+    # lightweight view of one forest node
+    __slots__ = ('forest', 'id')
+
+    def __init__(self, forest: Forest, node_id: int):
+        self.forest = forest
+        self.id = node_id
+
+    @property
+    def name(self) -> str:
+        return self.forest.names[self.id]
 
-class NodeBuilder:
-    def __init__(self, dependencies, enter_times, exit_times, total_time_in_children):
-        self.dependencies = dependencies
-        self.enter_times = enter_times
-        self.exit_times = exit_times
-        self.total_time_in_children = total_time_in_children
-        self.all_nodes = dict()
+    @property
+    def self_time(self) -> int:
+        return self.forest.self_times[self.id]
 
-    def build_all_nodes(self):
-        for name in self.enter_times.keys():
-            self.build_node(name)
-        return self.all_nodes
+    @property
+    def total_time(self) -> int:
+        return self.forest.total_times[self.id]
 
-    def build_node(self, node_name):
-        if node_name in self.all_nodes:
-            return self.all_nodes[node_name]
+    @property
+    def children(self) -> List['Node']:
+        return [Node(self.forest, c) for c in self.forest.child_ids(self.id)]
+
+    def __repr__(self):
+        return '{}, self-time: {}, total-time: {}, children count: {}'.format(
+            self.name, self.self_time, self.total_time, len(self.forest.child_ids(self.id)))
 
-        children = [self.build_node(dep) for dep in self.dependencies[node_name]]
-        total_time = self.exit_times[node_name] - self.enter_times[node_name]
-        self_time = total_time - self.total_time_in_children[node_name]
-        node = Node(node_name, children, self_time, total_time)
-        self.all_nodes[node_name] = node
-        return node
+    def dump_tree(self, indent=0):
+        # iterative, include chains can be deeper than the recursion limit
+        lines = []
+        stack = [(self.id, indent)]
+        while stack:
+            node_id, level = stack.pop()
+            lines.append(' ' * level + repr(Node(self.forest, node_id)))
+            stack.extend((c, level + 1) for c in reversed(self.forest.child_ids(node_id)))
+        return '\n'.join(lines)
+
+
+def build_forest(names: List[str], enter_times: List[int], exit_times: List[int], time_in_children: List[int],
+                 dependencies: List[Set[int]]) -> Forest:
+    total_times = array.array('q', (exit_t - enter_t for enter_t, exit_t in zip(enter_times, exit_times)))
+    self_times = array.array('q', (total - in_children for total, in_children in zip(total_times, time_in_children)))
+    child_offsets = array.array('q', [0])
+    children = array.array('q')
+    for deps in dependencies:
+        children.extend(sorted(deps))
+        child_offsets.append(len(children))
+    return Forest(names, self_times, total_times, child_offsets, children)
 
 
 def fix_path(path, root_dir):
     if not path:
         return path
-    if not os.path.isabs(path):
-        path = os.path.join(root_dir, path)
-    res = os.path.normpath(os.path.realpath(path))
-    return res
+    return PATHS.canonical(path, root_dir)
 
 
 def cleanup_events(events, root_dir):
-    events = events[1:]  # first is TU itself - we don't have matching "exit" for it
-    events = [e for e in events if e['Type'] in ('enter', 'exit', 'skip')]  # for now we don't need other events
-    return events
+    events = itertools.islice(events, 1, None)  # first is TU itself - we don't have matching "exit" for it
+    return filter_events(events)
+
+
+def filter_events(events: Iterable[Mapping]) -> Iterator[Mapping]:
+    return (e for e in events if e['Type'] in ('enter', 'exit', 'skip'))  # for now we don't need other events
+
+
+def tu_from_trace(trace, tu_name, root_dir) -> Forest:
+    return tu_from_events(cleanup_events(trace['Events'], root_dir), lambda: trace['TotalTime'], tu_name, root_dir)
 
 
-def tu_from_trace(trace, tu_name, root_dir):
-    processing_stack = [(tu_name, False)]
+def tu_from_events(events: Iterable[Mapping], get_total_time: Callable[[], int], tu_name, root_dir) -> Forest:
+    # total time is only queried once all events are consumed, streamed traces may store it after the events
+    processing_stack = [(0, False)]  # (node id, is multientry)
 
-    enter_times = {tu_name: 0}
-    exit_times = {tu_name: trace['TotalTime']}
-    total_time_in_children = {tu_name: 0}
-    dependencies = {tu_name: set()}
-    events = cleanup_events(trace['Events'], root_dir)
+    ids = {tu_name: 0}
+    names = [tu_name]
+    enter_times = [0]
+    exit_times: List[Optional[int]] = [None]
+    time_in_children = [0]
+    dependencies: List[Set[int]] = [set()]
 
-    level = 0
     for event in events:
         name = fix_path(event['File'], root_dir)
         if not name:
@@ -80,82 +138,168 @@ def tu_from_trace(trace, tu_name, root_dir):
 
         node_type = event['Type']
         timestamp = event['TimestampMS']
-        cur_name = processing_stack[-1][0]
-        cur_name_is_multientry = processing_stack[-1][1]
+        cur_id, cur_is_multientry = processing_stack[-1]
 
         if node_type == 'enter':
-            is_multientry = name in dependencies
+            node_id = ids.get(name)
+            is_multientry = node_id is not None
             if not is_multientry:
-                dependencies[name] = set()
-                enter_times[name] = timestamp
-                total_time_in_children[name] = 0
-                dependencies[cur_name].add(name)
+                node_id = ids[name] = len(names)
+                names.append(name)
+                enter_times.append(timestamp)
+                exit_times.append(None)
+                time_in_children.append(0)
+                dependencies.append(set())
+                dependencies[cur_id].add(node_id)
 
-            processing_stack.append((name, is_multientry))
-            # print(' ' * level, 'Entering', name, is_multientry)
-            level += 1
+            processing_stack.append((node_id, is_multientry))
 
         elif node_type == 'exit':
-            if cur_name != name:
+            if names[cur_id] != name:
                 raise RuntimeError(
-                    'Stack mismatch! Enter: {}, exit: {}, tu: {}'.format(cur_name, name, tu_name))
+                    'Stack mismatch! Enter: {}, exit: {}, tu: {}'.format(names[cur_id], name, tu_name))
 
             processing_stack.pop()
-            if not cur_name_is_multientry:
-                exit_times[name] = timestamp
-                if not processing_stack[-1][1]:
-                    total_time_in_children[processing_stack[-1][0]] += exit_times[name] - enter_times[name]
-            level -= 1
-            t = (exit_times[name] - enter_times[name]) if name in exit_times else '???'
-            # print(' ' * level, 'Leaving', name, t)
+            if not cur_is_multientry:
+                exit_times[cur_id] = timestamp
+                parent_id, parent_is_multientry = processing_stack[-1]
+                if not parent_is_multientry:
+                    time_in_children[parent_id] += timestamp - enter_times[cur_id]
 
         elif node_type == 'skip':
-            if not cur_name_is_multientry:
-                if name not in enter_times:
+            if not cur_is_multientry:
+                node_id = ids.get(name)
+                if node_id is None:
                     raise RuntimeError('Skipping unknown header {} in tu {}'.format(name, tu_name))
-                elif name not in exit_times:
+                elif exit_times[node_id] is None:
                     pass
                     # print('Recursive include of {} in tu {}, ignoring'.format(name, tu_name))
-                elif not cur_name_is_multientry:
-                    dependencies[cur_name].add(name)
+                else:
+                    dependencies[cur_id].add(node_id)
 
-    builder = NodeBuilder(dependencies, enter_times, exit_times, total_time_in_children)
-    all_nodes = builder.build_all_nodes()
-    tu = all_nodes[tu_name]
-    assert tu.total_time == exit_times[tu_name]
-    # actual = tu.total_time
-    # computed = sum(c.self_time for c in all_nodes.values())
-    # print(f'actual={actual}, computed={computed}, diff={computed - actual}')
-    return tu, all_nodes
+    exit_times[0] = get_total_time()
+    if len(processing_stack) != 1:
+        raise RuntimeError('Unterminated include of {} in tu {}'.format(names[processing_stack[-1][0]], tu_name))
+    return build_forest(names, enter_times, exit_times, time_in_children, dependencies)
 
 
-def process_trace(trace_path, root_dir):
-    trace = json.load(open(trace_path))
-    tu_name = fix_path(trace['Events'][0]['File'], root_dir)
-    return tu_from_trace(trace, tu_name, root_dir)
+def process_trace(trace_path, root_dir) -> Forest:
+    # events are streamed straight from the file, so memory doesn't depend on the trace size
+    with open(trace_path) as f:
+        fields = {}
+        events = JsonStreamReader(f).iter_object('Events', fields)
+        first_event = next(events, None)
+        if first_event is None:
+            raise RuntimeError('No events in {}'.format(trace_path))
+        tu_name = fix_path(first_event['File'], root_dir)
+        return tu_from_events(filter_events(events), lambda: fields['TotalTime'], tu_name, root_dir)
 
 
 def median_build_times(tu_times: Mapping[str, List[int]]) -> Mapping[str, int]:
     return {k: int(statistics.median(v)) for k, v in tu_times.items()}
 
 
-def collect_results(json_list):
-    tu_times = {}
-    immediate_deps = {}
-    object_files = {}
-    root_dir = sys.argv[1]
-    for tp in json_list:
-        print('    Processing', tp)
-        tu, all_nodes = process_trace(tp, root_dir)
-        for n in all_nodes.values():
-            if n.name not in tu_times:
-                tu_times[n.name] = []
-            tu_times[n.name].append(n.self_time)
-            immediate_deps[n.name] = set(c.name for c in n.children)
-        object_files[tu.name] = tp.replace('.o.time.json', '.o')
-    return MeasuringResults(median_build_times(tu_times), immediate_deps, object_files)
+# compact per-TU outcome of trace processing, cheap to send between processes
+class TuResult(NamedTuple):
+    name: str
+    total_time: int
+    nodes: List[Tuple[str, int, List[str]]]  # (name, self-time, names of immediate deps)
+
+
+def compact_trace(trace_path: str, root_dir: str) -> TuResult:
+    forest = process_trace(trace_path, root_dir)
+    names = forest.names
+    nodes = [(names[i], forest.self_times[i], [names[c] for c in forest.child_ids(i)]) for i in range(len(forest))]
+    return TuResult(names[0], forest.total_times[0], nodes)
+
+
+def _compact_trace_worker(args: Tuple[str, str]) -> Tuple[TuResult, int, int]:
+    hits, misses = PATHS.stats()
+    tu_result = compact_trace(*args)
+    return tu_result, PATHS.hits - hits, PATHS.misses - misses
+
+
+def collect_tu_results(json_list: Iterable[str], root_dir: str, jobs: int = 1,
+                       cache: Optional[ResultsCache] = None) -> List[Tuple[str, TuResult]]:
+    json_list = list(json_list)
+    cached = {}
+    if cache is not None:
+        for tp in json_list:
+            cached_result = cache.get(tp)
+            if cached_result is not None:
+                cached[tp] = TuResult(*cached_result)
+    todo = [tp for tp in json_list if tp not in cached]
+
+    processed = {}
+    if jobs <= 1 or not todo:
+        for tp in todo:
+            print('    Processing', tp)
+            processed[tp] = compact_trace(tp, root_dir)
+        print('   ', PATHS.report())
+    else:
+        hits = misses = 0
+        with multiprocessing.Pool(jobs) as pool:
+            tasks = ((tp, root_dir) for tp in todo)
+            for tp, (tu_result, h, m) in zip(todo, pool.imap(_compact_trace_worker, tasks, chunksize=4)):
+                print('    Processed', tp)
+                processed[tp] = tu_result
+                hits += h
+                misses += m
+        print('    path cache (all workers): {} hits, {} misses'.format(hits, misses))
+
+    if cache is not None:
+        for tp, tu_result in processed.items():
+            cache.put(tp, tu_result)
+        cache.prune(json_list)
+        cache.save()
+        print('   ', cache.report())
+
+    # results are kept in the input order, so merging gives exactly the same results as a serial uncached run
+    return [(tp, cached[tp] if tp in cached else processed[tp]) for tp in json_list]
+
+
+class ResultsMerger:
+    # merges TU results one at a time, the outcome only depends on the order they are added in
+    def __init__(self):
+        self.tu_times: Dict[str, List[int]] = {}
+        self.immediate_deps: Dict[str, Set[str]] = {}
+        self.object_files: Dict[str, str] = {}
+
+    def add(self, tp: str, tu_result: TuResult):
+        for name, self_time, children in tu_result.nodes:
+            if name not in self.tu_times:
+                self.tu_times[name] = []
+            self.tu_times[name].append(self_time)
+            self.immediate_deps[name] = set(children)
+        self.object_files[tu_result.name] = tp.replace('.o.time.json', '.o')
+
+    def results(self) -> MeasuringResults:
+        return MeasuringResults(median_build_times(self.tu_times), self.immediate_deps, self.object_files)
+
+
+def merge_tu_results(tu_results: Iterable[Tuple[str, TuResult]]) -> MeasuringResults:
+    merger = ResultsMerger()
+    for tp, tu_result in tu_results:
+        merger.add(tp, tu_result)
+    return merger.results()
+
+
+def collect_traces(json_list, root_dir: Optional[str] = None, jobs: int = 1, cache_path: Optional[str] = None,
+                   hash_traces: bool = False) -> List[Tuple[str, TuResult]]:
+    if root_dir is None:
+        root_dir = sys.argv[1]
+    cache = ResultsCache(cache_path, root_dir, hash_traces) if cache_path else None
+    return collect_tu_results(json_list, root_dir, jobs, cache)
+
+
+def collect_results(json_list, root_dir: Optional[str] = None, jobs: int = 1, cache_path: Optional[str] = None,
+                    hash_traces: bool = False):
+    return merge_tu_results(collect_traces(json_list, root_dir, jobs, cache_path, hash_traces))
 
 
 if __name__ == '__main__':
-    results = collect_results(glob.iglob(sys.argv[1] + '/**/*.o.time.json', recursive=True))
+    jobs = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    cache_path = sys.argv[3] if len(sys.argv) > 3 else None
+    results = collect_results(glob.iglob(sys.argv[1] + '/**/*.o.time.json', recursive=True), sys.argv[1], jobs,
+                              cache_path)
     open('results.json', 'w').write(results.to_json())
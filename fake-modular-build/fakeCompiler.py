@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# Stand-in for the compiler in the fake build: reads all its inputs (source and BMIs), writes the output and then holds
+# for the requested time, so I/O adds to the wait time like in the chain of shell commands it replaces with a single
+# process. It's meant to be run as "python3 -S", so that startup overhead stays small and stable.
+#
+# usage: fakeCompiler.py WAIT_TIME OUTPUT_SIZE OUTPUT SOURCE [BMI...]
+import sys
+import time
+
+SPIN_TIME = 0.001  # the end of the wait is spun, sleep() alone may oversleep by a scheduler tick
+CHUNK_SIZE = 1 << 20
+
+
+def hold_until(deadline: float):
+    remaining = deadline - time.perf_counter()
+    if remaining > SPIN_TIME:
+        time.sleep(remaining - SPIN_TIME)
+    while time.perf_counter() < deadline:
+        pass
+
+
+def main(argv):
+    wait_time = float(argv[1])
+    output_size = int(argv[2])
+    output = argv[3]
+    inputs = argv[4:]
+
+    for path in inputs:
+        with open(path, 'rb') as f:
+            while f.read(CHUNK_SIZE):
+                pass
+    chunk = bytes(min(output_size, CHUNK_SIZE))
+    with open(output, 'wb') as f:
+        while output_size > 0:
+            f.write(chunk[:output_size])
+            output_size -= len(chunk)
+
+    hold_until(time.perf_counter() + wait_time)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,130 @@
+import sys
+from typing import *
+
+import MeasuringResults
+
+
+def strongly_connected_components(nodes: List[str], deps: Mapping[str, Iterable[str]]) -> List[List[str]]:
+    # iterative Tarjan, components come out in dependencies-first order
+    index: Dict[str, int] = {}
+    low: Dict[str, int] = {}
+    on_stack = set()
+    stack = []
+    components = []
+    for root in nodes:
+        if root in index:
+            continue
+        work = [(root, iter(deps.get(root, ())))]
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = low[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(deps.get(child, ()))))
+                    break
+                elif child in on_stack:
+                    low[node] = min(low[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+    return components
+
+
+def transitive_reduction(deps: Mapping[str, Iterable[str]]) -> Dict[str, Set[str]]:
+    # Drops every edge v -> d for which d is also reachable through another dependency of v. Reachability is kept
+    # as one bitset (python int) per strongly connected component, indexed by component, and dropped as soon as
+    # all dependents of the component are processed. Edges of nodes inside include cycles are left as they are.
+    nodes = list(deps.keys())
+    for node_deps in list(deps.values()):
+        nodes.extend(d for d in node_deps if d not in deps)
+    components = strongly_connected_components(nodes, deps)
+    component_of = {}
+    for c, members in enumerate(components):
+        for member in members:
+            component_of[member] = c
+
+    # number of edges into each component from other components, to know when its bitset can be freed
+    users = [0] * len(components)
+    for node in deps:
+        for c in {component_of[d] for d in deps[node]} - {component_of[node]}:
+            users[c] += 1
+
+    reach: Dict[int, int] = {}  # component: bitset of components reachable from it, excluding itself
+    result: Dict[str, Set[str]] = {}
+    for c, members in enumerate(components):
+        component_reach = 0
+        for member in members:
+            member_deps = set(deps.get(member, ()))
+            cross = {component_of[d] for d in member_deps} - {c}
+            covered = 0
+            for d in cross:
+                covered |= reach[d]
+            for d in cross:
+                component_reach |= reach[d] | (1 << d)
+            if member in deps:
+                if len(members) > 1:
+                    result[member] = member_deps
+                else:
+                    result[member] = {d for d in member_deps if not covered >> component_of[d] & 1}
+            for d in cross:
+                users[d] -= 1
+                if not users[d]:
+                    del reach[d]
+        reach[c] = component_reach
+        if not users[c]:
+            del reach[c]
+    return result
+
+
+def transitive_deps(deps: Mapping[str, Iterable[str]]) -> Dict[str, Set[str]]:
+    # everything reachable from every node of deps, excluding the node itself, the same before and after transitive
+    # reduction. Returned sets may be shared between nodes and must not be modified.
+    nodes = list(deps.keys())
+    for node_deps in list(deps.values()):
+        nodes.extend(d for d in node_deps if d not in deps)
+    reach: Dict[str, Set[str]] = {}
+    for members in strongly_connected_components(nodes, deps):
+        component = set(members) if len(members) > 1 else set()
+        for member in members:
+            for d in deps.get(member, ()):
+                if d not in reach:
+                    continue  # in this component
+                component.add(d)
+                component |= reach[d]
+        for member in members:
+            reach[member] = component - {member} if len(members) > 1 else component
+    return {node: reach[node] for node in deps}
+
+
+def edge_count(deps: Mapping[str, Iterable[str]]) -> int:
+    return sum(len(d) for d in deps.values())
+
+
+def reduce_measurements(m: MeasuringResults.MeasuringResults) -> MeasuringResults.MeasuringResults:
+    return MeasuringResults.MeasuringResults(m.build_times, transitive_reduction(m.immediate_deps), m.object_files,
+                                             m.peak_memory)
+
+
+if __name__ == '__main__':
+    measuring_results = MeasuringResults.load(sys.argv[1])
+    reduced = reduce_measurements(measuring_results)
+    print('dependencies: {} -> {}'.format(edge_count(measuring_results.immediate_deps),
+                                          edge_count(reduced.immediate_deps)))
+    if len(sys.argv) > 2:
+        MeasuringResults.save(reduced, sys.argv[2])
@@ -0,0 +1,95 @@
+import json
+import re
+from typing import *
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class JsonStreamReader:
+    # Incremental reader for huge JSON documents: only one array element is decoded and kept in memory at a time,
+    # the rest of the file is read in fixed-size chunks
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, f: TextIO, chunk_size: int = CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self) -> Optional[str]:
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return None
+
+    def _expect(self, chars: str) -> str:
+        c = self._peek()
+        if c is None or c not in chars:
+            raise ValueError('Expected one of "{}" but got {!r} in {}'.format(chars, c, getattr(self.f, 'name', '?')))
+        self.pos += 1
+        return c
+
+    def _value(self) -> Any:
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # numbers and literals can be cut at the chunk boundary, make sure something follows them
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def _array(self) -> Iterator[Any]:
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._expect(',]') == ']':
+                return
+
+    def iter_array(self) -> Iterator[Any]:
+        # top-level array, e.g. compile_commands.json
+        return self._array()
+
+    def iter_object(self, streamed_key: str, fields: Dict[str, Any]) -> Iterator[Any]:
+        # top-level object: elements of array under streamed_key are yielded one by one,
+        # all other members are decoded as a whole and stored into fields
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            if key == streamed_key:
+                yield from self._array()
+            else:
+                fields[key] = self._value()
+            if self._expect(',}') == '}':
+                return
+
+
+def iter_json_array(path: str) -> Iterator[Any]:
+    with open(path) as f:
+        yield from JsonStreamReader(f).iter_array()
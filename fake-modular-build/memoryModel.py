@@ -0,0 +1,107 @@
+import math
+import sys
+from typing import *
+
+import MeasuringResults
+from bmiModel import fit, source_sizes
+from cdbToNinja import PEAK_RSS_SUFFIX
+
+
+class MemoryModel(NamedTuple):
+    # peak RSS = fixed + own_factor * source size + transitive_factor * total size of headers it transitively
+    # includes. It's fitted on measured TUs and applied to module compilations as well, which assumes importing a
+    # BMI costs as much memory as parsing its header, so it errs on the safe side.
+    fixed: float = 0.
+    own_factor: float = 0.
+    transitive_factor: float = 0.
+
+    def memory(self, own_size: int, transitive_size: int) -> int:
+        return max(0, int(self.fixed + self.own_factor * own_size + self.transitive_factor * transitive_size))
+
+    def __str__(self):
+        return '{:.1f}MB + {:.1f} * own + {:.1f} * transitive bytes'.format(self.fixed / 1e6, self.own_factor,
+                                                                            self.transitive_factor)
+
+
+def read_peak_memory(m: MeasuringResults.MeasuringResults, built: Optional[Iterable[str]] = None) -> Dict[str, int]:
+    # peak RSS of every TU recorded by the measuring build next to its object file, if built is given only object
+    # files in it are considered, others may have stale records of previous builds
+    built = set(built) if built is not None else None
+    result = {}
+    for name, object_file in m.object_files.items():
+        if built is not None and object_file not in built:
+            continue
+        try:
+            with open(object_file + PEAK_RSS_SUFFIX) as f:
+                result[name] = int(f.read())
+        except (OSError, ValueError):
+            continue
+    return result
+
+
+def fit_memory_model(m: MeasuringResults.MeasuringResults) -> Tuple[MemoryModel, int]:
+    if not m.peak_memory:
+        raise RuntimeError('No peak RSS measured for any TU')
+    own, transitive = source_sizes(m, with_sources=True)
+    samples = [(own[name], transitive[name], memory) for name, memory in m.peak_memory.items() if name in own]
+    if len(samples) < 3:
+        # not enough to fit anything, every edge is assumed to take as much as an average TU
+        return MemoryModel(sum(s[2] for s in samples) / len(samples) if samples else 0.), len(samples)
+    return MemoryModel(*fit(samples)), len(samples)
+
+
+def including_tu_memory(m: MeasuringResults.MeasuringResults) -> Dict[str, int]:
+    # least measured peak RSS of TUs including every header, directly or not, propagated down the include graph
+    bounds = dict(m.peak_memory or {})
+    work = list(bounds)
+    while work:
+        name = work.pop()
+        for dep in m.immediate_deps.get(name, ()):
+            if bounds[name] < bounds.get(dep, math.inf):
+                bounds[dep] = bounds[name]
+                work.append(dep)
+    return bounds
+
+
+def edge_memory(m: MeasuringResults.MeasuringResults, model: MemoryModel) -> Dict[str, int]:
+    # peak RSS of every edge of the fake build, measured for TUs where possible and modeled otherwise, a module
+    # can't take more than any TU parsing the same headers
+    own, transitive = source_sizes(m, with_sources=True)
+    measured = m.peak_memory or {}
+    bounds = including_tu_memory(m)
+    return {name: measured[name] if name in measured else
+            min(model.memory(own[name], transitive[name]), bounds.get(name, math.inf))
+            for name in m.build_times}
+
+
+def memory_pools(memory: Mapping[str, int], budget: int, parallelism: int) -> Tuple[Dict[str, int], Dict[str, str]]:
+    # Ninja pools limit the number of edges running at once, not their total weight, so the budget is approximated:
+    # edges light enough to run in every slot at once within the budget get no pool, heavier ones are bucketed by
+    # powers of two of that share, every bucket as deep as the budget allows at its upper bound. Buckets don't limit
+    # each other, so the budget holds for every bucket alone, the simulation tells the actual peak.
+    # Returns pool depths by pool name and pools by edge name.
+    if parallelism <= 0:
+        raise RuntimeError('Memory pools need a positive parallelism to be sized for, got {}'.format(parallelism))
+    share = budget / parallelism
+    depths = {}
+    pools = {}
+    for name, edge in memory.items():
+        if edge <= share:
+            continue
+        bucket = math.ceil(math.log2(edge / share))
+        pool = 'memory{}'.format(bucket)
+        depths[pool] = max(1, parallelism >> bucket)
+        pools[name] = pool
+    return depths, pools
+
+
+if __name__ == '__main__':
+    measuring_results = MeasuringResults.load(sys.argv[1])
+    if measuring_results.peak_memory is None:
+        measuring_results.peak_memory = read_peak_memory(measuring_results)
+    model, measured = fit_memory_model(measuring_results)
+    print('fitted on {} TUs: {}'.format(measured, model))
+    memory = edge_memory(measuring_results, model)
+    for name in sorted(memory, key=lambda n: -memory[n])[:int(sys.argv[2]) if len(sys.argv) > 2 else 10]:
+        print('{:>10.1f}MB {}{}'.format(memory[name] / 1e6, name, '' if name in measuring_results.peak_memory else
+                                         ' (modeled)'))
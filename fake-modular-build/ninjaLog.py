@@ -0,0 +1,259 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+from typing import *
+
+import MeasuringResults
+from createFakeBuild import MODE_VARIABLE, OverheadModel
+
+
+class LogEntry(NamedTuple):
+    start: float  # s since the start of the build
+    end: float
+    output: str
+    command_hash: str
+
+
+class Edge(NamedTuple):
+    outputs: List[str]
+    start: float
+    end: float
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class ScriptEdge(NamedTuple):
+    outputs: List[str]
+    inputs: List[str]  # explicit inputs
+    deps: List[str]  # implicit and order-only inputs
+    wait_time: Optional[float]  # requested wait time of fake build edges
+    variables: Dict[str, str]
+
+
+def read_ninja_log(path: str) -> List[LogEntry]:
+    # .ninja_log is appended to by every build, later entries for the same output win
+    entries: Dict[str, LogEntry] = {}
+    with open(path) as f:
+        header = f.readline()
+        if not header.startswith('# ninja log v'):
+            raise RuntimeError('{} is not a ninja log'.format(path))
+        version = int(header.split('v')[-1])
+        if version < 5:
+            raise RuntimeError('Unsupported ninja log version {} in {}'.format(version, path))
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 5:
+                continue
+            start, end, _, output, command_hash = fields
+            entries[output] = LogEntry(int(start) / 1000., int(end) / 1000., output, command_hash)
+    return list(entries.values())
+
+
+def group_edges(entries: Iterable[LogEntry]) -> List[Edge]:
+    # ninja logs every output of an edge separately with the same times and command
+    outputs: Dict[Tuple[float, float, str], List[str]] = {}
+    for e in entries:
+        outputs.setdefault((e.start, e.end, e.command_hash), []).append(e.output)
+    return sorted((Edge(o, start, end) for (start, end, _), o in outputs.items()), key=lambda e: (e.start, e.end))
+
+
+def read_ninja_script(path: str) -> Dict[str, ScriptEdge]:
+    # just enough of the ninja syntax to read the scripts generated here: one build statement per edge, paths
+    # without spaces, variables of the edge indented below it. Edges are keyed by every output.
+    edges: Dict[str, ScriptEdge] = {}
+    current = None
+    with open(path) as f:
+        for line in f:
+            if line.startswith('build '):
+                outputs, _, rest = line[len('build '):].partition(':')
+                tokens = rest.split()[1:]  # skip the rule
+                explicit = []
+                deps = []
+                target = explicit
+                for token in tokens:
+                    if token in ('|', '||'):
+                        target = deps
+                    else:
+                        target.append(token)
+                current = ScriptEdge(outputs.split(), explicit, deps, None, {})
+                for output in current.outputs:
+                    edges[output] = current
+            elif current is not None and line.startswith((' ', '\t')):
+                name, _, value = line.strip().partition('=')
+                current.variables[name.strip()] = value.strip()
+                if name.strip() == 'wait_time':
+                    current = current._replace(wait_time=float(value))
+                    for output in current.outputs:
+                        edges[output] = current
+            else:
+                current = None
+    return edges
+
+
+def read_build_mode(path: str) -> Optional[str]:
+    # mode of a fake build script, None for other scripts and fake builds created before it was recorded
+    with open(path) as f:
+        for line in f:
+            name, _, value = line.partition('=')
+            if not line.startswith((' ', '\t')) and name.strip() == MODE_VARIABLE:
+                return value.strip()
+    return None
+
+
+def schedule_stats(edges: List[Edge]) -> Dict[str, Any]:
+    if not edges:
+        return {'edges': 0, 'makespan': 0., 'busy_time': 0., 'average_concurrency': 0., 'max_concurrency': 0}
+    makespan = max(e.end for e in edges) - min(e.start for e in edges)
+    busy = sum(e.duration for e in edges)
+    # edges ending at the same millisecond another one starts don't overlap
+    events = sorted([(e.start, 1) for e in edges] + [(e.end, -1) for e in edges], key=lambda x: (x[0], x[1]))
+    concurrency = max_concurrency = 0
+    for _, delta in events:
+        concurrency += delta
+        max_concurrency = max(max_concurrency, concurrency)
+    return {'edges': len(edges), 'makespan': makespan, 'busy_time': busy,
+            'average_concurrency': busy / makespan if makespan else 0., 'max_concurrency': max_concurrency}
+
+
+def peak_concurrent_memory(edges: List[Edge], memory: Mapping[str, int]) -> Tuple[int, float]:
+    # max total memory of edges running at once and when it was reached, memory is by output of edges
+    events = []
+    for e in edges:
+        edge_memory = next((memory[o] for o in e.outputs if o in memory), 0)
+        events.append((e.start, 1, edge_memory))
+        events.append((e.end, -1, edge_memory))
+    events.sort(key=lambda x: (x[0], x[1]))
+    current = peak = 0
+    peak_time = 0.
+    for t, delta, edge_memory in events:
+        current += delta * edge_memory
+        if current > peak:
+            peak, peak_time = current, t
+    return peak, peak_time
+
+
+def actual_critical_path(edges: List[Edge], script: Mapping[str, ScriptEdge]) -> List[Dict[str, Any]]:
+    # Walks back from the edge which finished last, every time to the dependency which finished last, i.e. the
+    # one the edge was actually waiting for. delay is the time between that and the start of the edge, spent
+    # waiting for a free slot or in ninja itself.
+    by_output = {o: e for e in edges for o in e.outputs}
+    path = []
+    edge = max(edges, key=lambda e: e.end, default=None)
+    while edge is not None:
+        script_edge = script.get(edge.outputs[0])
+        deps = [by_output[d] for d in (script_edge.inputs + script_edge.deps if script_edge else ()) if d in by_output]
+        previous = max(deps, key=lambda e: e.end, default=None)
+        delay = edge.start - (previous.end if previous else 0.)
+        path.append({'output': edge.outputs[0], 'start': edge.start, 'duration': edge.duration, 'delay': delay})
+        edge = previous
+    return path[::-1]
+
+
+def edge_errors(edges: List[Edge], script: Mapping[str, ScriptEdge], m: MeasuringResults.MeasuringResults) \
+        -> List[Dict[str, Any]]:
+    # fake edges are joined to measurements by their source, which is the single explicit input
+    result = []
+    for edge in edges:
+        script_edge = script.get(edge.outputs[0])
+        if script_edge is None or len(script_edge.inputs) != 1 or script_edge.inputs[0] not in m.build_times:
+            continue
+        name = script_edge.inputs[0]
+        self_time = m.build_times[name] / 1000000.
+        result.append({'name': name, 'output': edge.outputs[0], 'self_time': self_time,
+                       'wait_time': script_edge.wait_time, 'duration': edge.duration,
+                       'error': edge.duration - self_time})
+    return result
+
+
+def error_stats(errors: List[Dict[str, Any]]) -> Dict[str, float]:
+    if not errors:
+        return {}
+    e = [x['error'] for x in errors]
+    return {'mean': statistics.mean(e), 'median': statistics.median(e),
+            'mean_absolute': statistics.mean(abs(x) for x in e), 'max': max(e), 'min': min(e),
+            'total_self_time': sum(x['self_time'] for x in errors),
+            'total_duration': sum(x['duration'] for x in errors)}
+
+
+def fit_overhead(samples: Sequence[Tuple[float, float]], mode: Optional[str] = None) -> OverheadModel:
+    # least squares fit of (requested wait time, observed duration) samples, if wait times don't vary enough to
+    # fit the scale it's assumed to be 1 and only the fixed overhead is estimated
+    if not samples:
+        return OverheadModel(mode=mode)
+    n = len(samples)
+    mean_w = sum(w for w, _ in samples) / n
+    mean_d = sum(d for _, d in samples) / n
+    var_w = sum((w - mean_w) ** 2 for w, _ in samples)
+    if var_w > 1e-9 * n:
+        scale = sum((w - mean_w) * (d - mean_d) for w, d in samples) / var_w
+        if scale > 0:
+            return OverheadModel(mean_d - scale * mean_w, scale, mode)
+    return OverheadModel(statistics.median(d - w for w, d in samples), 1., mode)
+
+
+def analyze_build(build_dir: str, m: Optional[MeasuringResults.MeasuringResults] = None,
+                  worst: int = 10) -> Dict[str, Any]:
+    edges = group_edges(read_ninja_log(os.path.join(build_dir, '.ninja_log')))
+    script_path = os.path.join(build_dir, 'build.ninja')
+    script = read_ninja_script(script_path)
+    result = {'build_dir': build_dir, 'schedule': schedule_stats(edges),
+              'critical_path': actual_critical_path(edges, script),
+              'longest_edges': [{'output': e.outputs[0], 'duration': e.duration}
+                                for e in sorted(edges, key=lambda e: -e.duration)[:worst]]}
+    if m is not None:
+        errors = edge_errors(edges, script, m)
+        result['errors'] = error_stats(errors)
+        result['worst_edges'] = sorted(errors, key=lambda x: -abs(x['error']))[:worst]
+        samples = [(x['wait_time'], x['duration']) for x in errors if x['wait_time'] is not None]
+        if samples:
+            result['overhead_model'] = fit_overhead(samples, read_build_mode(script_path))._asdict()
+    return result
+
+
+def format_analysis(name: str, a: Mapping[str, Any]) -> str:
+    s = a['schedule']
+    cp = a['critical_path']
+    lines = ['{} build: {} edges in {:.2f}s, {:.2f}s busy, average concurrency {:.2f}, max {}'.format(
+        name, s['edges'], s['makespan'], s['busy_time'], s['average_concurrency'], s['max_concurrency']),
+        '    actual critical path: {} edges, {:.2f}s running, {:.2f}s waiting'.format(
+            len(cp), sum(x['duration'] for x in cp), sum(x['delay'] for x in cp))]
+    if a.get('errors'):
+        e = a['errors']
+        lines.append('    per-edge error vs self-time: mean {:+.2f}ms, median {:+.2f}ms, mean absolute {:.2f}ms'.format(
+            e['mean'] * 1000., e['median'] * 1000., e['mean_absolute'] * 1000.))
+    if a.get('overhead_model'):
+        lines.append('    fitted edge overhead: {}'.format(OverheadModel(**a['overhead_model'])))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyze .ninja_log of a measuring or fake build')
+
+    parser.add_argument('build_dir', help='directory with build.ninja and .ninja_log')
+    parser.add_argument('--results-path', help='measuring results the fake build was created from, to compare '
+                                               'observed edge times with measured ones')
+    parser.add_argument('--output-path', help='path to dump the whole analysis as JSON')
+    parser.add_argument('--overhead-model-path', help='path to dump the fitted overhead model for createFakeBuild.py')
+    parser.add_argument('--worst', help='number of worst edges to keep', type=int, default=10)
+    args = parser.parse_args()
+
+    m = MeasuringResults.load(args.results_path) if args.results_path else None
+    analysis = analyze_build(args.build_dir, m, args.worst)
+    print(format_analysis(os.path.basename(os.path.normpath(args.build_dir)), analysis))
+    if args.output_path:
+        with open(args.output_path, 'w') as f:
+            json.dump(analysis, f, indent=2)
+    if args.overhead_model_path:
+        if 'overhead_model' not in analysis:
+            print('no fake build edges to fit the overhead model to', file=sys.stderr)
+            return 1
+        with open(args.overhead_model_path, 'w') as f:
+            json.dump(analysis['overhead_model'], f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+import sys
+from typing import *
+
+import MeasuringResults
+from createFakeBuild import measurements_to_ninja
+from graphReduction import reduce_measurements
+from predictModularBuild import default_parallelism, format_prediction, predict
+
+DEFAULT_IMPORT_OVERHEAD_US = 1000  # added to the importer for every module it imports
+DEFAULT_MAX_EVALUATIONS = 200
+
+
+class Partition:
+    # Grouping of headers into modules as a union-find over headers, with the module graph (modules and TUs as
+    # nodes) maintained on every merge, so that cycles can be rejected before a merge is simulated
+    def __init__(self, m: MeasuringResults.MeasuringResults):
+        self.m = m
+        self.headers = [name for name in m.build_times if not m.object_files.get(name)]
+        header_set = set(self.headers)
+        self.parent = {name: name for name in self.headers}
+        self.members = {name: [name] for name in self.headers}
+        self.times = {name: m.build_times[name] for name in self.headers}
+        nodes = list(m.build_times)
+        self.deps: Dict[str, Set[str]] = {n: {d for d in m.immediate_deps.get(n, ()) if d in header_set} for n in nodes}
+        self.users: Dict[str, Set[str]] = {n: set() for n in nodes}
+        for n, deps in self.deps.items():
+            for d in deps:
+                self.users[d].add(n)
+
+    def find(self, name: str) -> str:
+        root = name
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[name] != root:
+            self.parent[name], name = root, self.parent[name]
+        return root
+
+    def snapshot(self):
+        return (dict(self.parent), {k: list(v) for k, v in self.members.items()}, dict(self.times),
+                {k: set(v) for k, v in self.deps.items()}, {k: set(v) for k, v in self.users.items()})
+
+    def restore(self, snapshot):
+        self.parent, self.members, self.times, self.deps, self.users = snapshot
+
+    def _reaches(self, start: str, target: str) -> bool:
+        # is target reachable from start through at least one other module
+        stack = [d for d in self.deps[start] if d != target]
+        seen = set(stack)
+        while stack:
+            node = stack.pop()
+            if node == target:
+                return True
+            for d in self.deps[node]:
+                if d not in seen:
+                    seen.add(d)
+                    stack.append(d)
+        return False
+
+    def can_merge(self, a: str, b: str) -> bool:
+        return not self._reaches(a, b) and not self._reaches(b, a)
+
+    def merge(self, a: str, b: str):
+        # b is merged into a
+        self.parent[b] = a
+        self.members[a].extend(self.members.pop(b))
+        self.times[a] += self.times.pop(b)
+        for d in self.deps.pop(b):
+            self.users[d].discard(b)
+            if d != a:
+                self.deps[a].add(d)
+                self.users[d].add(a)
+        for u in self.users.pop(b):
+            self.deps[u].discard(b)
+            if u != a:
+                self.deps[u].add(a)
+                self.users[a].add(u)
+        self.deps[a].discard(a)
+        self.users[a].discard(a)
+
+    def modules(self) -> Dict[str, List[str]]:
+        return dict(self.members)
+
+    def to_measurements(self, import_overhead_us: int = DEFAULT_IMPORT_OVERHEAD_US) \
+            -> MeasuringResults.MeasuringResults:
+        # every module is named after its first header, which is also the fake input of its BMI edge
+        build_times = {}
+        immediate_deps = {}
+        for n, deps in self.deps.items():
+            time = self.times[n] if n in self.times else self.m.build_times[n]
+            build_times[n] = time + len(deps) * import_overhead_us
+            immediate_deps[n] = set(deps)
+        return MeasuringResults.MeasuringResults(build_times, immediate_deps, self.m.object_files, self.m.peak_memory)
+
+
+class Constraints(NamedTuple):
+    max_module_time: Optional[int] = None  # us, sum of self-times of module's headers
+    max_module_headers: Optional[int] = None
+    keep_directories: bool = True  # modules never span directories
+
+
+def merge_candidates(p: Partition, constraints: Constraints) -> List[Tuple[str, str]]:
+    # include edges between headers, cheapest first: merging tiny modules saves the most overhead per
+    # serialized second
+    candidates = []
+    for h in p.headers:
+        for d in p.deps[h]:
+            if constraints.keep_directories and os.path.dirname(h) != os.path.dirname(d):
+                continue
+            candidates.append((p.times[h] + p.times[d], h, d))
+    candidates.sort()
+    return [(h, d) for _, h, d in candidates]
+
+
+def allowed(p: Partition, a: str, b: str, constraints: Constraints) -> bool:
+    if a == b:
+        return False
+    if constraints.max_module_time is not None and p.times[a] + p.times[b] > constraints.max_module_time:
+        return False
+    if constraints.max_module_headers is not None and \
+            len(p.members[a]) + len(p.members[b]) > constraints.max_module_headers:
+        return False
+    return p.can_merge(a, b)
+
+
+def optimize_partition(m: MeasuringResults.MeasuringResults, parallelism: int, constraints: Constraints = Constraints(),
+                       import_overhead_us: int = DEFAULT_IMPORT_OVERHEAD_US,
+                       max_evaluations: int = DEFAULT_MAX_EVALUATIONS) -> Tuple[Partition, float, float]:
+    # Batched hill climbing: a batch of the next candidate merges is applied and the whole build is simulated.
+    # If predicted time doesn't get worse the batch is kept and the next one is twice as large, otherwise it's
+    # rolled back and retried at half the size, a single merge which makes things worse is skipped.
+    p = Partition(m)
+    initial = best = predict(p.to_measurements(import_overhead_us), parallelism).makespan
+    candidates = merge_candidates(p, constraints)
+    position = 0
+    batch = 1
+    evaluations = 1
+    while position < len(candidates) and evaluations < max_evaluations:
+        snapshot = p.snapshot()
+        merged = 0
+        end = position
+        while end < len(candidates) and merged < batch:
+            a, b = (p.find(x) for x in candidates[end])
+            end += 1
+            if allowed(p, a, b, constraints):
+                p.merge(a, b)
+                merged += 1
+        if not merged:
+            break
+        makespan = predict(p.to_measurements(import_overhead_us), parallelism).makespan
+        evaluations += 1
+        if makespan <= best:
+            best = makespan
+            position = end
+            batch *= 2
+        else:
+            p.restore(snapshot)
+            if batch == 1:
+                position = end
+            batch = max(1, batch // 2)
+    return p, initial, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Group headers into modules to minimize predicted build time')
+
+    parser.add_argument('--results-path', help='path to measuring results (JSON or binary)', required=True)
+    parser.add_argument('--output-path', help='fake build directory for the grouped build', required=True)
+    parser.add_argument('-j', help='parallelism to optimize for (default: same as ninja)', type=int,
+                        dest='parallelism')
+    parser.add_argument('--max-module-time', help='max total self-time of headers in a module, us', type=int)
+    parser.add_argument('--max-module-headers', help='max number of headers in a module', type=int)
+    parser.add_argument('--allow-cross-directory', help='allow modules spanning several directories',
+                        default=False, action='store_true')
+    parser.add_argument('--import-overhead', help='time added to an importer per imported module, us', type=int,
+                        default=DEFAULT_IMPORT_OVERHEAD_US)
+    parser.add_argument('--max-evaluations', help='max number of build simulations', type=int,
+                        default=DEFAULT_MAX_EVALUATIONS)
+    args = parser.parse_args()
+
+    measuring_results = reduce_measurements(MeasuringResults.load(args.results_path))
+    parallelism = args.parallelism or default_parallelism()
+    constraints = Constraints(args.max_module_time, args.max_module_headers, not args.allow_cross_directory)
+    partition, initial, best = optimize_partition(measuring_results, parallelism, constraints, args.import_overhead,
+                                                  args.max_evaluations)
+    modules = partition.modules()
+    print('{} headers grouped into {} modules, predicted -j{} build: {:.2f}s -> {:.2f}s'.format(
+        len(partition.headers), len(modules), parallelism, initial, best))
+    grouped = partition.to_measurements(args.import_overhead)
+    print(format_prediction(predict(grouped, parallelism)))
+
+    os.makedirs(os.path.join(args.output_path, 'BMI'), exist_ok=True)
+    with open(os.path.join(args.output_path, 'modules.json'), 'w') as f:
+        json.dump(modules, f, indent=2)
+    with open(os.path.join(args.output_path, 'build.ninja'), 'w') as f:
+        f.write(measurements_to_ninja(grouped, args.output_path))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+import os
+from collections import OrderedDict
+from typing import *
+
+
+class PathInterner:
+    # Only the LRU of raw spellings is bounded by max_size. The id tables are unbounded on purpose: they keep one
+    # entry per unique canonical path, i.e. per header and source of the build, and cached ids must stay valid.
+    def __init__(self, max_size: int = 65536):
+        self.max_size = max_size
+        self.resolved: 'OrderedDict[Tuple[str, str], int]' = OrderedDict()  # LRU of (raw path, root dir): id
+        self.ids: Dict[str, int] = {}  # canonical path: id
+        self.paths: List[str] = []  # id: canonical path
+        self.hits = 0
+        self.misses = 0
+
+    def intern(self, path: str, root_dir: str) -> int:
+        # root_dir only matters for relative paths, so keep absolute ones shared between roots
+        key = (path, '' if os.path.isabs(path) else root_dir)
+        path_id = self.resolved.get(key)
+        if path_id is not None:
+            self.hits += 1
+            self.resolved.move_to_end(key)
+            return path_id
+
+        self.misses += 1
+        canonical = os.path.normpath(os.path.realpath(os.path.join(root_dir, path)))
+        path_id = self.ids.get(canonical)
+        if path_id is None:
+            path_id = len(self.paths)
+            self.ids[canonical] = path_id
+            self.paths.append(canonical)
+
+        self.resolved[key] = path_id
+        if len(self.resolved) > self.max_size:
+            self.resolved.popitem(last=False)
+        return path_id
+
+    def path(self, path_id: int) -> str:
+        return self.paths[path_id]
+
+    def canonical(self, path: str, root_dir: str) -> str:
+        return self.paths[self.intern(path, root_dir)]
+
+    def stats(self) -> Tuple[int, int]:
+        return self.hits, self.misses
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        return 'path cache: {} hits, {} misses ({:.1f}% hit rate), {} unique paths'.format(
+            self.hits, self.misses, 100. * self.hits / total if total else 0., len(self.paths))
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# Runs a compiler command of the measuring build and writes its peak RSS in bytes to OUTPUT. Like fakeCompiler.py
+# it's meant to be run as "python3 -S", so that it adds as little as possible to every edge.
+#
+# usage: peakRss.py OUTPUT COMMAND [ARG...]
+import os
+import sys
+
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024  # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+
+
+def main(argv):
+    output = argv[1]
+    command = argv[2:]
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.execvp(command[0], command)
+        except OSError as e:
+            print('{}: {}'.format(command[0], e), file=sys.stderr)
+        os._exit(127)
+    # rusage of the child covers everything it waited for itself, e.g. cc1 run by the driver out of process
+    _, status, usage = os.wait4(pid, 0)
+    with open(output, 'w') as f:
+        f.write('{}\n'.format(usage.ru_maxrss * MAXRSS_UNIT))
+    code = os.waitstatus_to_exitcode(status)
+    return code if code >= 0 else 128 - code
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
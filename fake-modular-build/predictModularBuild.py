@@ -0,0 +1,249 @@
+import argparse
+import heapq
+import os
+import sys
+
+import MeasuringResults
+from createFakeBuild import MIN_TIME_TO_SPAWN_COMPILER
+from memoryModel import edge_memory, fit_memory_model, memory_pools
+from typing import *
+
+
+class BuildGraph:
+    # Same graph as the one measurements_to_ninja generates: one edge per measured node (object edges for sources,
+    # BMI edges for headers), each depending on the BMIs of its immediate deps. Nodes are integer ids with
+    # CSR-style dependency lists. Optionally nodes have peak memory and belong to ninja pools (-1 for none).
+    def __init__(self, names: List[str], durations: List[float], is_object: List[bool], dep_offsets: List[int],
+                 deps: List[int], memory: Optional[List[int]] = None, pools: Optional[List[int]] = None,
+                 pool_depths: Optional[List[int]] = None):
+        self.names = names
+        self.durations = durations
+        self.is_object = is_object
+        self.dep_offsets = dep_offsets
+        self.deps = deps
+        self.memory = memory if memory is not None else [0] * len(names)
+        self.pools = pools if pools is not None else [-1] * len(names)
+        self.pool_depths = pool_depths or []
+
+    def __len__(self):
+        return len(self.names)
+
+    def node_deps(self, node: int) -> List[int]:
+        return self.deps[self.dep_offsets[node]:self.dep_offsets[node + 1]]
+
+    def dependents(self) -> Tuple[List[int], List[int]]:
+        # reversed graph in the same CSR form
+        counts = [0] * (len(self) + 1)
+        for d in self.deps:
+            counts[d + 1] += 1
+        for i in range(len(self)):
+            counts[i + 1] += counts[i]
+        fill = counts[:-1]
+        result = [0] * len(self.deps)
+        for node in range(len(self)):
+            for d in self.node_deps(node):
+                result[fill[d]] = node
+                fill[d] += 1
+        return counts, result
+
+    def topological_order(self) -> List[int]:
+        offsets, dependents = self.dependents()
+        pending = [self.dep_offsets[n + 1] - self.dep_offsets[n] for n in range(len(self))]
+        order = [n for n in range(len(self)) if not pending[n]]
+        for node in order:
+            for user in dependents[offsets[node]:offsets[node + 1]]:
+                pending[user] -= 1
+                if not pending[user]:
+                    order.append(user)
+        if len(order) != len(self):
+            raise RuntimeError('Dependency cycle between {} nodes'.format(len(self) - len(order)))
+        return order
+
+
+def build_graph(m: MeasuringResults.MeasuringResults, spawn_time: float = MIN_TIME_TO_SPAWN_COMPILER,
+                min_time: float = 0., memory: Optional[Mapping[str, int]] = None,
+                pools: Optional[Tuple[Mapping[str, int], Mapping[str, str]]] = None) -> BuildGraph:
+    # spawn_time is added to every edge, min_time is the shortest possible edge (fake compiler overhead),
+    # memory is peak memory of edges by name and pools are the same as for measurements_to_ninja
+    names = list(m.build_times.keys())
+    ids = {name: i for i, name in enumerate(names)}
+    durations = [max(m.build_times[name] / 1000000. + spawn_time, min_time) for name in names]
+    is_object = [bool(m.object_files.get(name)) for name in names]
+    dep_offsets = [0]
+    deps = []
+    for name in names:
+        # deps without measurements have no edge of their own, the same BMI would be a missing input for ninja
+        deps.extend(ids[d] for d in m.immediate_deps.get(name, ()) if d in ids)
+        dep_offsets.append(len(deps))
+    node_memory = [memory.get(name, 0) for name in names] if memory is not None else None
+    node_pools = pool_depths = None
+    if pools is not None:
+        pool_names = sorted(pools[0])
+        pool_ids = {pool: i for i, pool in enumerate(pool_names)}
+        pool_depths = [pools[0][pool] for pool in pool_names]
+        node_pools = [pool_ids[pools[1][name]] if name in pools[1] else -1 for name in names]
+    return BuildGraph(names, durations, is_object, dep_offsets, deps, node_memory, node_pools, pool_depths)
+
+
+def critical_path(graph: BuildGraph) -> Tuple[float, List[int]]:
+    finish = [0.] * len(graph)
+    via = [-1] * len(graph)
+    for node in graph.topological_order():
+        start = 0.
+        for d in graph.node_deps(node):
+            if finish[d] > start:
+                start = finish[d]
+                via[node] = d
+        finish[node] = start + graph.durations[node]
+    if not finish:
+        return 0., []
+    node = max(range(len(graph)), key=finish.__getitem__)
+    length = finish[node]
+    path = []
+    while node != -1:
+        path.append(node)
+        node = via[node]
+    return length, path[::-1]
+
+
+def default_parallelism() -> int:
+    # same as ninja's default -j
+    cpus = os.cpu_count() or 1
+    return 2 if cpus <= 1 else 3 if cpus == 2 else cpus + 2
+
+
+def parallelism_arg(value: str) -> int:
+    # argparse type for -j values, ninja's -j0 (no limit) has no number of slots to simulate or size pools for
+    parallelism = int(value)
+    if parallelism <= 0:
+        raise argparse.ArgumentTypeError('parallelism must be positive, got {}'.format(parallelism))
+    return parallelism
+
+
+class Prediction(NamedTuple):
+    parallelism: int
+    makespan: float
+    critical_path_time: float
+    critical_path: List[str]
+    utilization: float  # busy core-seconds / (parallelism * makespan)
+    max_concurrency: int
+    peak_memory: int = 0  # max total memory of edges running at once, bytes
+
+
+def simulate(graph: BuildGraph, parallelism: int, critical_first: bool = True) -> Prediction:
+    # Discrete-event list scheduling: whenever a slot is free the ready edge with the longest remaining
+    # critical path is started (like ninja >= 1.12 does), or the one that became ready first otherwise.
+    # Ready edges of a full pool wait aside until an edge of the pool finishes, like in ninja.
+    if parallelism <= 0:
+        raise RuntimeError('Parallelism must be positive, got {}'.format(parallelism))
+    cp_time, cp_nodes = critical_path(graph)
+    offsets, dependents = graph.dependents()
+
+    if critical_first:
+        # longest path from a node to the end of the build
+        tail = [0.] * len(graph)
+        for node in reversed(graph.topological_order()):
+            tail[node] = graph.durations[node] + max(
+                (tail[u] for u in dependents[offsets[node]:offsets[node + 1]]), default=0.)
+        priority = [-t for t in tail]
+    else:
+        priority = list(range(len(graph)))
+
+    pending = [graph.dep_offsets[n + 1] - graph.dep_offsets[n] for n in range(len(graph))]
+    ready = [(priority[n], n) for n in range(len(graph)) if not pending[n]]
+    heapq.heapify(ready)
+    running = []  # heap of (finish time, node)
+    in_pool = [0] * len(graph.pool_depths)
+    delayed = [[] for _ in graph.pool_depths]  # heaps of ready edges waiting for their pool
+    now = 0.
+    busy = 0.
+    max_concurrency = 0
+    memory = peak_memory = 0
+    finished = 0
+    while ready or running:
+        while ready and len(running) < parallelism:
+            entry = heapq.heappop(ready)
+            node = entry[1]
+            pool = graph.pools[node]
+            if pool >= 0:
+                if in_pool[pool] >= graph.pool_depths[pool]:
+                    heapq.heappush(delayed[pool], entry)
+                    continue
+                in_pool[pool] += 1
+            heapq.heappush(running, (now + graph.durations[node], node))
+            busy += graph.durations[node]
+            memory += graph.memory[node]
+        max_concurrency = max(max_concurrency, len(running))
+        peak_memory = max(peak_memory, memory)
+
+        now, node = heapq.heappop(running)
+        memory -= graph.memory[node]
+        pool = graph.pools[node]
+        if pool >= 0:
+            in_pool[pool] -= 1
+            if delayed[pool]:
+                heapq.heappush(ready, heapq.heappop(delayed[pool]))
+        finished += 1
+        for user in dependents[offsets[node]:offsets[node + 1]]:
+            pending[user] -= 1
+            if not pending[user]:
+                heapq.heappush(ready, (priority[user], user))
+
+    assert finished == len(graph)
+    return Prediction(parallelism, now, cp_time, [graph.names[n] for n in cp_nodes],
+                      busy / (parallelism * now) if now else 0., max_concurrency, peak_memory)
+
+
+def predict(m: MeasuringResults.MeasuringResults, parallelism: Optional[int] = None,
+            spawn_time: float = MIN_TIME_TO_SPAWN_COMPILER, critical_first: bool = True, min_time: float = 0.,
+            memory: Optional[Mapping[str, int]] = None,
+            pools: Optional[Tuple[Mapping[str, int], Mapping[str, str]]] = None) -> Prediction:
+    return simulate(build_graph(m, spawn_time, min_time, memory, pools), parallelism or default_parallelism(),
+                    critical_first)
+
+
+def format_prediction(p: Prediction) -> str:
+    return '-j{}: makespan {:.2f}s, critical path {:.2f}s ({} edges), utilization {:.1f}%, max concurrency {}{}'.format(
+        p.parallelism, p.makespan, p.critical_path_time, len(p.critical_path), 100. * p.utilization,
+        p.max_concurrency, ', peak memory {:.2f}GB'.format(p.peak_memory / 1e9) if p.peak_memory else '')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Predict fake modular build time without running it')
+
+    parser.add_argument('--results-path', help='path to measuring results (JSON or binary)', required=True)
+    parser.add_argument('-j', help='parallelism to predict for, may be repeated (default: same as ninja)',
+                        type=parallelism_arg, action='append', dest='parallelism')
+    parser.add_argument('--spawn-time', help='per-edge overhead in seconds', type=float,
+                        default=MIN_TIME_TO_SPAWN_COMPILER)
+    parser.add_argument('--min-time', help='shortest possible edge in seconds', type=float, default=0.)
+    parser.add_argument('--fifo', help='start ready edges in order instead of by critical path', default=False,
+                        action='store_true')
+    parser.add_argument('--memory-budget', help='memory budget in GB the fake build has memory pools for, needs '
+                                                'peak RSS in the results', type=float)
+    parser.add_argument('--show-critical-path', default=False, action='store_true')
+    args = parser.parse_args()
+
+    m = MeasuringResults.load(args.results_path)
+    memory = None
+    if m.peak_memory:
+        memory_model, measured = fit_memory_model(m)
+        print('memory model fitted on {} TUs: {}'.format(measured, memory_model))
+        memory = edge_memory(m, memory_model)
+    elif args.memory_budget:
+        parser.error('no peak RSS in {}'.format(args.results_path))
+    graph = build_graph(m, args.spawn_time, args.min_time, memory)
+    print('{} edges ({} objects), {} dependencies'.format(len(graph), sum(graph.is_object), len(graph.deps)))
+    for parallelism in args.parallelism or [default_parallelism()]:
+        if args.memory_budget:
+            # pools are sized for the parallelism the fake build is run with
+            graph = build_graph(m, args.spawn_time, args.min_time, memory,
+                                memory_pools(memory, int(args.memory_budget * 1e9), parallelism))
+        prediction = simulate(graph, parallelism, not args.fifo)
+        print(format_prediction(prediction))
+    if args.show_critical_path:
+        print('\n'.join(prediction.critical_path))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
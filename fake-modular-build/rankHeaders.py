@@ -0,0 +1,254 @@
+import argparse
+import glob
+import heapq
+import json
+import statistics
+import sys
+from typing import *
+
+import MeasuringResults
+from dependenciesForest import TuResult, collect_traces, merge_tu_results
+
+DEFAULT_LOAD_FACTOR = 0.1  # BMI load time as a fraction of the module's own build time, paid by every importer
+
+
+class HeaderStats(NamedTuple):
+    name: str
+    total_time: int  # self-time summed over all TUs
+    includers: int  # TUs which parse it
+    module_time: int  # build time as a module (median self-time)
+    saving: int  # serial build time saved by turning only this header into a module
+
+
+def header_stats(m: MeasuringResults.MeasuringResults, tu_results: Iterable[Tuple[str, TuResult]],
+                 load_factor: float = DEFAULT_LOAD_FACTOR) -> Dict[str, HeaderStats]:
+    # as a header it's parsed in every includer, as a module it's built once and loaded by every importer
+    times: Dict[str, List[int]] = {}
+    for _, tu in tu_results:
+        for name, self_time, _ in tu.nodes:
+            if name != tu.name:
+                times.setdefault(name, []).append(self_time)
+    result = {}
+    for name, t in times.items():
+        if m.object_files.get(name):
+            continue  # sources are never turned into modules
+        module_time = m.build_times.get(name, int(statistics.median(t)))
+        total_time = sum(t)
+        saving = int(total_time - module_time - len(t) * load_factor * module_time)
+        result[name] = HeaderStats(name, total_time, len(t), module_time, saving)
+    return result
+
+
+class ClosureSums:
+    # Headers are numbered, and the transitive closure of every header (itself and all headers it includes) is a
+    # bitset. Sums of savings over any set of headers are computed from bit-planes of the savings: sum over a set
+    # is sum of 2^k * popcount(set & plane_k), so each sum costs a few dozen big int operations, no matter how large
+    # the set is. This is what makes repeated re-evaluation of candidates cheap.
+    # includers is the transposed relation: bitsets of the headers whose closure contains every header.
+    def __init__(self, names: List[str], deps: Mapping[str, Iterable[str]], values: Mapping[str, int]):
+        self.names = names
+        self.ids = {name: i for i, name in enumerate(names)}
+        self.values = [values[n] for n in names]
+        children = [[self.ids[d] for d in deps.get(name, ()) if d in self.ids] for name in names]
+        parents: List[List[int]] = [[] for _ in names]
+        for i, cs in enumerate(children):
+            for c in cs:
+                parents[c].append(i)
+        self.closures = self._reachable(children)
+        self.includers = self._reachable(parents)
+        self.positive_planes = self._planes([max(0, v) for v in self.values])
+        self.negative_planes = self._planes([max(0, -v) for v in self.values])
+
+    @staticmethod
+    def _reachable(children: List[List[int]]) -> List[int]:
+        # bitset of everything reachable from every node, itself included. Include cycles merged from different TUs
+        # are strongly connected components sharing one bitset, found by iterative Tarjan (include chains can be
+        # deeper than the recursion limit), which completes every component after all components reachable from it.
+        n = len(children)
+        index = [-1] * n
+        low = [0] * n
+        on_stack = [False] * n
+        stack: List[int] = []
+        result = [0] * n
+        counter = 0
+        for root in range(n):
+            if index[root] >= 0:
+                continue
+            work = [(root, 0)]
+            while work:
+                i, position = work[-1]
+                if position == 0:
+                    index[i] = low[i] = counter
+                    counter += 1
+                    stack.append(i)
+                    on_stack[i] = True
+                if position < len(children[i]):
+                    work[-1] = (i, position + 1)
+                    c = children[i][position]
+                    if index[c] < 0:
+                        work.append((c, 0))
+                    elif on_stack[c]:
+                        low[i] = min(low[i], index[c])
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[i])
+                if low[i] != index[i]:
+                    continue
+                members = []
+                while not members or members[-1] != i:
+                    members.append(stack.pop())
+                    on_stack[members[-1]] = False
+                bits = 0
+                for m in members:
+                    bits |= 1 << m
+                    for c in children[m]:
+                        bits |= result[c]  # 0 for members, which are set below
+                for m in members:
+                    result[m] = bits
+        return result
+
+    @staticmethod
+    def _planes(values: List[int]) -> List[int]:
+        planes = []
+        for k in range(max(values, default=0).bit_length()):
+            plane = 0
+            for i, v in enumerate(values):
+                if v >> k & 1:
+                    plane |= 1 << i
+            planes.append(plane)
+        return planes
+
+    def sum(self, bits: int) -> int:
+        positive = sum((bits & plane).bit_count() << k for k, plane in enumerate(self.positive_planes))
+        negative = sum((bits & plane).bit_count() << k for k, plane in enumerate(self.negative_planes))
+        return positive - negative
+
+    def members(self, bits: int) -> List[str]:
+        return [self.names[i] for i in self.indices(bits)]
+
+    @staticmethod
+    def indices(bits: int) -> List[int]:
+        # through the binary string, peeling off the lowest bit is a big int operation per member
+        digits = bin(bits)[:1:-1]  # least significant first, without '0b'
+        result = []
+        i = digits.find('1')
+        while i >= 0:
+            result.append(i)
+            i = digits.find('1', i + 1)
+        return result
+
+
+class PlanStep(NamedTuple):
+    header: str
+    converted: List[str]  # headers newly turned into modules at this step: the header and its remaining deps
+    saving: int
+    total_saving: int
+
+
+def migration_plan(sums: ClosureSums, steps: Optional[int] = None) -> List[PlanStep]:
+    # Greedy plan: at every step convert the header (with all its not yet converted deps, since modules can't
+    # include headers) which saves the most per converted header. Converting a header changes the value of every
+    # candidate including any of the converted headers, in either direction: converting a dep with a negative saving
+    # makes the others including it more attractive. The remaining saving and size of every candidate are kept up to
+    # date through includers of the newly converted headers, so a step costs as much as the candidates it touches.
+    # Candidates whose value grew are pushed right away, the others are refreshed when their stale entry is popped,
+    # so heap keys never underestimate a candidate and the first current entry popped is the best one.
+    n = len(sums.names)
+    saving = [sums.sum(closure) for closure in sums.closures]
+    count = [closure.bit_count() for closure in sums.closures]
+
+    def ratio(i: int) -> float:
+        return saving[i] / count[i] if count[i] else float('-inf')
+
+    keys = [-ratio(i) for i in range(n)]
+    heap = [(key, i) for i, key in enumerate(keys)]
+    heapq.heapify(heap)
+
+    converted = 0
+    plan = []
+    total = 0
+    while heap and (steps is None or len(plan) < steps):
+        key, i = heapq.heappop(heap)
+        if converted >> i & 1 or key != keys[i]:
+            continue  # converted or superseded
+        if key != -ratio(i):
+            keys[i] = -ratio(i)  # dropped since pushed
+            heapq.heappush(heap, (keys[i], i))
+            continue
+        if saving[i] <= 0:
+            break  # the entry is current, so no other candidate saves anything either
+        new = sums.closures[i] & ~converted
+        converted |= new
+        total += saving[i]
+        plan.append(PlanStep(sums.names[i], sums.members(new), saving[i], total))
+        touched = set()
+        for k in sums.indices(new):
+            for j in sums.indices(sums.includers[k] & ~converted):
+                saving[j] -= sums.values[k]
+                count[j] -= 1
+                touched.add(j)
+        for j in touched:
+            if -ratio(j) < keys[j]:
+                keys[j] = -ratio(j)
+                heapq.heappush(heap, (keys[j], j))
+    return plan
+
+
+def rank_headers(m: MeasuringResults.MeasuringResults, tu_results: List[Tuple[str, TuResult]],
+                 load_factor: float = DEFAULT_LOAD_FACTOR, plan_steps: Optional[int] = None) -> Dict[str, Any]:
+    stats = header_stats(m, tu_results, load_factor)
+    names = sorted(stats)
+    sums = ClosureSums(names, m.immediate_deps, {n: stats[n].saving for n in names})
+    ranking = []
+    for i, name in enumerate(names):
+        s = stats[name]
+        ranking.append({'header': name, 'total_time': s.total_time, 'includers': s.includers,
+                        'module_time': s.module_time, 'saving': s.saving,
+                        'saving_with_deps': sums.sum(sums.closures[i]),
+                        'deps_to_convert': sums.closures[i].bit_count() - 1})
+    ranking.sort(key=lambda r: -r['saving'])
+    return {'load_factor': load_factor, 'ranking': ranking,
+            'plan': [step._asdict() for step in migration_plan(sums, plan_steps)]}
+
+
+def format_ranking(result: Mapping[str, Any], top: int = 20) -> str:
+    lines = ['{:>12} {:>9} {:>12} {:>16} {:>6}  header'.format('total', 'includers', 'saving', 'saving w/ deps',
+                                                              'deps')]
+    for r in result['ranking'][:top]:
+        lines.append('{:>12} {:>9} {:>12} {:>16} {:>6}  {}'.format(r['total_time'], r['includers'], r['saving'],
+                                                                  r['saving_with_deps'], r['deps_to_convert'],
+                                                                  r['header']))
+    lines.append('migration plan:')
+    for step in result['plan'][:top]:
+        lines.append('    {} (+{} headers): saves {}, {} in total'.format(step['header'], len(step['converted']) - 1,
+                                                                         step['saving'], step['total_saving']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rank headers by the build time saved by turning them into modules')
+
+    parser.add_argument('--traces-dir', help='directory with .o.time.json traces of the measuring build',
+                        required=True)
+    parser.add_argument('--jobs', help='number of processes used to process time traces', type=int, default=1)
+    parser.add_argument('--cache-path', help='path to a persistent cache of processed time traces')
+    parser.add_argument('--load-factor', help='BMI load time as a fraction of module build time', type=float,
+                        default=DEFAULT_LOAD_FACTOR)
+    parser.add_argument('--plan-steps', help='maximal number of migration plan steps', type=int)
+    parser.add_argument('--top', help='number of headers to print', type=int, default=20)
+    parser.add_argument('--output-path', help='path to dump the whole ranking and plan as JSON')
+    args = parser.parse_args()
+
+    tu_results = collect_traces(glob.iglob(args.traces_dir + '/**/*.o.time.json', recursive=True), args.traces_dir,
+                                args.jobs, args.cache_path)
+    result = rank_headers(merge_tu_results(tu_results), tu_results, args.load_factor, args.plan_steps)
+    print(format_ranking(result, args.top))
+    if args.output_path:
+        with open(args.output_path, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import sys
+from typing import *
+
+CACHE_VERSION = 1
+
+
+class TraceFingerprint(NamedTuple):
+    size: int
+    mtime_ns: int
+    digest: Optional[str]  # content hash, only computed when hashing is enabled
+
+
+def hash_file(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def fingerprint(path: str, with_hash: bool = False) -> TraceFingerprint:
+    st = os.stat(path)
+    return TraceFingerprint(st.st_size, st.st_mtime_ns, hash_file(path) if with_hash else None)
+
+
+class ResultsCache:
+    # Persistent per-trace analysis results (compact TuResult tuples), keyed on trace path and validated by
+    # size/mtime, or by size/content hash if hashing is enabled (so rebuilt but identical traces still hit)
+    def __init__(self, cache_path: str, root_dir: str, with_hash: bool = False):
+        self.cache_path = cache_path
+        self.root_dir = root_dir
+        self.with_hash = with_hash
+        self.entries: Dict[str, Tuple[TraceFingerprint, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.cache_path):
+            return
+        with open(self.cache_path) as f:
+            data = json.load(f)
+        # results contain canonical paths, they are only valid for the same root
+        if data.get('version') != CACHE_VERSION or data.get('root_dir') != self.root_dir:
+            self.dirty = True
+            return
+        for trace_path, (fp, result) in data['entries'].items():
+            self.entries[trace_path] = (TraceFingerprint(*fp), result)
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'root_dir': self.root_dir,
+                       'entries': {tp: [list(fp), result] for tp, (fp, result) in self.entries.items()}}, f)
+        os.replace(tmp_path, self.cache_path)  # never leave a half-written cache behind
+        self.dirty = False
+
+    def _matches(self, trace_path: str, cached: TraceFingerprint) -> Optional[TraceFingerprint]:
+        st = os.stat(trace_path)
+        if st.st_size != cached.size:
+            return None
+        if st.st_mtime_ns == cached.mtime_ns:
+            return cached
+        if self.with_hash and cached.digest is not None:
+            digest = hash_file(trace_path)
+            if digest == cached.digest:
+                return TraceFingerprint(st.st_size, st.st_mtime_ns, digest)
+        return None
+
+    def get(self, trace_path: str) -> Optional[Any]:
+        entry = self.entries.get(trace_path)
+        fp = self._matches(trace_path, entry[0]) if entry is not None else None
+        if fp is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if fp != entry[0]:
+            self.entries[trace_path] = (fp, entry[1])
+            self.dirty = True
+        return entry[1]
+
+    def put(self, trace_path: str, result: Any):
+        self.entries[trace_path] = (fingerprint(trace_path, self.with_hash), result)
+        self.dirty = True
+
+    def prune(self, live_paths: Iterable[str]):
+        # forget traces which are no longer part of the build
+        live_paths = set(live_paths)
+        for tp in [tp for tp in self.entries if tp not in live_paths]:
+            del self.entries[tp]
+            self.dirty = True
+
+    def clear(self):
+        self.entries.clear()
+        self.dirty = True
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        return 'results cache: {} hits, {} misses ({:.1f}% hit rate), {} entries in {}'.format(
+            self.hits, self.misses, 100. * self.hits / total if total else 0., len(self.entries), self.cache_path)
+
+
+def invalidate(cache_path: str, trace_paths: Iterable[str] = ()):
+    # drop given traces from the cache, or the whole cache if none are given
+    trace_paths = list(trace_paths)
+    if not os.path.isfile(cache_path):
+        return
+    if not trace_paths:
+        os.remove(cache_path)
+        return
+    with open(cache_path) as f:
+        data = json.load(f)
+    for tp in trace_paths:
+        data['entries'].pop(os.path.abspath(tp), None)
+    with open(cache_path, 'w') as f:
+        json.dump(data, f)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in ('invalidate', 'stats'):
+        print('usage: {} invalidate|stats CACHE_PATH [TRACE_PATH...]'.format(sys.argv[0]), file=sys.stderr)
+        exit(1)
+    if sys.argv[1] == 'invalidate':
+        invalidate(sys.argv[2], sys.argv[3:])
+    else:
+        with open(sys.argv[2]) as f:
+            cache_data = json.load(f)
+        print('{} entries for root {}'.format(len(cache_data['entries']), cache_data['root_dir']))
@@ -0,0 +1,104 @@
+import math
+import statistics
+from typing import *
+
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_PRECISION = 0.02  # relative half-width of the CI to stop repeating at
+MIN_RUNS = 3  # CIs of fewer runs are too wide and too unreliable to stop at
+
+
+def t_probability(t: float, df: int) -> float:
+    # P(|T| < t) of Student's t distribution, closed form for integer degrees of freedom
+    theta = math.atan(t / math.sqrt(df))
+    c2 = math.cos(theta) ** 2
+    total = term = 1.
+    if df % 2:
+        for k in range(1, (df - 1) // 2):
+            term *= 2. * k / (2. * k + 1.) * c2
+            total += term
+        return 2. / math.pi * (theta + (math.sin(theta) * math.cos(theta) * total if df > 1 else 0.))
+    for k in range(1, df // 2):
+        term *= (2. * k - 1.) / (2. * k) * c2
+        total += term
+    return math.sin(theta) * total
+
+
+def t_quantile(confidence: float, df: int) -> float:
+    # t such that P(|T| < t) = confidence, by bisection
+    low, high = 0., 1.
+    while t_probability(high, df) < confidence:
+        high *= 2.
+    for _ in range(100):
+        middle = (low + high) / 2.
+        if t_probability(middle, df) < confidence:
+            low = middle
+        else:
+            high = middle
+    return high
+
+
+class Summary(NamedTuple):
+    n: int
+    mean: float
+    median: float
+    stdev: float
+    ci_low: Optional[float]  # CI of the mean, None for a single sample
+    ci_high: Optional[float]
+    confidence: float
+
+    @property
+    def half_width(self) -> float:
+        return (self.ci_high - self.ci_low) / 2. if self.ci_low is not None else math.inf
+
+    @property
+    def relative_half_width(self) -> float:
+        if self.ci_low is None:
+            return math.inf
+        return self.half_width / abs(self.mean) if self.mean else 0.
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = self._asdict()
+        d['half_width'] = self.half_width if self.ci_low is not None else None
+        return d
+
+
+def summarize(values: Sequence[float], confidence: float = DEFAULT_CONFIDENCE) -> Summary:
+    n = len(values)
+    mean = statistics.mean(values)
+    median = statistics.median(values)
+    if n < 2:
+        return Summary(n, mean, median, 0., None, None, confidence)
+    stdev = statistics.stdev(values)
+    half_width = t_quantile(confidence, n - 1) * stdev / math.sqrt(n)
+    return Summary(n, mean, median, stdev, mean - half_width, mean + half_width, confidence)
+
+
+def is_stable(values: Sequence[float], precision: float = DEFAULT_PRECISION,
+              confidence: float = DEFAULT_CONFIDENCE, min_runs: int = MIN_RUNS) -> bool:
+    return len(values) >= max(2, min_runs) and summarize(values, confidence).relative_half_width <= precision
+
+
+def repeat_until_stable(run: Callable[[int], float], max_runs: int, precision: float = DEFAULT_PRECISION,
+                        confidence: float = DEFAULT_CONFIDENCE, min_runs: int = MIN_RUNS) -> List[float]:
+    # runs up to max_runs times, stopping as soon as the CI of the mean is narrower than precision of the mean,
+    # precision 0 never stops early
+    samples = []
+    for i in range(max_runs):
+        samples.append(run(i))
+        if precision > 0 and is_stable(samples, precision, confidence, min_runs):
+            break
+    return samples
+
+
+def summarize_distributions(distributions: Mapping[str, Sequence[float]],
+                            confidence: float = DEFAULT_CONFIDENCE) -> Dict[str, Summary]:
+    return {name: summarize(values, confidence) for name, values in distributions.items()}
+
+
+def format_summary(s: Summary, unit: str = 's', scale: float = 1., digits: int = 2) -> str:
+    value = '{{:.{}f}}{}'.format(digits, unit).format
+    if s.ci_low is None:
+        return value(s.mean * scale)
+    return '{} ± {} ({:.0f}% CI of the mean, n={}, median {}, stdev {})'.format(
+        value(s.mean * scale), value(s.half_width * scale), 100. * s.confidence, s.n, value(s.median * scale),
+        value(s.stdev * scale))
@@ -0,0 +1,174 @@
+import math
+import os
+import random
+import statistics
+from typing import *
+
+from commandNormalizer import CommandNormalizer
+from dependenciesForest import TuResult, median_build_times
+from MeasuringResults import MeasuringResults
+from util import make_absolute
+
+Z_95 = 1.96  # normal approximation is good enough for the sample sizes we care about
+
+
+class CdbEntry(NamedTuple):
+    entry: Mapping[str, Any]  # original CDB entry
+    tu_name: str  # canonical path of the source, the same as dependenciesForest would produce
+    object_file: str
+    stratum: str
+
+
+class SamplePlan(NamedTuple):
+    entries: List[CdbEntry]  # whole CDB
+    sampled: List[CdbEntry]
+    strata: Dict[str, Tuple[int, int]]  # stratum: (population size, sample size)
+
+
+def describe_entries(cdb: Iterable[Mapping[str, Any]], by: str) -> List[CdbEntry]:
+    normalizer = CommandNormalizer()
+    result = []
+    for entry in cdb:
+        command = entry['arguments'] if 'arguments' in entry else entry['command']
+        normalized = normalizer.normalize(command, entry['file'], entry['directory'])
+        if by == 'directory':
+            stratum = os.path.dirname(normalized.input_file)
+        elif by == 'flags':
+            stratum = repr((normalized.compiler, normalizer.flag_set(normalized.common_args)))
+        else:
+            raise RuntimeError('Unknown stratification {}'.format(by))
+        result.append(CdbEntry(entry, os.path.normpath(os.path.realpath(normalized.input_file)),
+                               make_absolute(normalized.output, entry['directory']), stratum))
+    return result
+
+
+def sample_cdb(cdb: Iterable[Mapping[str, Any]], fraction: float, by: str = 'directory', seed: int = 0,
+               min_per_stratum: int = 2) -> SamplePlan:
+    # stratified random sample, each stratum gets its proportional share but at least min_per_stratum TUs
+    # (or all of them if it's smaller), so that every stratum has a variance estimate
+    entries = describe_entries(cdb, by)
+    strata: Dict[str, List[CdbEntry]] = {}
+    for e in entries:
+        strata.setdefault(e.stratum, []).append(e)
+
+    rng = random.Random(seed)
+    sampled_names = set()
+    sizes = {}
+    for stratum, members in strata.items():
+        n = min(len(members), max(min_per_stratum, int(math.ceil(fraction * len(members)))))
+        sampled_names.update(e.object_file for e in rng.sample(members, n))
+        sizes[stratum] = (len(members), n)
+
+    # keep the CDB order, so the measuring build is generated the same way as a full one
+    sampled = [e for e in entries if e.object_file in sampled_names]
+    return SamplePlan(entries, sampled, sizes)
+
+
+def mean_ci(values: Sequence[float]) -> Tuple[float, Optional[float]]:
+    mean = statistics.mean(values)
+    if len(values) < 2:
+        return mean, None
+    return mean, Z_95 * statistics.stdev(values) / math.sqrt(len(values))
+
+
+def stratified_total(samples: Mapping[str, Sequence[float]], strata: Mapping[str, Tuple[int, int]]) \
+        -> Tuple[float, float]:
+    # classic stratified estimator of a population total with finite population correction
+    total = 0.
+    variance = 0.
+    for stratum, values in samples.items():
+        population, _ = strata[stratum]
+        n = len(values)
+        total += population * statistics.mean(values)
+        if n > 1:
+            variance += population ** 2 * (1. - n / population) * statistics.variance(values) / n
+    return total, Z_95 * math.sqrt(variance)
+
+
+def extrapolate(plan: SamplePlan, tu_results: Iterable[Tuple[str, TuResult]], seed: int = 0) \
+        -> Tuple[MeasuringResults, Dict[str, Any]]:
+    # Headers get median self-times of the sampled TUs as usual. Every TU which wasn't measured borrows
+    # self-time and includes from a random measured TU of the same stratum (hot-deck imputation), so the fake
+    # build has the same shape and size as a full one would.
+    by_object = {tp.replace('.o.time.json', '.o'): tu for tp, tu in tu_results}
+    donors: Dict[str, List[TuResult]] = {}
+    header_times: Dict[str, List[int]] = {}
+    header_tus: Dict[str, Dict[str, int]] = {}  # header: {stratum: number of sampled TUs including it}
+    immediate_deps = {}
+    tu_self_times = {}
+    for e in plan.sampled:
+        tu = by_object.get(e.object_file)
+        if tu is None:
+            continue
+        donors.setdefault(e.stratum, []).append(tu)
+        for name, self_time, children in tu.nodes:
+            immediate_deps[name] = set(children)
+            if name == tu.name:
+                tu_self_times[name] = self_time
+                continue
+            header_times.setdefault(name, []).append(self_time)
+            counts = header_tus.setdefault(name, {})
+            counts[e.stratum] = counts.get(e.stratum, 0) + 1
+
+    build_times = dict(median_build_times(header_times))
+    build_times.update(tu_self_times)
+    object_files = {}
+    rng = random.Random(seed)
+    imputed = 0
+    for e in plan.entries:
+        object_files[e.tu_name] = e.object_file
+        if e.tu_name in tu_self_times:
+            continue
+        stratum_donors = donors.get(e.stratum)
+        if not stratum_donors:
+            raise RuntimeError('No measured TUs in stratum {}'.format(e.stratum))
+        donor = rng.choice(stratum_donors)
+        donor_deps, donor_self_time = next((c, t) for n, t, c in donor.nodes if n == donor.name)
+        build_times[e.tu_name] = donor_self_time
+        immediate_deps[e.tu_name] = set(donor_deps)
+        imputed += 1
+
+    total_times = {}
+    self_times = {}
+    for stratum, stratum_donors in donors.items():
+        total_times[stratum] = [tu.total_time for tu in stratum_donors]
+        self_times[stratum] = [next(t for n, t, _ in tu.nodes if n == tu.name) for tu in stratum_donors]
+
+    headers = {}
+    for name, times in header_times.items():
+        mean, ci = mean_ci(times)
+        # each sampled TU stands for population/sample TUs of its stratum
+        includers = sum(count * plan.strata[s][0] / plan.strata[s][1] for s, count in header_tus[name].items())
+        headers[name] = {'median': build_times[name], 'mean': mean, 'ci95': ci, 'samples': len(times),
+                         'estimated_includers': includers, 'estimated_total_time': includers * mean}
+
+    serial_time, serial_ci = stratified_total(total_times, plan.strata)
+    tu_self_time, tu_self_ci = stratified_total(self_times, plan.strata)
+    report = {
+        'population': len(plan.entries),
+        'sampled': len(plan.sampled),
+        'measured': sum(len(d) for d in donors.values()),
+        'imputed': imputed,
+        'strata': {s: {'population': p, 'sampled': n} for s, (p, n) in plan.strata.items()},
+        'estimated_serial_time': serial_time,
+        'estimated_serial_time_ci95': serial_ci,
+        'estimated_tu_self_time': tu_self_time,
+        'estimated_tu_self_time_ci95': tu_self_ci,
+        'headers': headers,
+    }
+    return MeasuringResults(build_times, immediate_deps, object_files), report
+
+
+def format_report(report: Mapping[str, Any], top: int = 10) -> str:
+    lines = ['measured {} of {} TUs in {} strata, {} TUs imputed'.format(
+        report['measured'], report['population'], len(report['strata']), report['imputed']),
+        'estimated serial compile time: {:.0f} +- {:.0f}'.format(
+            report['estimated_serial_time'], report['estimated_serial_time_ci95']),
+        'estimated TU self-time:        {:.0f} +- {:.0f}'.format(
+            report['estimated_tu_self_time'], report['estimated_tu_self_time_ci95'])]
+    headers = sorted(report['headers'].items(), key=lambda h: -h[1]['estimated_total_time'])
+    for name, h in headers[:top]:
+        lines.append('    {}: {:.0f} total, {:.0f} per TU +- {}, ~{:.0f} includers'.format(
+            name, h['estimated_total_time'], h['mean'], '{:.0f}'.format(h['ci95']) if h['ci95'] is not None else '?',
+            h['estimated_includers']))
+    return '\n'.join(lines)
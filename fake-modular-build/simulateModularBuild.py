@@ -3,13 +3,29 @@ import datetime
 import json
 import os
 import shutil
+import statistics
 import subprocess
 import sys
 import time
 
-from cdbToNinja import cdb_to_ninja
-from createFakeBuild import measurements_to_ninja
-from dependenciesForest import collect_results
+import MeasuringResults
+from bmiModel import BmiSizeModel, bmi_sizes, calibrate
+from cdbToNinja import cdb_to_ninja, peak_rss_command
+from createFakeBuild import FAKE_COMPILER_MODE, SHELL_MODE, build_mode, check_overhead_model, fake_compiler_command, \
+    load_overhead_model, measure_spawn_overhead, measurements_to_ninja
+from dependenciesForest import ResultsMerger, collect_results, collect_traces
+from graphReduction import edge_count, reduce_measurements
+from jsonStream import iter_json_array
+from memoryModel import edge_memory, fit_memory_model, memory_pools, read_peak_memory
+from ninjaLog import analyze_build, format_analysis, group_edges, peak_concurrent_memory, read_ninja_log, \
+    read_ninja_script
+from predictModularBuild import default_parallelism, format_prediction, parallelism_arg, predict
+from resultsCache import invalidate
+from runStatistics import DEFAULT_CONFIDENCE, DEFAULT_PRECISION, format_summary, repeat_until_stable, summarize, \
+    summarize_distributions
+from sampleCdb import extrapolate, format_report, sample_cdb
+from telemetry import Telemetry
+from tracePipeline import TracePipeline, run_ninja_pipelined
 
 
 def measuring_dir(output_path):
@@ -42,27 +58,40 @@ def create_dir(path):
     os.makedirs(path)
 
 
-def prepare_output_dirs(output_path):
-    report('Removing', output_path)
-    if os.path.isfile(output_path):
-        os.remove(output_path)
-    elif os.path.isdir(output_path):
-        shutil.rmtree(output_path)
+def prepare_output_dirs(output_path, keep_measuring=False):
+    # with keep_measuring the measuring build of the previous run stays, to be rebuilt incrementally
+    if keep_measuring and os.path.isdir(measuring_dir(output_path)):
+        report('Removing', output_path, 'except for the measuring build')
+        for entry in os.scandir(output_path):
+            if entry.path == measuring_dir(output_path):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+    else:
+        report('Removing', output_path)
+        if os.path.isfile(output_path):
+            os.remove(output_path)
+        elif os.path.isdir(output_path):
+            shutil.rmtree(output_path)
+        create_dir(measuring_dir(output_path))
 
-    create_dir(measuring_dir(output_path))
     create_dir(fake_dir(output_path))
     create_dir(bmi_dir(output_path))
 
 
-def create_measuring_ninja_script(cdb_path, output_path, measuring_compiler_path):
+def create_measuring_ninja_script(cdb_path, output_path, measuring_compiler_path, cdb=None, record_peak_rss=False):
+    # cdb is a subset of CDB entries to use instead of the whole CDB
     path = measuring_dir(output_path)
     script_path = ninja_script_path(path)
-    report('Creating measuring ninja script in {} for {}'.format(script_path, cdb_path))
-    with open(cdb_path) as f:
-        cdb_json = json.load(f)
-    ninja_text, obj_mapping = cdb_to_ninja(cdb_json, measuring_compiler_path)
+    report('Creating measuring ninja script in {} for {}{}'.format(script_path, cdb_path,
+                                                                   ', recording peak RSS' if record_peak_rss else ''))
+    start_time = time.time()
     with open(script_path, 'w') as f:
-        f.write(ninja_text)
+        _, obj_mapping = cdb_to_ninja(iter_json_array(cdb_path) if cdb is None else cdb, measuring_compiler_path, f,
+                                      peak_rss_command() if record_peak_rss else None)
+    report('Converted {} CDB entries in {:.2f}s'.format(len(obj_mapping), time.time() - start_time))
 
     # this file is not used for now, just for manual inspection
     obj_mapping_path = os.path.join(output_path, 'obj_mapping.json')
@@ -73,14 +102,19 @@ def create_measuring_ninja_script(cdb_path, output_path, measuring_compiler_path
     return script_path, obj_mapping
 
 
-def report_ninja_time(ninja_script_path, build_name):
-    ninja_dir = containing_dir(ninja_script_path)
-
+def clean_build(ninja_dir, build_name):
     clean_command = ['ninja', '-t', 'clean']
     report('Running "{}" for {} build in {}'.format(' '.join(clean_command), build_name, ninja_dir))
     subprocess.check_call(clean_command, cwd=ninja_dir, stdout=subprocess.DEVNULL)
 
-    build_command = ['ninja']
+
+def report_ninja_time(ninja_script_path, build_name, parallelism=None, clean=True):
+    ninja_dir = containing_dir(ninja_script_path)
+
+    if clean:
+        clean_build(ninja_dir, build_name)
+
+    build_command = ['ninja'] if parallelism is None else ['ninja', '-j{}'.format(parallelism)]
     report('Timing "{}" for {} build in {}'.format(' '.join(build_command), build_name, ninja_dir))
     start_time = time.time()
     subprocess.check_call(build_command, cwd=ninja_dir, stdout=subprocess.DEVNULL)
@@ -90,43 +124,427 @@ def report_ninja_time(ninja_script_path, build_name):
     return elapsed_time
 
 
-def collect_measuring_results(obj_files_mapping, output_path):
-    report('Processing time traces')
+def build_and_collect_traces(ninja_script_path, obj_files_mapping, jobs=1, cache_path=None, hash_traces=False,
+                             clean=True):
+    # measuring build with traces processed while it runs, as soon as their edges finish
+    ninja_dir = containing_dir(ninja_script_path)
+    trace_paths = [obj_file + '.time.json' for _, obj_file in obj_files_mapping]
+    trace_for_output = {output: edge.variables['obj_file'] + '.time.json'
+                        for output, edge in read_ninja_script(ninja_script_path).items()
+                        if 'obj_file' in edge.variables}
+
+    if clean:
+        clean_build(ninja_dir, 'measuring')
+    report('Timing "ninja" for measuring build in {}, processing traces using {} low priority job(s) '
+           'meanwhile'.format(ninja_dir, jobs))
+    with TracePipeline(trace_paths, jobs=jobs, cache_path=cache_path, hash_traces=hash_traces) as pipeline:
+        start_time = time.time()
+        elapsed_time = run_ninja_pipelined(ninja_dir, trace_for_output, pipeline, clean=clean)
+        report('measuring build took {:.2f}s'.format(elapsed_time))
+        collected = pipeline.finish()
+    report('{} of {} traces were processed during the build, results ready {:.2f}s after it'.format(
+        pipeline.processed_during_build, len(pipeline.trace_paths), time.time() - start_time - elapsed_time))
+    return elapsed_time, collected
+
+
+def repeat_measuring_builds(ninja_script_path, obj_files_mapping, max_runs, precision, confidence, jobs=1,
+                            cache_path=None, hash_traces=False, pipeline=False):
+    # Every run is a clean build with its traces processed, self-times of every node are pooled over all runs.
+    # Returns build times, TU results of all runs and the merger holding the pooled times.
+    list_of_time_json_files = [obj_file + '.time.json' for _, obj_file in obj_files_mapping]
+    merger = ResultsMerger()
+    tu_results = []
+
+    def run(i):
+        if pipeline:
+            elapsed_time, (run_tu_results, _) = build_and_collect_traces(ninja_script_path, obj_files_mapping, jobs,
+                                                                         cache_path, hash_traces)
+        else:
+            elapsed_time = report_ninja_time(ninja_script_path, 'measuring #{}'.format(i + 1))
+            report('Processing time traces using {} job(s)'.format(jobs))
+            run_tu_results = collect_traces(list_of_time_json_files, jobs=jobs, cache_path=cache_path,
+                                            hash_traces=hash_traces)
+        for tp, tu_result in run_tu_results:
+            merger.add(tp, tu_result)
+        tu_results.extend(run_tu_results)
+        return elapsed_time
+
+    times = repeat_until_stable(run, max_runs, precision, confidence)
+    report_repeats('measuring', times, max_runs, confidence)
+    return times, tu_results, merger
+
+
+def repeat_ninja_time(ninja_script_path, build_name, max_runs, precision, confidence):
+    if max_runs <= 1:
+        return [report_ninja_time(ninja_script_path, build_name)]
+    times = repeat_until_stable(
+        lambda i: report_ninja_time(ninja_script_path, '{} #{}'.format(build_name, i + 1)), max_runs, precision,
+        confidence)
+    report_repeats(build_name, times, max_runs, confidence)
+    return times
+
+
+def report_repeats(build_name, times, max_runs, confidence):
+    if len(times) < max_runs:
+        report('{} build times are stable after {} of {} runs'.format(build_name, len(times), max_runs))
+    report('{} build: {}'.format(build_name, format_summary(summarize(times, confidence))))
+
+
+def report_repeat_statistics(measuring_times, fake_times, node_times, output_path, confidence, worst=10):
+    # node_times are self-times of every header and TU pooled over all measuring runs
+    nodes = summarize_distributions(node_times, confidence)
+    statistics_path = os.path.join(output_path, 'repeat_statistics.json')
+    report('Dumping statistics of repeated runs to', statistics_path)
+    with open(statistics_path, 'w') as f:
+        json.dump({'confidence': confidence,
+                   'measuring': {'times': measuring_times, 'summary': summarize(measuring_times, confidence).to_dict()},
+                   'fake': {'times': fake_times, 'summary': summarize(fake_times, confidence).to_dict()},
+                   'nodes': {name: s.to_dict() for name, s in nodes.items()}}, f, indent=2)
+
+    # the widest CIs in absolute terms are the ones contributing most uncertainty to the fake build
+    noisy = sorted(((name, s) for name, s in nodes.items() if s.ci_low is not None), key=lambda x: -x[1].half_width)
+    print('########################')
+    print('least certain self-times of {} nodes:'.format(len(nodes)))
+    for name, s in noisy[:worst]:
+        print('    {}: {}'.format(name, format_summary(s, 'ms', 1e-3, 3)))
+
+
+def sweep_ninja_times(ninja_script_path, build_name, parallelisms, repeats):
+    # every run starts from a clean build dir, so runs are independent of each other and of their order
+    times = {}
+    for parallelism in parallelisms:
+        times[parallelism] = [report_ninja_time(ninja_script_path, '{} -j{} #{}'.format(build_name, parallelism, i),
+                                                parallelism) for i in range(repeats)]
+    return times
+
+
+def scaling_table(times):
+    # speedup and efficiency are relative to the smallest parallelism in the sweep
+    base_j = min(times)
+    base_time = statistics.median(times[base_j])
+    rows = []
+    for parallelism in sorted(times):
+        median_time = statistics.median(times[parallelism])
+        speedup = base_time / median_time if median_time else 0.
+        rows.append({'parallelism': parallelism, 'times': times[parallelism], 'median': median_time,
+                     'speedup': speedup, 'efficiency': speedup * base_j / parallelism})
+    return rows
+
+
+def report_scaling_sweep(measuring_ninja_script_path, fake_ninja_script_path, measuring_results, output_path,
+                         parallelisms, repeats, spawn_overhead=None, memory=None, fake_build_for=None):
+    # fake_build_for(parallelism) returns the path and pools of a fake build with memory pools sized for that -j,
+    # the fake build is left with the pools of the last one. Without it the same script is run at every -j.
+    report('Sweeping parallelism {} with {} run(s) each'.format(parallelisms, repeats))
+    normal_times = sweep_ninja_times(measuring_ninja_script_path, 'measuring', parallelisms, repeats)
+    modular_times = {}
+    predicted = {}
+    pooled_edges = {}
+    for parallelism in parallelisms:
+        pools = None
+        if fake_build_for is not None:
+            fake_ninja_script_path, pools = fake_build_for(parallelism)
+            pooled_edges[parallelism] = len(pools[1])
+        modular_times.update(sweep_ninja_times(fake_ninja_script_path, 'fake', [parallelism], repeats))
+        predicted[parallelism] = predict_fake_build(measuring_results, parallelism, spawn_overhead, memory,
+                                                    pools).makespan
+    sweep = {
+        'normal': scaling_table(normal_times),
+        'modular': scaling_table(modular_times),
+        'predicted': predicted,
+    }
+    if fake_build_for is not None:
+        sweep['pooled_edges'] = pooled_edges  # by -j, pools differ between them
+
+    sweep_path = os.path.join(output_path, 'sweep.json')
+    report('Dumping parallelism sweep to', sweep_path)
+    with open(sweep_path, 'w') as f:
+        json.dump(sweep, f, indent=2)
+
+    print('########################')
+    print('{:>5} | {:>9} {:>8} {:>6} | {:>9} {:>8} {:>6} | {:>9}'.format(
+        '-j', 'normal', 'speedup', 'eff', 'modular', 'speedup', 'eff', 'predicted'))
+    for normal, modular in zip(sweep['normal'], sweep['modular']):
+        print('{:>5} | {:>8.2f}s {:>7.2f}x {:>5.0f}% | {:>8.2f}s {:>7.2f}x {:>5.0f}% | {:>8.2f}s'.format(
+            normal['parallelism'], normal['median'], normal['speedup'], 100. * normal['efficiency'],
+            modular['median'], modular['speedup'], 100. * modular['efficiency'],
+            sweep['predicted'][normal['parallelism']]))
+    return sweep
+
+
+def sample_measuring_cdb(cdb_path, output_path, fraction, by, seed):
+    report('Sampling {:.1f}% of {} stratified by {}'.format(100. * fraction, cdb_path, by))
+    plan = sample_cdb(iter_json_array(cdb_path), fraction, by, seed)
+    report('Sampled {} of {} TUs in {} strata'.format(len(plan.sampled), len(plan.entries), len(plan.strata)))
+    return plan
+
+
+def collect_measuring_results(obj_files_mapping, output_path, jobs=1, cache_path=None, hash_traces=False,
+                              binary_results=False, sample_plan=None, collected=None, measure_memory=False):
+    # collected is (TU results, merged results) if traces were already processed during the measuring build
     list_of_time_json_files = [obj_file + '.time.json' for _, obj_file in obj_files_mapping]
-    results = collect_results(list_of_time_json_files)
+    if collected is None:
+        report('Processing time traces using {} job(s)'.format(jobs))
+    if sample_plan is None:
+        results = collected[1] if collected else collect_results(list_of_time_json_files, jobs=jobs,
+                                                                 cache_path=cache_path, hash_traces=hash_traces)
+    else:
+        tu_results = collected[0] if collected else collect_traces(list_of_time_json_files, jobs=jobs,
+                                                                   cache_path=cache_path, hash_traces=hash_traces)
+        results, sampling_report = extrapolate(sample_plan, tu_results)
+        sampling_path = os.path.join(output_path, 'sampling.json')
+        report('Extrapolated sampled traces to the whole CDB, dumping estimates to', sampling_path)
+        with open(sampling_path, 'w') as f:
+            json.dump(sampling_report, f, indent=2)
+        print(format_report(sampling_report))
+
+    if measure_memory:
+        results.peak_memory = read_peak_memory(results, [obj_file for _, obj_file in obj_files_mapping])
+        report('Peak RSS recorded for {} of {} TUs'.format(len(results.peak_memory), len(results.object_files)))
 
     # this file is not used for now, just for manual inspection
-    results_paths = os.path.join(output_path, 'results.json')
+    results_paths = os.path.join(output_path, 'results.bin' if binary_results else 'results.json')
     report('Dumping processed traces to', results_paths)
-    with open(results_paths, 'w') as f:
-        f.write(results.to_json())
+    MeasuringResults.save(results, results_paths, binary_results)
 
     return results
 
 
-def create_fake_ninja_build(measuring_results, output_path):
+def model_edge_memory(measuring_results, memory_budget=None):
+    # memory_budget in bytes is split into ninja pools for the parallelism the fake build is run with
+    memory_model, measured = fit_memory_model(measuring_results)
+    report('Memory model fitted on {} TUs: {}'.format(measured, memory_model))
+    memory = edge_memory(measuring_results, memory_model)
+    pools = None
+    if memory_budget:
+        pools = size_memory_pools(memory, memory_budget, default_parallelism())
+    return memory, pools
+
+
+def size_memory_pools(memory, memory_budget, parallelism):
+    pools = memory_pools(memory, memory_budget, parallelism)
+    report('{} of {} edges limited by {} memory pools to fit {:.2f}GB at -j{}'.format(
+        len(pools[1]), len(memory), len(pools[0]), memory_budget / 1e9, parallelism))
+    return pools
+
+
+def create_fake_ninja_build(measuring_results, output_path, use_fake_compiler=False, pcm_dir=None,
+                            overhead_model_path=None, pools=None, spawn_overhead=None):
+    # spawn_overhead of the fake compiler is measured unless it's given or comes from the overhead model
     fd = fake_dir(output_path)
     script_path = ninja_script_path(fd)
+    bmi_model = BmiSizeModel()
+    if pcm_dir:
+        bmi_model, matched = calibrate(measuring_results, pcm_dir)
+        report('BMI size model calibrated on {} real BMIs'.format(matched))
+    report('BMI size model: {}, {:.1f}MB of BMIs in total'.format(
+        bmi_model, sum(bmi_sizes(measuring_results, bmi_model).values()) / 1e6))
+    fake_compiler = fake_compiler_command() if use_fake_compiler else None
+    overhead_model = None
+    if overhead_model_path:
+        overhead_model = load_overhead_model(overhead_model_path)
+        report('Edge overhead model from {}: {}'.format(overhead_model_path, overhead_model))
+        if not check_overhead_model(overhead_model, build_mode(fake_compiler)):
+            report('Edge overhead model doesn\'t record the mode it was fitted in, make sure it was fitted {} '
+                   '--fake-compiler'.format('with' if use_fake_compiler else 'without'))
+        if use_fake_compiler:
+            spawn_overhead = overhead_model.fixed
+    elif use_fake_compiler and spawn_overhead is None:
+        spawn_overhead = measure_spawn_overhead(fake_compiler)
+        report('Fake compiler overhead is {:.2f}ms per edge, subtracting it from edge times'.format(
+            spawn_overhead * 1000.))
     report('Creating fake ninja script in', script_path)
-    script_text = measurements_to_ninja(measuring_results, fd)
+    script_text = measurements_to_ninja(measuring_results, fd, fake_compiler, spawn_overhead or 0., bmi_model,
+                                        overhead_model, pools)
     with open(script_path, 'w') as f:
         f.write(script_text)
 
-    return script_path
-
-
-def main(cdb_path, output_path, measuring_compiler_path):
-    prepare_output_dirs(output_path)
-    measuring_ninja_script_path, obj_files_mapping = create_measuring_ninja_script(cdb_path, output_path,
-                                                                                   measuring_compiler_path)
-    normal_time = report_ninja_time(measuring_ninja_script_path, 'measuring')
-    measuring_results = collect_measuring_results(obj_files_mapping, output_path)
-    fake_build_ninja_script_path = create_fake_ninja_build(measuring_results, output_path)
-    modular_time = report_ninja_time(fake_build_ninja_script_path, 'fake')
+    return script_path, spawn_overhead
+
+
+def analyze_ninja_logs(measuring_ninja_script_path, fake_ninja_script_path, measuring_results, output_path):
+    report('Analyzing .ninja_log of both builds')
+    analysis = {'measuring': analyze_build(containing_dir(measuring_ninja_script_path)),
+                'fake': analyze_build(containing_dir(fake_ninja_script_path), measuring_results)}
+    analysis_path = os.path.join(output_path, 'ninja_log_analysis.json')
+    report('Dumping .ninja_log analysis to', analysis_path)
+    with open(analysis_path, 'w') as f:
+        json.dump(analysis, f, indent=2)
+    if 'overhead_model' in analysis['fake']:
+        overhead_model_path = os.path.join(output_path, 'overhead_model.json')
+        report('Dumping fitted edge overhead model to {}, pass it with --overhead-model to the next run'.format(
+            overhead_model_path))
+        with open(overhead_model_path, 'w') as f:
+            json.dump(analysis['fake']['overhead_model'], f, indent=2)
+    print(format_analysis('measuring', analysis['measuring']))
+    print(format_analysis('fake', analysis['fake']))
+    return analysis
+
+
+def report_peak_memory(measuring_ninja_script_path, fake_ninja_script_path, measuring_results, memory, prediction,
+                       output_path):
+    # Edges of both builds as they actually ran according to .ninja_log, with measured peak RSS for measuring
+    # edges and modeled memory for fake ones. Peak RSS is held for the whole edge, so peaks are upper bounds.
+    tu_of_object = {obj: name for name, obj in measuring_results.object_files.items()}
+    measuring_memory = {}
+    for output, edge in read_ninja_script(measuring_ninja_script_path).items():
+        tu = tu_of_object.get(edge.variables.get('obj_file'))
+        if tu in measuring_results.peak_memory:
+            measuring_memory[output] = measuring_results.peak_memory[tu]
+    fake_memory = {output: memory[edge.inputs[0]]
+                   for output, edge in read_ninja_script(fake_ninja_script_path).items()
+                   if edge.inputs and edge.inputs[0] in memory}
+
+    peaks = {}
+    for name, script_path, edge_memory in (('header', measuring_ninja_script_path, measuring_memory),
+                                           ('modular', fake_ninja_script_path, fake_memory)):
+        edges = group_edges(read_ninja_log(os.path.join(containing_dir(script_path), '.ninja_log')))
+        peak, peak_time = peak_concurrent_memory(edges, edge_memory)
+        peaks[name] = {'peak_memory': peak, 'time': peak_time}
+    peaks['predicted'] = {'peak_memory': prediction.peak_memory}
+
+    memory_path = os.path.join(output_path, 'memory.json')
+    report('Dumping peak memory of both builds and memory of fake edges to', memory_path)
+    with open(memory_path, 'w') as f:
+        json.dump({'peaks': peaks, 'edges': memory}, f, indent=2)
+    return peaks
+
+
+def reduce_fake_build_graph(measuring_results):
+    report('Removing transitively redundant dependencies')
+    reduced = reduce_measurements(measuring_results)
+    report('Dependencies: {} before, {} after reduction'.format(edge_count(measuring_results.immediate_deps),
+                                                                 edge_count(reduced.immediate_deps)))
+    return reduced
+
+
+def predict_fake_build(measuring_results, parallelism=None, spawn_overhead=None, memory=None, pools=None):
+    # with fake compiler edges take exactly their self-time, but not less than the spawn overhead
+    if spawn_overhead is None:
+        return predict(measuring_results, parallelism, memory=memory, pools=pools)
+    return predict(measuring_results, parallelism, spawn_time=0., min_time=spawn_overhead, memory=memory, pools=pools)
+
+
+def dump_telemetry(telemetry, output_path):
+    json_path = os.path.join(output_path, 'telemetry.json')
+    trace_path = os.path.join(output_path, 'telemetry.trace.json')
+    report('Dumping pipeline telemetry to {}, Chrome/Perfetto trace to {}'.format(json_path, trace_path))
+    telemetry.dump(json_path, trace_path)
+    print('########################')
+    print(telemetry.format_table())
+
+
+def main(cdb_path, output_path, measuring_compiler_path, jobs=1, cache_path=None, hash_traces=False,
+         binary_results=False, sweep_parallelism=None, sweep_repeats=1, sample_fraction=None,
+         sample_by='directory', sample_seed=0, use_fake_compiler=False, pcm_dir=None, reduce_deps=True,
+         overhead_model_path=None, pipeline=False, repeat=1, repeat_precision=DEFAULT_PRECISION,
+         confidence=DEFAULT_CONFIDENCE, measure_memory=False, memory_budget=None, incremental=False):
+    telemetry = Telemetry()
+    prepare_output_dirs(output_path, incremental)
+    sample_plan = None
+    if sample_fraction:
+        with telemetry.phase('sampling') as phase:
+            sample_plan = sample_measuring_cdb(cdb_path, output_path, sample_fraction, sample_by, sample_seed)
+            phase.count('entries', len(sample_plan.entries))
+            phase.count('sampled', len(sample_plan.sampled))
+    with telemetry.phase('cdb conversion') as phase:
+        measuring_ninja_script_path, obj_files_mapping = create_measuring_ninja_script(
+            cdb_path, output_path, measuring_compiler_path,
+            [e.entry for e in sample_plan.sampled] if sample_plan else None, measure_memory)
+        phase.count('entries', len(obj_files_mapping))
+    collected = None
+    measuring_merger = None
+    if repeat > 1:
+        with telemetry.phase('repeated measuring builds') as phase:
+            measuring_times, tu_results, measuring_merger = repeat_measuring_builds(
+                measuring_ninja_script_path, obj_files_mapping, repeat, repeat_precision, confidence, jobs,
+                cache_path, hash_traces, pipeline)
+            collected = (tu_results, measuring_merger.results())
+            normal_time = statistics.mean(measuring_times)
+            phase.count('runs', len(measuring_times))
+            phase.count('edges', len(obj_files_mapping) * len(measuring_times))
+    elif pipeline:
+        with telemetry.phase('measuring build with trace processing') as phase:
+            normal_time, collected = build_and_collect_traces(measuring_ninja_script_path, obj_files_mapping, jobs,
+                                                              cache_path, hash_traces, not incremental)
+            phase.count('edges', len(obj_files_mapping))
+    else:
+        with telemetry.phase('measuring build') as phase:
+            normal_time = report_ninja_time(measuring_ninja_script_path, 'measuring', clean=not incremental)
+            phase.count('edges', len(obj_files_mapping))
+    with telemetry.phase('trace processing') as phase:
+        measuring_results = collect_measuring_results(obj_files_mapping, output_path, jobs, cache_path, hash_traces,
+                                                      binary_results, sample_plan, collected, measure_memory)
+        phase.count('traces', len(obj_files_mapping))
+        phase.count('nodes', len(measuring_results.build_times))
+        phase.count('dependencies', edge_count(measuring_results.immediate_deps))
+    if reduce_deps:
+        with telemetry.phase('graph reduction') as phase:
+            measuring_results = reduce_fake_build_graph(measuring_results)
+            phase.count('dependencies', edge_count(measuring_results.immediate_deps))
+    memory = pools = None
+    if measure_memory:
+        with telemetry.phase('memory model') as phase:
+            memory, pools = model_edge_memory(measuring_results, memory_budget)
+            phase.count('pooled edges', len(pools[1]) if pools else 0)
+    with telemetry.phase('fake script generation') as phase:
+        fake_build_ninja_script_path, spawn_overhead = create_fake_ninja_build(measuring_results, output_path,
+                                                                               use_fake_compiler, pcm_dir,
+                                                                               overhead_model_path, pools)
+        phase.count('edges', len(measuring_results.build_times))
+        phase.count('script bytes', os.path.getsize(fake_build_ninja_script_path))
+    with telemetry.phase('prediction'):
+        prediction = predict_fake_build(measuring_results, spawn_overhead=spawn_overhead, memory=memory, pools=pools)
+    report('Predicted fake build', format_prediction(prediction))
+    with telemetry.phase('fake build') as phase:
+        fake_times = repeat_ninja_time(fake_build_ninja_script_path, 'fake', repeat, repeat_precision, confidence)
+        modular_time = statistics.mean(fake_times)
+        phase.count('runs', len(fake_times))
+        phase.count('edges', len(measuring_results.build_times) * len(fake_times))
+    with telemetry.phase('ninja log analysis') as phase:
+        analysis = analyze_ninja_logs(measuring_ninja_script_path, fake_build_ninja_script_path, measuring_results,
+                                      output_path)
+        phase.count('edges', analysis['measuring']['schedule']['edges'] + analysis['fake']['schedule']['edges'])
+
+    peaks = None
+    if measure_memory:
+        peaks = report_peak_memory(measuring_ninja_script_path, fake_build_ninja_script_path, measuring_results,
+                                   memory, prediction, output_path)
+    if measuring_merger is not None:
+        report_repeat_statistics(measuring_times, fake_times, measuring_merger.tu_times, output_path, confidence)
 
     print('########################')
-    print('normal:  {:.2f}s'.format(normal_time))
-    print('modular: {:.2f}s'.format(modular_time))
+    if measuring_merger is not None:
+        print('normal:    {}'.format(format_summary(summarize(measuring_times, confidence))))
+        print('modular:   {}'.format(format_summary(summarize(fake_times, confidence))))
+    else:
+        print('normal:    {:.2f}s{}{}'.format(normal_time, ' (sampled TUs only)' if sample_plan else '',
+                                            ' (incremental)' if incremental else ''))
+        print('modular:   {:.2f}s'.format(modular_time))
+    print('predicted: {:.2f}s ({:+.1f}%)'.format(prediction.makespan,
+                                                  100. * (prediction.makespan - modular_time) / modular_time))
+    if peaks is not None:
+        print('peak memory: header build {:.2f}GB{}, modular build {:.2f}GB, predicted {:.2f}GB'.format(
+            peaks['header']['peak_memory'] / 1e9, ' (sampled TUs only)' if sample_plan else '',
+            peaks['modular']['peak_memory'] / 1e9, peaks['predicted']['peak_memory'] / 1e9))
+
+    if sweep_parallelism:
+        fake_build_for = None
+        if pools is not None:
+            # pools are sized for the -j the fake build is run with, so every swept -j gets a fake build of its own
+            def fake_build_for(parallelism):
+                sweep_pools = size_memory_pools(memory, memory_budget, parallelism)
+                script_path, _ = create_fake_ninja_build(measuring_results, output_path, use_fake_compiler, pcm_dir,
+                                                         overhead_model_path, sweep_pools, spawn_overhead)
+                return script_path, sweep_pools
+
+        with telemetry.phase('parallelism sweep') as phase:
+            report_scaling_sweep(measuring_ninja_script_path, fake_build_ninja_script_path, measuring_results,
+                                 output_path, sweep_parallelism, sweep_repeats, spawn_overhead, memory,
+                                 fake_build_for)
+            phase.count('builds', 2 * len(sweep_parallelism) * sweep_repeats)
+
+    dump_telemetry(telemetry, output_path)
 
 
 if __name__ == '__main__':
@@ -137,11 +555,86 @@ if __name__ == '__main__':
                         required=True)
     parser.add_argument('--force', help='Erase output directory', default=False, action='store_true')
     parser.add_argument('--measuring-compiler-path', help='path to measuring compilers (clang/clang++)', required=True)
+    parser.add_argument('--jobs', help='number of processes used to process time traces', type=int, default=1)
+    parser.add_argument('--cache-path', help='path to a persistent cache of processed time traces, '
+                                             'must be outside of the output directory. Measuring builds are clean '
+                                             'builds rewriting every trace, so it only hits with --incremental')
+    parser.add_argument('--hash-traces', help='validate cached traces by content hash, not only by mtime',
+                        default=False, action='store_true')
+    parser.add_argument('--binary-results', help='dump processed traces in the compact binary format',
+                        default=False, action='store_true')
+    parser.add_argument('--sweep-parallelism', help='comma-separated list of -j values to time both builds with',
+                        type=lambda s: [parallelism_arg(j) for j in s.split(',')])
+    parser.add_argument('--sweep-repeats', help='number of runs for each -j value of the sweep', type=int, default=1)
+    parser.add_argument('--sample-fraction', help='measure only this fraction of TUs and extrapolate to the rest',
+                        type=float)
+    parser.add_argument('--sample-by', help='how to stratify sampled TUs', choices=['directory', 'flags'],
+                        default='directory')
+    parser.add_argument('--sample-seed', help='random seed for sampling', type=int, default=0)
+    parser.add_argument('--fake-compiler', help='run fake build edges with a single fake compiler process each '
+                                                '(instead of a chain of shell commands)',
+                        default=False, action='store_true')
+    parser.add_argument('--calibrate-bmi', help='directory with real .pcm files to fit the BMI size model to')
+    parser.add_argument('--keep-redundant-deps', help='don\'t remove transitively redundant dependencies '
+                                                      'from the fake build', default=False, action='store_true')
+    parser.add_argument('--overhead-model', help='per-edge overhead model fitted on .ninja_log of a previous run '
+                                                 '(overhead_model.json in its output directory)')
+    parser.add_argument('--pipeline', help='process time traces while the measuring build is running, at low '
+                                           'priority', default=False, action='store_true')
+    parser.add_argument('--repeat', help='max number of runs of both builds, self-times are pooled over all measuring '
+                                         'runs and build times reported with confidence intervals', type=int,
+                        default=1)
+    parser.add_argument('--repeat-precision', help='stop repeating once the CI of the mean build time is narrower '
+                                                   'than this fraction of it (0 to always do all runs)', type=float,
+                        default=DEFAULT_PRECISION)
+    parser.add_argument('--confidence', help='confidence level of reported intervals', type=float,
+                        default=DEFAULT_CONFIDENCE)
+    parser.add_argument('--measure-memory', help='record peak RSS of measuring compiles, model memory of fake build '
+                                                 'edges and report peak aggregate memory of both builds',
+                        default=False, action='store_true')
+    parser.add_argument('--memory-budget', help='memory budget in GB to limit heavy fake build edges to with ninja '
+                                                'pools, implies --measure-memory', type=float)
+    parser.add_argument('--incremental', help='keep the measuring build of the previous run in the output directory '
+                                              'and only rebuild what changed since, the reported measuring build '
+                                              'time is then the incremental one', default=False, action='store_true')
+    parser.add_argument('--invalidate-cache', help='drop the traces cache before running', default=False,
+                        action='store_true')
     args = parser.parse_args()
 
+    cache_path = os.path.abspath(args.cache_path) if args.cache_path else None
+    if cache_path and os.path.commonpath([cache_path, os.path.abspath(args.output_path)]) == \
+            os.path.abspath(args.output_path):
+        print('cache path must be outside of the output directory', file=sys.stderr)
+        exit(1)
+    if cache_path and args.invalidate_cache:
+        invalidate(cache_path)
+
+    if args.repeat > 1 and args.sample_fraction:
+        print('--repeat can\'t be combined with --sample-fraction', file=sys.stderr)
+        exit(1)
+    if args.repeat > 1 and args.incremental:
+        print('--repeat can\'t be combined with --incremental, repeated measuring builds are clean', file=sys.stderr)
+        exit(1)
+
+    if args.overhead_model:
+        # checked before the measuring build, which may take long
+        try:
+            check_overhead_model(load_overhead_model(args.overhead_model),
+                                 FAKE_COMPILER_MODE if args.fake_compiler else SHELL_MODE)
+        except RuntimeError as e:
+            print(e, file=sys.stderr)
+            exit(1)
+
     if not args.force and (not os.path.isdir(args.output_path) or os.listdir(args.output_path)):
-        print('output directory not empty, pass --force to remove anyway', file=sys.stderr)
+        print('output directory not empty, pass --force to remove anyway (and --incremental to keep the measuring '
+              'build)', file=sys.stderr)
         exit(1)
 
     sys.exit(main(os.path.abspath(args.cdb_path), os.path.abspath(args.output_path),
-                  os.path.abspath(args.measuring_compiler_path)))
+                  os.path.abspath(args.measuring_compiler_path), args.jobs, cache_path, args.hash_traces,
+                  args.binary_results, args.sweep_parallelism, args.sweep_repeats, args.sample_fraction,
+                  args.sample_by, args.sample_seed, args.fake_compiler,
+                  os.path.abspath(args.calibrate_bmi) if args.calibrate_bmi else None, not args.keep_redundant_deps,
+                  os.path.abspath(args.overhead_model) if args.overhead_model else None, args.pipeline,
+                  args.repeat, args.repeat_precision, args.confidence, args.measure_memory or bool(args.memory_budget),
+                  int(args.memory_budget * 1e9) if args.memory_budget else None, args.incremental))
@@ -0,0 +1,162 @@
+import argparse
+import bisect
+import json
+import os
+import random
+import sys
+from typing import *
+
+
+class CorpusParams(NamedTuple):
+    tus: int = 1000
+    headers: int = 2000
+    depth: int = 6  # include layers, headers only include headers from deeper layers
+    fan_out: int = 4  # direct includes of every TU and header
+    shared_ratio: float = 0.2  # fraction of headers (and of includes) in the shared directory, visible everywhere
+    directories: int = 10
+    seed: int = 0
+    header_time_us: int = 2000  # median header self-time
+    tu_time_us: int = 50000  # median TU own time (after preamble)
+
+
+class Header(NamedTuple):
+    path: str
+    layer: int
+    self_time: int
+    includes: List[int]
+
+
+class IncludePool:
+    # headers sorted by layer, so headers deeper than a given layer are a suffix
+    def __init__(self, headers: List[Header], ids: List[int]):
+        self.ids = sorted(ids, key=lambda i: headers[i].layer)
+        self.layers = [headers[i].layer for i in self.ids]
+
+    def pick(self, rng: random.Random, below_layer: int) -> Optional[int]:
+        start = bisect.bisect_right(self.layers, below_layer)
+        if start == len(self.ids):
+            return None
+        return self.ids[rng.randrange(start, len(self.ids))]
+
+
+def header_graph(p: CorpusParams, root: str, rng: random.Random) -> Tuple[List[Header], IncludePool,
+                                                                          List[IncludePool]]:
+    shared_count = int(p.headers * p.shared_ratio)
+    headers = []
+    for i in range(p.headers):
+        directory = 'common' if i < shared_count else 'd{}'.format(i % p.directories)
+        # lognormal self-times: most headers are cheap, a few are very expensive
+        self_time = int(p.header_time_us * rng.lognormvariate(0., 1.))
+        headers.append(Header(os.path.join(root, 'include', directory, 'h{}.h'.format(i)), rng.randrange(p.depth),
+                              self_time, []))
+    shared = IncludePool(headers, list(range(shared_count)))
+    local = [IncludePool(headers, [i for i in range(shared_count, p.headers) if i % p.directories == d])
+             for d in range(p.directories)]
+    for i, h in enumerate(headers):
+        pool = local[i % p.directories] if i >= shared_count else None
+        h.includes.extend(pick_includes(p, rng, shared, pool, h.layer))
+    return headers, shared, local
+
+
+def pick_includes(p: CorpusParams, rng: random.Random, shared: IncludePool, local: Optional[IncludePool],
+                  layer: int) -> List[int]:
+    includes = []
+    for _ in range(p.fan_out):
+        first, second = (shared, local) if local is None or rng.random() < p.shared_ratio else (local, shared)
+        picked = first.pick(rng, layer)
+        if picked is None and second is not None:
+            picked = second.pick(rng, layer)
+        if picked is not None and picked not in includes:
+            includes.append(picked)
+    return includes
+
+
+def trace_text(tu_path: str, includes: List[int], headers: List[Header], quoted: List[str], tu_time: int,
+               rng: random.Random) -> str:
+    # the same events the measuring compiler writes: the TU is entered first and never exited, every header is
+    # entered once and skipped afterwards (include guards), times are in us
+    events = ['{{"Type": "enter", "File": {}, "TimestampMS": 0}}'.format(json.dumps(tu_path))]
+    seen = set()
+    now = 0
+    stack = [(i, False) for i in reversed(includes)]
+    while stack:
+        i, exiting = stack.pop()
+        if exiting:
+            now += headers[i].self_time // 2
+            events.append('{{"Type": "exit", "File": {}, "TimestampMS": {}}}'.format(quoted[i], now))
+            continue
+        if i in seen:
+            events.append('{{"Type": "skip", "File": {}, "TimestampMS": {}}}'.format(quoted[i], now))
+            continue
+        seen.add(i)
+        events.append('{{"Type": "enter", "File": {}, "TimestampMS": {}}}'.format(quoted[i], now))
+        # some jitter between TUs, half of the self-time before the nested includes and half after them
+        now += int(headers[i].self_time * rng.uniform(0.9, 1.1)) - headers[i].self_time // 2
+        stack.append((i, True))
+        stack.extend((c, False) for c in reversed(headers[i].includes))
+    return '{{"Events": [\n{}\n], "TotalTime": {}}}\n'.format(',\n'.join(events), now + tu_time)
+
+
+def generate_corpus(p: CorpusParams, root: str) -> str:
+    # Writes compile_commands.json and a time trace for every TU next to its object file, where the measuring
+    # build would leave it. Sources and headers themselves are not written, no stage reads them.
+    rng = random.Random(p.seed)
+    headers, shared, local = header_graph(p, root, rng)
+    quoted = [json.dumps(h.path) for h in headers]
+    cdb_path = os.path.join(root, 'compile_commands.json')
+    os.makedirs(root, exist_ok=True)
+    with open(cdb_path, 'w') as cdb:
+        cdb.write('[\n')
+        for n in range(p.tus):
+            d = n % p.directories
+            source = os.path.join('src', 'd{}'.format(d), 'f{}.cpp'.format(n))
+            obj = os.path.join('build', 'd{}'.format(d), 'f{}.o'.format(n))
+            # a handful of flag sets per directory, like targets of a real project
+            command = 'clang++ -Iinclude/common -Iinclude/d{} -O2 -DTARGET={} -c {} -o {}'.format(
+                d, n % 3, source, obj)
+            cdb.write('{}{}'.format(',\n' if n else '',
+                                    json.dumps({'directory': root, 'command': command, 'file': source})))
+            includes = pick_includes(p, rng, shared, local[d], -1)
+            trace_path = os.path.join(root, obj + '.time.json')
+            os.makedirs(os.path.dirname(trace_path), exist_ok=True)
+            with open(trace_path, 'w') as f:
+                f.write(trace_text(os.path.join(root, source), includes, headers, quoted,
+                                   int(p.tu_time_us * rng.lognormvariate(0., 0.5)), rng))
+        cdb.write('\n]\n')
+    with open(os.path.join(root, 'corpus.json'), 'w') as f:
+        json.dump(p._asdict(), f, indent=2)
+    return cdb_path
+
+
+def trace_paths(root: str) -> List[str]:
+    # same order as the CDB, which is the order the pipeline processes traces in
+    result = []
+    with open(os.path.join(root, 'compile_commands.json')) as f:
+        for entry in json.load(f):
+            obj = entry['command'].rsplit(' -o ', 1)[1]
+            result.append(os.path.join(entry['directory'], obj + '.time.json'))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic CDB with matching time traces')
+
+    parser.add_argument('output', help='directory to generate the corpus in')
+    defaults = CorpusParams()
+    parser.add_argument('--tus', type=int, default=defaults.tus)
+    parser.add_argument('--headers', type=int, default=defaults.headers)
+    parser.add_argument('--depth', help='number of include layers', type=int, default=defaults.depth)
+    parser.add_argument('--fan-out', help='direct includes per TU and header', type=int, default=defaults.fan_out)
+    parser.add_argument('--shared-ratio', help='fraction of headers and includes shared by all directories',
+                        type=float, default=defaults.shared_ratio)
+    parser.add_argument('--directories', type=int, default=defaults.directories)
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+    args = parser.parse_args()
+
+    params = CorpusParams(args.tus, args.headers, args.depth, args.fan_out, args.shared_ratio, args.directories,
+                          args.seed)
+    print('generated', generate_corpus(params, os.path.abspath(args.output)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
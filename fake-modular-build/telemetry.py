@@ -0,0 +1,138 @@
+import contextlib
+import json
+import os
+import resource
+import sys
+import time
+from typing import *
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+BLOCK_SIZE = 512  # unit of ru_inblock/ru_oublock
+
+
+def read_proc_io() -> Optional[Tuple[int, int]]:
+    # bytes read and written by this process through read/write-like calls, Linux only
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(':', 1) for line in f)
+    except OSError:
+        return None
+    return int(fields['rchar']), int(fields['wchar'])
+
+
+class Sample(NamedTuple):
+    wall: float
+    cpu_self: float
+    cpu_children: float
+    maxrss_self: int
+    maxrss_children: int
+    io_self: Optional[Tuple[int, int]]
+    io_children: Tuple[int, int]  # block IO only, children's /proc/self/io is gone once they're reaped
+
+
+def sample() -> Sample:
+    usage_self = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return Sample(time.perf_counter(),
+                  usage_self.ru_utime + usage_self.ru_stime,
+                  usage_children.ru_utime + usage_children.ru_stime,
+                  usage_self.ru_maxrss * MAXRSS_UNIT,
+                  usage_children.ru_maxrss * MAXRSS_UNIT,
+                  read_proc_io(),
+                  (usage_children.ru_inblock * BLOCK_SIZE, usage_children.ru_oublock * BLOCK_SIZE))
+
+
+class Phase:
+    def __init__(self, name: str, depth: int, start: Sample, origin: float):
+        self.name = name
+        self.depth = depth
+        self.start = start
+        self.origin = origin
+        self.end: Optional[Sample] = None
+        self.counts: Dict[str, int] = {}
+
+    def count(self, key: str, value: int):
+        self.counts[key] = self.counts.get(key, 0) + value
+
+    def to_dict(self) -> Dict[str, Any]:
+        # peak RSS values are high-water marks of the whole run up to the end of the phase, not of the phase alone
+        start, end = self.start, self.end
+        result = {
+            'name': self.name,
+            'depth': self.depth,
+            'start': start.wall - self.origin,
+            'wall_time': end.wall - start.wall,
+            'cpu_time': end.cpu_self - start.cpu_self,
+            'children_cpu_time': end.cpu_children - start.cpu_children,
+            'peak_rss': end.maxrss_self,
+            'children_peak_rss': end.maxrss_children,
+            'children_bytes_read': end.io_children[0] - start.io_children[0],
+            'children_bytes_written': end.io_children[1] - start.io_children[1],
+            'counts': self.counts,
+        }
+        if start.io_self is not None and end.io_self is not None:
+            result['bytes_read'] = end.io_self[0] - start.io_self[0]
+            result['bytes_written'] = end.io_self[1] - start.io_self[1]
+        return result
+
+
+class Telemetry:
+    # Resource usage of the pipeline phases. Child process figures cover only children which were waited for,
+    # which is the case for everything run with subprocess.check_call and for multiprocessing pools.
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.phases: List[Phase] = []
+        self.depth = 0
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[Phase]:
+        phase = Phase(name, self.depth, sample(), self.origin)
+        self.phases.append(phase)
+        self.depth += 1
+        try:
+            yield phase
+        finally:
+            self.depth -= 1
+            phase.end = sample()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'pid': os.getpid(), 'argv': sys.argv, 'phases': [p.to_dict() for p in self.phases if p.end]}
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        # Trace Event Format, opens in chrome://tracing and ui.perfetto.dev: a complete event per phase and
+        # counter tracks for memory, sampled at phase boundaries
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': 1, 'tid': 1, 'args': {'name': 'simulateModularBuild'}}]
+        for p in self.phases:
+            if not p.end:
+                continue
+            d = p.to_dict()
+            args = {k: v for k, v in d.items() if k not in ('name', 'depth', 'start', 'counts')}
+            args.update(d['counts'])
+            events.append({'name': p.name, 'cat': 'phase', 'ph': 'X', 'pid': 1, 'tid': 1,
+                           'ts': d['start'] * 1e6, 'dur': d['wall_time'] * 1e6, 'args': args})
+            for s in (p.start, p.end):
+                events.append({'name': 'peak RSS, MB', 'ph': 'C', 'pid': 1, 'ts': (s.wall - self.origin) * 1e6,
+                               'args': {'self': s.maxrss_self / 1e6, 'children': s.maxrss_children / 1e6}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def dump(self, json_path: str, trace_path: str):
+        with open(json_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        with open(trace_path, 'w') as f:
+            json.dump(self.to_chrome_trace(), f)
+
+    def format_table(self) -> str:
+        lines = ['{:<28} {:>9} {:>9} {:>9} {:>9} {:>10} {:>10}  {}'.format(
+            'phase', 'wall', 'cpu', 'child cpu', 'peak RSS', 'read', 'written', 'counts')]
+        for p in self.phases:
+            if not p.end:
+                continue
+            d = p.to_dict()
+            lines.append('{:<28} {:>8.2f}s {:>8.2f}s {:>8.2f}s {:>7.0f}MB {:>8.1f}MB {:>8.1f}MB  {}'.format(
+                '  ' * p.depth + p.name, d['wall_time'], d['cpu_time'], d['children_cpu_time'],
+                max(d['peak_rss'], d['children_peak_rss']) / 1e6,
+                (d.get('bytes_read', 0) + d['children_bytes_read']) / 1e6,
+                (d.get('bytes_written', 0) + d['children_bytes_written']) / 1e6,
+                ', '.join('{} {}'.format(v, k) for k, v in d['counts'].items())).rstrip())
+        return '\n'.join(lines)
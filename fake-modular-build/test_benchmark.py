@@ -0,0 +1,22 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # modules here import each other by plain name
+
+from benchmark import MIN_STAGE_TIME, is_slower
+
+
+class IsSlowerTest(unittest.TestCase):
+    def test_short_stages_need_the_slowdown_of_a_min_length_stage(self):
+        # 1.6x of 10ms is within the noise of a short stage
+        self.assertFalse(is_slower(0.016, 0.01, 1.5))
+        self.assertTrue(is_slower(0.01 + 0.6 * MIN_STAGE_TIME, 0.01, 1.5))
+
+    def test_long_stages_are_held_to_the_ratio(self):
+        self.assertFalse(is_slower(2.9, 2., 1.5))
+        self.assertTrue(is_slower(3.1, 2., 1.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,24 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # modules here import each other by plain name
+
+from cdbToNinja import CDBToNinjaBuilder
+
+
+class BuildEdgeTest(unittest.TestCase):
+    def edge(self, measuring_compilers_path):
+        builder = CDBToNinjaBuilder(measuring_compilers_path)
+        builder.add_cdb_command('/usr/bin/c++ -O2 -c src/a.cpp -o build/a.o', 'src/a.cpp', '/work')
+        return builder.edges[0].splitlines()[0]
+
+    def test_trace_is_an_absolute_output(self):
+        self.assertEqual(self.edge('/clang').split(':')[0], 'build /work/build/a.o /work/build/a.o.time.json')
+
+    def test_without_measuring_compiler_only_the_object_is_an_output(self):
+        self.assertEqual(self.edge(None).split(':')[0], 'build /work/build/a.o')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,23 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # modules here import each other by plain name
+
+from commandNormalizer import canonical_flag_set
+
+
+class CanonicalFlagSetTest(unittest.TestCase):
+    def test_order_of_overriding_flags_is_kept(self):
+        for a, b in [('-Wall', '-Wno-unused-variable'), ('-Werror', '-Wno-error=unused'),
+                     ('-ffast-math', '-fno-finite-math-only'), ('-march=x86-64', '-mno-avx')]:
+            self.assertNotEqual(canonical_flag_set([a, b]), canonical_flag_set([b, a]), (a, b))
+
+    def test_independent_flags_are_reordered(self):
+        self.assertEqual(canonical_flag_set(['-DA=1', '-O2', '-DB', '-Wall']),
+                         canonical_flag_set(['-Wall', '-DB', '-O2', '-DA=1']))
+        self.assertNotEqual(canonical_flag_set(['-DA', '-UA']), canonical_flag_set(['-UA', '-DA']))
+
+
+if __name__ == '__main__':
+    unittest.main()
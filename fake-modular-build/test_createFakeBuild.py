@@ -0,0 +1,42 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # modules here import each other by plain name
+
+import MeasuringResults
+from createFakeBuild import MIN_TIME_TO_SPAWN_COMPILER, OBJFILE_RULE, NinjaBuilder, OverheadModel, get_bmi_path, \
+    measurements_to_ninja
+from graphReduction import reduce_measurements
+
+
+def wait_time(builder: NinjaBuilder, self_time_us: int) -> float:
+    builder.add_fake_command(OBJFILE_RULE, self_time_us, 'a.cpp', [], 'a.o')
+    return float(builder.edges[-1].split('wait_time = ')[1].split()[0])
+
+
+class WaitTimeTest(unittest.TestCase):
+    def test_shell_rules_add_spawn_time(self):
+        self.assertAlmostEqual(wait_time(NinjaBuilder(), 100000), 0.1 + MIN_TIME_TO_SPAWN_COMPILER)
+
+    def test_overhead_model_aims_at_self_time(self):
+        model = OverheadModel(0.005, 1., 'shell')
+        self.assertAlmostEqual(wait_time(NinjaBuilder(overhead_model=model), 100000), 0.095)
+        self.assertAlmostEqual(wait_time(NinjaBuilder('fake', overhead_model=model._replace(mode='fake-compiler')),
+                                         100000), 0.095)
+
+
+class BmisTest(unittest.TestCase):
+    def test_reduced_edges_still_read_all_imported_bmis(self):
+        m = MeasuringResults.MeasuringResults({'a.cpp': 10, 'a.h': 10, 'b.h': 10},
+                                              {'a.cpp': {'a.h', 'b.h'}, 'a.h': {'b.h'}, 'b.h': set()},
+                                              {'a.cpp': 'a.o'})
+        script = measurements_to_ninja(reduce_measurements(m), 'out')
+        edge = script[script.index('build a.o:'):]
+        a, b = get_bmi_path('a.h', 'out'), get_bmi_path('b.h', 'out')
+        self.assertEqual(edge.splitlines()[0], 'build a.o: fake_objfile a.cpp  | {}'.format(a))
+        self.assertIn('bmis = {} {}'.format(a, b), edge)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,21 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # modules here import each other by plain name
+
+from memoryModel import memory_pools
+
+
+class MemoryPoolsTest(unittest.TestCase):
+    def test_pools_are_sized_for_the_parallelism(self):
+        memory = {'light': 100, 'heavy': 400}
+        self.assertEqual(memory_pools(memory, 1000, 2), ({}, {}))
+        self.assertEqual(memory_pools(memory, 1000, 8), ({'memory2': 2}, {'heavy': 'memory2'}))
+
+    def test_non_positive_parallelism_is_rejected(self):
+        self.assertRaises(RuntimeError, memory_pools, {'a': 1}, 1000, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # modules here import each other by plain name
+
+from createFakeBuild import FAKE_COMPILER_MODE, SHELL_MODE, NinjaBuilder, OverheadModel, check_overhead_model
+from ninjaLog import fit_overhead, read_build_mode
+
+
+class OverheadModeTest(unittest.TestCase):
+    def test_fake_build_script_records_its_mode(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'build.ninja')
+            for fake_compiler, mode in ((None, SHELL_MODE), ('fake-compiler', FAKE_COMPILER_MODE)):
+                with open(path, 'w') as f:
+                    f.write(NinjaBuilder(fake_compiler).build())
+                self.assertEqual(read_build_mode(path), mode)
+
+    def test_model_applies_only_to_the_mode_it_was_fitted_in(self):
+        model = fit_overhead([(0.1, 0.12), (0.2, 0.22)], SHELL_MODE)
+        self.assertEqual(model.mode, SHELL_MODE)
+        self.assertTrue(check_overhead_model(model, SHELL_MODE))
+        with self.assertRaises(RuntimeError):
+            check_overhead_model(model, FAKE_COMPILER_MODE)
+        self.assertFalse(check_overhead_model(OverheadModel(**{'fixed': 0.01, 'scale': 1.}), FAKE_COMPILER_MODE))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # modules here import each other by plain name
+
+import MeasuringResults
+from createFakeBuild import fake_compiler_command, measure_spawn_overhead, measurements_to_ninja
+from predictModularBuild import build_graph, parallelism_arg, predict, simulate
+
+
+def few_edge_results(root: str) -> MeasuringResults.MeasuringResults:
+    # two sources importing a chain of two modules, and one importing nothing, self-times in us
+    sources = [os.path.join(root, name) for name in ('a.h', 'b.h', 'a.cpp', 'b.cpp', 'c.cpp')]
+    for source in sources:
+        open(source, 'w').close()
+    a_h, b_h, a_cpp, b_cpp, c_cpp = sources
+    return MeasuringResults.MeasuringResults(
+        {a_h: 200000, b_h: 150000, a_cpp: 100000, b_cpp: 250000, c_cpp: 300000},
+        {a_h: set(), b_h: {a_h}, a_cpp: {a_h}, b_cpp: {b_h}, c_cpp: set()},
+        {a_cpp: os.path.join(root, 'a.o'), b_cpp: os.path.join(root, 'b.o'), c_cpp: os.path.join(root, 'c.o')})
+
+
+class ParallelismTest(unittest.TestCase):
+    def test_non_positive_parallelism_is_rejected(self):
+        m = MeasuringResults.MeasuringResults({'a.cpp': 10}, {'a.cpp': set()}, {'a.cpp': 'a.o'})
+        for parallelism in (0, -1):
+            self.assertRaises(RuntimeError, simulate, build_graph(m), parallelism)
+            self.assertRaises(argparse.ArgumentTypeError, parallelism_arg, str(parallelism))
+        self.assertEqual(parallelism_arg('4'), 4)
+
+
+@unittest.skipIf(shutil.which('ninja') is None, 'needs ninja')
+class FakeCompilerBuildTest(unittest.TestCase):
+    def test_prediction_matches_measured_time(self):
+        with tempfile.TemporaryDirectory() as d:
+            m = few_edge_results(d)
+            os.mkdir(os.path.join(d, 'BMI'))
+            compiler = fake_compiler_command()
+            spawn_overhead = measure_spawn_overhead(compiler)
+            with open(os.path.join(d, 'build.ninja'), 'w') as f:
+                f.write(measurements_to_ninja(m, d, compiler, spawn_overhead))
+            start_time = time.perf_counter()
+            subprocess.check_call(['ninja', '-j2'], cwd=d, stdout=subprocess.DEVNULL)
+            measured = time.perf_counter() - start_time
+        # the same prediction simulateModularBuild makes for fake compiler builds
+        predicted = predict(m, 2, spawn_time=0., min_time=spawn_overhead).makespan
+        self.assertAlmostEqual(predicted, 0.6)
+        # ninja startup and scheduling come on top of the edges, and a loaded machine spawns slower
+        self.assertGreater(measured, predicted - 0.05)
+        self.assertLess(measured, predicted * 1.2 + 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import multiprocessing
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # modules here import each other by plain name
+
+from tracePipeline import WORKER_NICENESS, NinjaLogTail, TracePipeline
+
+
+class TracePipelineTest(unittest.TestCase):
+    def test_workers_run_at_low_priority(self):
+        with TracePipeline([]) as pipeline:
+            self.assertGreaterEqual(pipeline.pool.apply(os.nice, (0,)), min(19, os.nice(0) + WORKER_NICENESS))
+
+    def test_pool_is_terminated_when_a_worker_fails(self):
+        with tempfile.TemporaryDirectory() as d:
+            missing = os.path.join(d, 'missing.o.time.json')
+            with self.assertRaises(OSError):
+                with TracePipeline([missing], d) as pipeline:
+                    pipeline.submit(missing)
+                    pipeline.collect(wait=True)
+        self.assertEqual(multiprocessing.active_children(), [])
+
+
+class NinjaLogTailTest(unittest.TestCase):
+    def test_skips_previous_builds_and_rereads_recompacted_logs(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, '.ninja_log')
+            with open(path, 'w') as f:
+                f.write('# ninja log v7\n0\t1\t1\ta.o\th\n')
+            tail = NinjaLogTail(path, os.path.getsize(path))
+            with open(path, 'a') as f:
+                f.write('1\t2\t2\tb.o\th\n')
+            self.assertEqual(tail.new_outputs(), ['b.o'])
+            with open(path, 'w') as f:
+                f.write('# ninja log v7\n1\t2\t2\tc.o\th\n')
+            self.assertEqual(tail.new_outputs(), ['c.o'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from typing import *
+
+from MeasuringResults import MeasuringResults
+from dependenciesForest import ResultsMerger, TuResult, _compact_trace_worker
+from resultsCache import ResultsCache
+
+POLL_INTERVAL = 0.05  # s
+WORKER_NICENESS = 19  # workers yield the CPU to the timed build, they only get what it leaves idle
+
+
+def _lower_priority():
+    os.nice(WORKER_NICENESS)
+
+
+class NinjaLogTail:
+    # outputs of edges of a running build as they finish, ninja appends and flushes a .ninja_log entry right
+    # after every edge. Entries before offset are of previous builds.
+    def __init__(self, path: str, offset: int = 0):
+        self.path = path
+        self.offset = offset
+        self.partial = b''
+
+    def new_outputs(self) -> List[str]:
+        try:
+            with open(self.path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < self.offset:
+                    self.offset = 0  # recompacted by ninja on startup, old entries only submit their traces early
+                    self.partial = b''
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        self.offset += len(data)
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()  # not terminated yet
+        outputs = []
+        for line in lines:
+            fields = line.decode(errors='replace').split('\t')
+            if not line.startswith(b'#') and len(fields) == 5:
+                outputs.append(fields[3])
+        return outputs
+
+
+class TracePipeline:
+    # Traces are processed in a process pool as soon as they are submitted, and merged in the order of trace_paths
+    # as soon as all the preceding ones are done, so the outcome is exactly the same as of collect_results.
+    # Use it as a context manager, the pool is terminated when leaving it early, e.g. on errors of a worker.
+    def __init__(self, trace_paths: List[str], root_dir: Optional[str] = None, jobs: int = 1,
+                 cache_path: Optional[str] = None, hash_traces: bool = False):
+        self.trace_paths = trace_paths
+        self.index = {tp: i for i, tp in enumerate(trace_paths)}
+        self.root_dir = root_dir if root_dir is not None else sys.argv[1]  # same fallback as collect_traces
+        self.cache = ResultsCache(cache_path, self.root_dir, hash_traces) if cache_path else None
+        self.results: List[Optional[TuResult]] = [None] * len(trace_paths)
+        self.pending: Dict[str, Any] = {}  # trace path: AsyncResult
+        self.submitted: Set[str] = set()
+        self.merger = ResultsMerger()
+        self.merged = 0
+        self.processed_during_build = 0
+        self.pool = multiprocessing.Pool(max(1, jobs), _lower_priority)
+
+    def __enter__(self) -> 'TracePipeline':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.terminate()  # no-op after finish
+
+    def submit(self, trace_path: str):
+        if trace_path in self.submitted or trace_path not in self.index:
+            return
+        self.submitted.add(trace_path)
+        cached = self.cache.get(trace_path) if self.cache is not None else None
+        if cached is not None:
+            self.results[self.index[trace_path]] = TuResult(*cached)
+        else:
+            self.pending[trace_path] = self.pool.apply_async(_compact_trace_worker, ((trace_path, self.root_dir),))
+
+    def collect(self, wait: bool = False):
+        for trace_path, async_result in list(self.pending.items()):
+            if not wait and not async_result.ready():
+                continue
+            tu_result, _, _ = async_result.get()  # re-raises errors of the worker
+            self.results[self.index[trace_path]] = tu_result
+            if self.cache is not None:
+                self.cache.put(trace_path, tu_result)
+            del self.pending[trace_path]
+        while self.merged < len(self.trace_paths) and self.results[self.merged] is not None:
+            self.merger.add(self.trace_paths[self.merged], self.results[self.merged])
+            self.merged += 1
+
+    def finish(self) -> Tuple[List[Tuple[str, TuResult]], MeasuringResults]:
+        # traces of edges which didn't show up in the log (e.g. up to date ones) are processed now
+        self.processed_during_build = len(self.submitted) - len(self.pending)
+        for tp in self.trace_paths:
+            self.submit(tp)
+        self.collect(wait=True)
+        self.pool.close()
+        self.pool.join()
+        if self.cache is not None:
+            self.cache.prune(self.trace_paths)
+            self.cache.save()
+            print('   ', self.cache.report())
+        return list(zip(self.trace_paths, self.results)), self.merger.results()
+
+    def terminate(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+def run_ninja_pipelined(ninja_dir: str, trace_for_output: Mapping[str, str], pipeline: TracePipeline,
+                        parallelism: Optional[int] = None, clean: bool = True) -> float:
+    # runs ninja, submitting the trace of every edge to the pipeline as soon as the edge finishes,
+    # returns the build time. Incremental builds need the log of the previous ones to know what is up to date.
+    log_path = os.path.join(ninja_dir, '.ninja_log')
+    offset = 0
+    if clean and os.path.isfile(log_path):
+        os.remove(log_path)  # only entries of this build are tailed
+    elif os.path.isfile(log_path):
+        offset = os.path.getsize(log_path)
+    tail = NinjaLogTail(log_path, offset)
+    command = ['ninja'] if parallelism is None else ['ninja', '-j{}'.format(parallelism)]
+    start_time = time.time()
+    with subprocess.Popen(command, cwd=ninja_dir, stdout=subprocess.DEVNULL) as process:
+        try:
+            while True:
+                finished = process.poll() is not None
+                for output in tail.new_outputs():
+                    trace_path = trace_for_output.get(output)
+                    if trace_path is not None:
+                        pipeline.submit(trace_path)
+                pipeline.collect()
+                if finished:
+                    break
+                time.sleep(POLL_INTERVAL)
+        except BaseException:
+            process.kill()  # leaving the with statement would wait for the whole build otherwise
+            raise
+    elapsed_time = time.time() - start_time
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    return elapsed_time
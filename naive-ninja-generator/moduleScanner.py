@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# Scans module units for what they provide and import. Only the module preamble is read: the optional global
+# module fragment (preprocessor directives only), the module declaration and the import declarations following it.
+# Scanning stops at the first other declaration, so the rest of the file is never read.
+
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import sys
+from collections import namedtuple
+
+CACHE_VERSION = 1
+CACHE_NAME = ".module-scan-cache.json"
+
+ScanResult = namedtuple("ScanResult", ["module", "imports", "header_units"])
+
+NAME = r"[A-Za-z_][\w.]*"
+MODULE_DECL = re.compile(r"^(?:export\s+)?module\s+({name})(?:\s*:\s*({name}))?$".format(name=NAME))
+IMPORT_DECL = re.compile(r"^(?:export\s+)?import\s+(?:({name})|:\s*({name})|(<[^>]*>|\"[^\"]*\"))$".format(name=NAME))
+PREAMBLE_KEYWORDS = ("export", "import", "module")
+
+
+def strip_comments(line, in_comment):
+    # returns the line without comments and whether a block comment is still open at its end
+    result = []
+    i = 0
+    while i < len(line):
+        if in_comment:
+            end = line.find("*/", i)
+            if end == -1:
+                return "".join(result), True
+            i = end + 2
+            in_comment = False
+            result.append(" ")
+        elif line.startswith("//", i):
+            break
+        elif line.startswith("/*", i):
+            in_comment = True
+            i += 2
+        else:
+            result.append(line[i])
+            i += 1
+    return "".join(result), in_comment
+
+
+def starts_preamble_declaration(text):
+    words = text.replace(":", " :").replace(";", " ;").split()
+    if words[0] == "export" and len(words) > 1:
+        return words[1] in ("import", "module")
+    return words[0] in PREAMBLE_KEYWORDS
+
+
+def scan_lines(lines):
+    module = None
+    imports = []
+    header_units = []
+    statement = ""
+    in_comment = False
+    in_directive = False
+    for raw_line in lines:
+        line, in_comment = strip_comments(raw_line.rstrip("\n"), in_comment)
+        if in_directive or (not statement and line.lstrip().startswith("#")):
+            in_directive = line.rstrip().endswith("\\")
+            continue
+        statement += " " + line
+        while True:
+            text = statement.strip()
+            if not text:
+                statement = ""
+                break
+            if not starts_preamble_declaration(text):
+                return ScanResult(module, imports, header_units)  # first declaration after the preamble
+            end = statement.find(";")
+            if end == -1:
+                break
+            declaration = " ".join(statement[:end].split())
+            statement = statement[end + 1:]
+            if declaration == "module":
+                continue  # global module fragment
+            if declaration in ("module :private", "module:private"):
+                return ScanResult(module, imports, header_units)
+            match = MODULE_DECL.match(declaration)
+            if match:
+                module = match.group(1) + (":" + match.group(2) if match.group(2) else "")
+                continue
+            match = IMPORT_DECL.match(declaration)
+            if not match:
+                return ScanResult(module, imports, header_units)  # e.g. "export int f();"
+            if match.group(1):
+                imports.append(match.group(1))
+            elif match.group(2):
+                # partitions are imported by their own name only, and only from units of the same module
+                primary = module.split(":")[0] if module else ""
+                imports.append(primary + ":" + match.group(2))
+            else:
+                header_units.append(match.group(3))
+    return ScanResult(module, imports, header_units)
+
+
+def scan_file(path):
+    with open(path, errors="replace") as f:
+        return scan_lines(f)
+
+
+def pcm_name(module):
+    # the name clang looks for in -fprebuilt-module-path, partitions use a dash
+    return module.replace(":", "-") + ".pcm"
+
+
+class ScanCache:
+    # per file results, valid while the file's mtime and size stay the same
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        if path and os.path.isfile(path):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                if data.get("version") == CACHE_VERSION:
+                    self.entries = data["entries"]
+            except (OSError, ValueError):
+                pass  # a broken cache is just rebuilt
+
+    @staticmethod
+    def stamp(path):
+        st = os.stat(path)
+        return [st.st_mtime_ns, st.st_size]
+
+    def get(self, path, stamp):
+        entry = self.entries.get(path)
+        if entry is None or entry[0] != stamp:
+            return None
+        return ScanResult(*entry[1])
+
+    def put(self, path, stamp, result):
+        self.entries[path] = [stamp, list(result)]
+        self.dirty = True
+
+    def prune(self, paths):
+        paths = set(paths)
+        for path in [p for p in self.entries if p not in paths]:
+            del self.entries[path]
+            self.dirty = True
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": CACHE_VERSION, "entries": self.entries}, f)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+def scan_files(paths, jobs=None, cache_path=None):
+    # returns {path: ScanResult}, only files changed since the last run are read
+    cache = ScanCache(cache_path)
+    stamps = {path: ScanCache.stamp(path) for path in paths}
+    results = {}
+    todo = []
+    for path in paths:
+        cached = cache.get(path, stamps[path])
+        if cached is None:
+            todo.append(path)
+        else:
+            results[path] = cached
+
+    jobs = jobs or os.cpu_count() or 1
+    if jobs <= 1 or len(todo) < 2 * jobs:
+        scanned = [scan_file(path) for path in todo]
+    else:
+        with multiprocessing.Pool(jobs) as pool:
+            scanned = pool.map(scan_file, todo, chunksize=max(1, len(todo) // (jobs * 8)))
+    for path, result in zip(todo, scanned):
+        results[path] = result
+        cache.put(path, stamps[path], result)
+
+    cache.prune(paths)
+    cache.save()
+    return results
+
+
+def write_if_changed(path, text):
+    # keeps mtime of unchanged outputs, so that with restat ninja doesn't rerun what depends on them
+    try:
+        with open(path) as f:
+            if f.read() == text:
+                return
+    except OSError:
+        pass
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def source_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def to_p1689(path, result):
+    # dependency info in the format of P1689 (what clang-scan-deps -format=p1689 writes), one rule per source
+    rule = {"primary-output": source_name(path) + ".o", "requires": []}
+    if result.module:
+        rule["provides"] = [{"logical-name": result.module, "is-interface": True}]
+    for module in result.imports:
+        rule["requires"].append({"logical-name": module})
+    for header in result.header_units:
+        rule["requires"].append({"logical-name": header[1:-1],
+                                 "lookup-method": "include-angle" if header.startswith("<") else "include-quote"})
+    return {"version": 1, "revision": 0, "rules": [rule]}
+
+
+def write_ddi(source, ddi_path):
+    write_if_changed(ddi_path, json.dumps(to_p1689(source, scan_file(source)), indent=2) + "\n")
+
+
+def collate(dyndep_path, ddi_paths):
+    # Turns per-source scan results into a ninja dyndep file, which adds .pcm files of imported modules as
+    # implicit inputs of both edges of every source, and a response file per source mapping every module it
+    # (transitively) imports to its .pcm. Every source produces <name>.pcm and <name>.o.
+    providers = {}
+    requires = {}
+    for ddi_path in ddi_paths:
+        name = source_name(ddi_path)
+        with open(ddi_path) as f:
+            rule = json.load(f)["rules"][0]
+        for provided in rule.get("provides", []):
+            providers[provided["logical-name"]] = name
+        requires[name] = [r["logical-name"] for r in rule["requires"] if "lookup-method" not in r]
+
+    deps = {}
+    for name, modules in requires.items():
+        deps[name] = []
+        for module in modules:
+            if module not in providers:
+                print("warning: {}.cpp imports {}, which no scanned file provides".format(name, module),
+                      file=sys.stderr)
+            elif providers[module] not in deps[name]:
+                deps[name].append(providers[module])
+
+    module_of = {name: module for module, name in providers.items()}
+    lines = ["ninja_dyndep_version = 1\n"]
+    for name in requires:
+        implicit = " ".join(dep + ".pcm" for dep in deps[name])
+        for output in (name + ".pcm", name + ".o"):
+            lines.append("build {}: dyndep{}\n".format(output, " | " + implicit if implicit else ""))
+        closure = []
+        stack = list(reversed(deps[name]))
+        while stack:
+            dep = stack.pop()
+            if dep not in closure and dep != name:
+                closure.append(dep)
+                stack.extend(reversed(deps[dep]))
+        write_if_changed(os.path.join(os.path.dirname(dyndep_path), name + ".modmap"),
+                         "".join("-fmodule-file={}={}.pcm\n".format(module_of[dep], dep) for dep in closure))
+    write_if_changed(dyndep_path, "".join(lines))
+
+
+def expand_response_files(args):
+    result = []
+    for arg in args:
+        if arg.startswith("@"):
+            with open(arg[1:]) as f:
+                result.extend(f.read().split())
+        else:
+            result.append(arg)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan C++ module units for provided and imported modules")
+    parser.add_argument("--ddi", help="scan a single source into a P1689 dependency file (build-time scan step)",
+                        nargs=2, metavar=("SOURCE", "DDI"))
+    parser.add_argument("--collate", help="collate dependency files into a ninja dyndep file and .modmap files",
+                        nargs="+", metavar=("DYNDEP", "DDI"))
+    parser.add_argument("sources", nargs="*")
+    args = parser.parse_args()
+
+    if args.ddi:
+        write_ddi(*args.ddi)
+    elif args.collate:
+        collate(args.collate[0], expand_response_files(args.collate[1:]))
+    else:
+        for path, result in sorted(scan_files(args.sources).items()):
+            print("{}: provides {}, imports {}{}".format(
+                path, result.module or "nothing", ", ".join(result.imports) or "nothing",
+                ", header units " + ", ".join(result.header_units) if result.header_units else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,19 +5,27 @@ import glob
 import os
 import sys
 
+import moduleScanner
+
 
 class NinjaFile:
     def __init__(self):
         self.rules = []
         self.build_edges = []
 
-    def add_rule(self, name, command):
+    def add_rule(self, name, command, **variables):
         self.rules.append("rule {}\n".format(name))
-        self.rules.append("  command = {}\n\n".format(command))
+        self.rules.append("  command = {}\n".format(command))
+        for key, value in variables.items():
+            self.rules.append("  {} = {}\n".format(key, value))
+        self.rules.append("\n")
 
-    def add_build_edge(self, rule, input, output, deps):
+    def add_build_edge(self, rule, input, output, deps, order_only=None, **variables):
         self.build_edges.append(
-            "build {}: {} {} {}\n".format(output, rule, input, "| " + " ".join(deps) if deps else ""))
+            "build {}: {} {} {}{}\n".format(output, rule, input, "| " + " ".join(deps) if deps else "",
+                                            " || " + " ".join(order_only) if order_only else ""))
+        for key, value in variables.items():
+            self.build_edges.append("  {} = {}\n".format(key, value))
 
     def write_to(self, filename):
         with open(filename, 'w+') as f:
@@ -41,26 +49,40 @@ def create_headers(path, compiler):
     return ninja_file
 
 
-def scan_deps(path, cpp_names):
+def scan_deps(path, cpp_names, jobs=None, use_cache=True):
+    # returns in/out deps between cpp names and the name of the .pcm each of them would produce
+    paths = [os.path.join(path, name + ".cpp") for name in cpp_names]
+    cache_path = os.path.join(path, moduleScanner.CACHE_NAME) if use_cache else None
+    scanned = moduleScanner.scan_files(paths, jobs, cache_path)
+
+    providers = {}
+    pcms = {}
+    for name, file in zip(cpp_names, paths):
+        module = scanned[file].module
+        if module:
+            providers[module] = name
+        pcms[name] = moduleScanner.pcm_name(module) if module else name + ".pcm"
+
     in_deps = {}
     out_deps = {}
-    for name in cpp_names:
-        if name not in out_deps:
-            out_deps[name] = []
-        with open(os.path.join(path, name + ".cpp")) as f:
-            for line in f.readlines():
-                if line.startswith("import"):
-                    dep_name = line.replace("import", "").replace(";", "").strip()
-                    if dep_name not in in_deps:
-                        in_deps[dep_name] = []
-                    in_deps[dep_name] += [name]
-                    out_deps[name] += [dep_name]
-    return in_deps, out_deps
-
-
-def create_modules(path, compiler, all_artifacts):
+    for name, file in zip(cpp_names, paths):
+        out_deps[name] = []
+        for imported in scanned[file].imports:
+            dep_name = providers.get(imported)
+            if dep_name is None:
+                print("warning: {}.cpp imports {}, which no scanned file provides".format(name, imported),
+                      file=sys.stderr)
+                continue
+            if dep_name not in in_deps:
+                in_deps[dep_name] = []
+            in_deps[dep_name] += [name]
+            out_deps[name] += [dep_name]
+    return in_deps, out_deps, pcms
+
+
+def create_modules(path, compiler, all_artifacts, jobs=None, use_scan_cache=True):
     cpp_names = find_module_names(path)
-    in_deps, out_deps = scan_deps(path, cpp_names)
+    in_deps, out_deps, pcms = scan_deps(path, cpp_names, jobs, use_scan_cache)
 
     ninja_file = NinjaFile()
     ninja_file.add_rule("cc", compiler + " -fmodules-ts -c -O0 $in -fprebuilt-module-path=. -o $out")
@@ -68,16 +90,47 @@ def create_modules(path, compiler, all_artifacts):
                                              "-Xclang -fmodules-codegen -Xclang -emit-module-interface "
                                              "-o $out")
     for name in cpp_names:
-        deps = [dep + ".pcm" for dep in out_deps[name]]
+        deps = [pcms[dep] for dep in out_deps[name]]
         has_in_deps = name in in_deps and in_deps[name]
         if all_artifacts or has_in_deps:
-            ninja_file.add_build_edge("cc-pcm", name + ".cpp", name + ".pcm", deps)
+            ninja_file.add_build_edge("cc-pcm", name + ".cpp", pcms[name], deps)
         if all_artifacts or not has_in_deps:
             ninja_file.add_build_edge("cc", name + ".cpp", name + ".o", deps)
 
     return ninja_file
 
 
+def create_modules_dyndep(path, compiler):
+    # Module dependencies are discovered during the build (P1689-style): every source has a scan edge writing its
+    # .ddi, a single collate edge turns them into a dyndep file and a .modmap per source, which maps imported
+    # modules to .pcm files. Scan and collate outputs are only rewritten when they change (restat), so changing one
+    # source rescans only that source and recompiles only what depends on it.
+    # Which modules are imported isn't known here, so both .pcm and .o are built for every source.
+    cpp_names = find_module_names(path)
+    scanner = "{} {}".format(sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                          "moduleScanner.py"))
+
+    ninja_file = NinjaFile()
+    ninja_file.add_rule("scan", scanner + " --ddi $in $out", restat="1", description="SCAN $in")
+    ninja_file.add_rule("collate", scanner + " --collate $out @$out.rsp", restat="1", rspfile="$out.rsp",
+                        rspfile_content="$in", description="COLLATE $out")
+    ninja_file.add_rule("cc", compiler + " -fmodules-ts -c -O0 $in -fprebuilt-module-path=. @$modmap -o $out")
+    ninja_file.add_rule("cc-pcm", compiler + " -fmodules-ts -c -O0 $in -fprebuilt-module-path=. @$modmap "
+                                             "-Xclang -fmodules-codegen -Xclang -emit-module-interface "
+                                             "-o $out")
+    for name in cpp_names:
+        ninja_file.add_build_edge("scan", name + ".cpp", name + ".ddi", None)
+    modmaps = [name + ".modmap" for name in cpp_names]
+    ninja_file.add_build_edge("collate", " ".join(name + ".ddi" for name in cpp_names),
+                              "modules.dd | " + " ".join(modmaps), None)
+    for name in cpp_names:
+        for rule, output in (("cc-pcm", name + ".pcm"), ("cc", name + ".o")):
+            ninja_file.add_build_edge(rule, name + ".cpp", output, [name + ".modmap"], ["modules.dd"],
+                                      dyndep="modules.dd", modmap=name + ".modmap")
+
+    return ninja_file
+
+
 def main():
     parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter, description="""
 Generate ninja build files for simple header-based or module-based bunch of files.
@@ -86,19 +139,26 @@ Assumptions:
   - All files are named *.cpp or *.h and are placed in the working directory
   - Module names match header names
   - clang with modules-ts support is used
-  - Module dependency scanning is performing by looking at `import <name>;` declarations
+  - Module dependency scanning is performing by looking at module and import declarations in module preambles
     """)
     parser.add_argument('--headers', help='Path to header-based sources')
     parser.add_argument('--modules', help='Path to module-based sources')
     parser.add_argument('--compiler', help='Path to the compiler', required=True)
     parser.add_argument('--all-artifacts', help='Build .o for intermediate modules', default=False, action='store_true')
+    parser.add_argument('--jobs', help='Number of processes scanning module sources', type=int)
+    parser.add_argument('--dyndep', help='Discover module dependencies during the build with ninja dyndep files '
+                                         '(implies --all-artifacts)', default=False, action='store_true')
+    parser.add_argument('--no-scan-cache', help='Rescan all module sources instead of only changed ones',
+                        default=False, action='store_true')
     args = parser.parse_args()
 
     if args.headers:
         create_headers(args.headers, args.compiler).write_to(os.path.join(args.headers, 'build.ninja'))
 
-    if args.modules:
-        create_modules(args.modules, args.compiler, args.all_artifacts).write_to(
+    if args.modules and args.dyndep:
+        create_modules_dyndep(args.modules, args.compiler).write_to(os.path.join(args.modules, 'build.ninja'))
+    elif args.modules:
+        create_modules(args.modules, args.compiler, args.all_artifacts, args.jobs, not args.no_scan_cache).write_to(
             os.path.join(args.modules, 'build.ninja'))
 
 
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# Generates equivalent header-based and module-based synthetic projects for naive-generator.py, and optionally
+# builds both of them at several -j values to compare how they scale.
+
+import argparse
+import importlib.util
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import namedtuple
+
+ProjectParams = namedtuple("ProjectParams", ["modules", "depth", "fan_out", "fan_in", "functions", "templates",
+                                             "seed"])
+
+
+def load_naive_generator():
+    # naive-generator.py can't be imported by name
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "naive-generator.py")
+    spec = importlib.util.spec_from_file_location("naive_generator", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def module_dag(params):
+    # Modules are spread over depth layers, layer 0 is the top (nothing imports it). Every module imports up to
+    # fan_out modules from deeper layers, mostly the next one, and no module is imported by more than fan_in others.
+    rng = random.Random(params.seed)
+    layers = [[] for _ in range(params.depth)]
+    for i in range(params.modules):
+        layers[i * params.depth // params.modules].append(i)
+    importers = [0] * params.modules
+    deps = [[] for _ in range(params.modules)]
+    for layer in range(params.depth - 1):
+        for i in layers[layer]:
+            candidates = [m for m in layers[layer + 1] if importers[m] < params.fan_in]
+            deeper = [m for below in layers[layer + 2:] for m in below if importers[m] < params.fan_in]
+            rng.shuffle(candidates)
+            rng.shuffle(deeper)
+            for dep in (candidates + deeper)[:params.fan_out]:
+                deps[i].append(dep)
+                importers[dep] += 1
+    return deps
+
+
+def namespace_body(i, deps, params):
+    # the same code in both variants: class templates, inline functions and instantiations of templates of deps
+    lines = [
+        "template <typename T, int N> struct Box {",
+        "  T values[N] = {};",
+        "  constexpr T sum() const { T s{}; for (int k = 0; k < N; ++k) s += values[k] + T(k); return s; }",
+        "};",
+        # no explicit specialization to end the recursion, those can't be exported from a module
+        "template <int N> constexpr long chain() {",
+        "  if constexpr (N == 0) return {}; else return chain<N - 1>() * 3 % 1000003 + N;".format(i),
+        "}",
+    ]
+    for f in range(params.functions):
+        calls = " + ".join("m{}::f{}(x)".format(dep, f % params.functions) for dep in deps[:2]) or "0"
+        lines += [
+            "inline long f{}(long x) {{".format(f),
+            "  long r = x * {} + {};".format(f + 1, i),
+            "  for (int k = 0; k < {}; ++k) r = (r * 31 + k) % 1000003;".format(f % 7 + 1),
+            "  return r + {};".format(calls),
+            "}",
+        ]
+    for t in range(params.templates):
+        lines.append("inline long t{}() {{ return Box<long, {}>{{}}.sum() + chain<{}>(); }}".format(
+            t, t + 1, t + 10))
+    # instantiations of templates of the deps happen in the importer, in both variants
+    uses = ["Box<int, {}>{{}}.sum()".format(t + 100 + i) for t in range(params.templates)]
+    uses += ["m{}::Box<long, {}>{{}}.sum()".format(dep, i + 200) for dep in deps]
+    lines.append("inline long use_templates() {{ return {}; }}".format(" + ".join(uses) or "0"))
+    return lines
+
+
+def entry_body(deps, params):
+    calls = " + ".join(["f0(x)" if params.functions else "x", "use_templates()"] +
+                       ["m{}::entry(x)".format(dep) for dep in deps])
+    return "long entry(long x) {{ return {}; }}".format(calls)
+
+
+def write_if_changed(path, text):
+    # keeps timestamps of unchanged files, so that regenerating doesn't force a full rebuild
+    if os.path.isfile(path):
+        with open(path) as f:
+            if f.read() == text:
+                return
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def write_header_project(path, deps, params):
+    os.makedirs(path, exist_ok=True)
+    for i in range(params.modules):
+        includes = ["#include \"m{}.h\"".format(dep) for dep in deps[i]]
+        header = ["#pragma once"] + includes + ["namespace m{} {{".format(i)] + namespace_body(i, deps[i], params) + \
+                 ["long entry(long x);", "}"]
+        source = ["#include \"m{}.h\"".format(i), "namespace m{} {{".format(i), entry_body(deps[i], params), "}"]
+        write_if_changed(os.path.join(path, "m{}.h".format(i)), "\n".join(header) + "\n")
+        write_if_changed(os.path.join(path, "m{}.cpp".format(i)), "\n".join(source) + "\n")
+
+
+def write_module_project(path, deps, params):
+    os.makedirs(path, exist_ok=True)
+    for i in range(params.modules):
+        imports = ["import m{};".format(dep) for dep in deps[i]]
+        unit = ["export module m{};".format(i)] + imports + ["export namespace m{} {{".format(i)] + \
+               namespace_body(i, deps[i], params) + [entry_body(deps[i], params), "}"]
+        write_if_changed(os.path.join(path, "m{}.cpp".format(i)), "\n".join(unit) + "\n")
+
+
+def generate(path, params):
+    deps = module_dag(params)
+    write_header_project(os.path.join(path, "headers"), deps, params)
+    write_module_project(os.path.join(path, "modules"), deps, params)
+    return deps
+
+
+def time_build(path, parallelism):
+    subprocess.check_call(["ninja", "-t", "clean"], cwd=path, stdout=subprocess.DEVNULL)
+    start_time = time.time()
+    subprocess.check_call(["ninja", "-j{}".format(parallelism)], cwd=path, stdout=subprocess.DEVNULL)
+    return time.time() - start_time
+
+
+def measure(path, compiler, parallelisms, all_artifacts):
+    naive_generator = load_naive_generator()
+    headers_path = os.path.join(path, "headers")
+    modules_path = os.path.join(path, "modules")
+    naive_generator.create_headers(headers_path, compiler).write_to(os.path.join(headers_path, "build.ninja"))
+    naive_generator.create_modules(modules_path, compiler, all_artifacts).write_to(
+        os.path.join(modules_path, "build.ninja"))
+
+    print("{:>5} {:>10} {:>10} {:>8}".format("-j", "headers", "modules", "ratio"))
+    results = []
+    for parallelism in parallelisms:
+        headers_time = time_build(headers_path, parallelism)
+        modules_time = time_build(modules_path, parallelism)
+        results.append((parallelism, headers_time, modules_time))
+        print("{:>5} {:>9.2f}s {:>9.2f}s {:>7.2f}x".format(parallelism, headers_time, modules_time,
+                                                           headers_time / modules_time if modules_time else 0.))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="""
+Generate equivalent header-based (<output>/headers) and module-based (<output>/modules) synthetic projects.
+With --compiler both are also built with naive-generator.py scripts at every -j value of --jobs.
+    """)
+    parser.add_argument("output", help="directory to generate projects in")
+    parser.add_argument("--modules", help="number of modules (headers)", type=int, default=100)
+    parser.add_argument("--depth", help="number of layers of the import DAG", type=int, default=5)
+    parser.add_argument("--fan-out", help="max modules imported by a module", type=int, default=3)
+    parser.add_argument("--fan-in", help="max modules importing a module", type=int, default=10)
+    parser.add_argument("--functions", help="inline functions per module", type=int, default=20)
+    parser.add_argument("--templates", help="template instantiations per module", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compiler", help="build both projects with this clang and report times")
+    parser.add_argument("--jobs", help="comma-separated -j values to build with", default=str(os.cpu_count() or 1))
+    parser.add_argument("--all-artifacts", help="build .o for intermediate modules", default=False,
+                        action="store_true")
+    args = parser.parse_args()
+
+    params = ProjectParams(args.modules, max(1, args.depth), args.fan_out, args.fan_in, args.functions,
+                           args.templates, args.seed)
+    deps = generate(args.output, params)
+    print("generated {} modules with {} imports in {}".format(params.modules, sum(len(d) for d in deps),
+                                                               args.output))
+    if args.compiler:
+        measure(args.output, args.compiler, [int(j) for j in args.jobs.split(",")], args.all_artifacts)
+
+
+if __name__ == "__main__":
+    main()